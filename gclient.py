@@ -16,6 +16,13 @@
 #   .gclient_entries : A cache constructed by 'update' command.  Format is a
 #                   Python script defining 'entries', a list of the names
 #                   of all modules in the client
+#   .gclient_deps_cache : A cache of the parsed DEPS files, keyed by their
+#                   contents and variables, so unchanged DEPS files aren't
+#                   evaluated again.
+#   .gclient_timings : A JSON file constructed by 'update' command recording
+#                   how long each module took to fetch, checkout, parse and
+#                   run hooks over the last syncs. It is used to start the
+#                   slowest modules first, and reported by 'sync --timings'.
 #   <module>/DEPS : Python script defining var 'deps' as a map from each
 #                   requisite submodule name to a URL where it can be found (via
 #                   one SCM)
@@ -45,6 +52,17 @@
 #                will be extended by the list of matching files.
 #     "name"     An optional string specifying the group to which a hook belongs
 #                for overriding and organizing.
+#     "depends_on" An optional list of names of hooks that must run before this
+#                one. Hooks declaring "depends_on" or "resources" may run
+#                concurrently (up to --jobs); other hooks wait for all the
+#                hooks before them.
+#     "resources" An optional list of strings. Hooks sharing a resource never
+#                run at the same time.
+#     "inputs"   An optional list of files or directories, relative to the
+#                hook's cwd. If present, the hook is skipped when its inputs,
+#                action, cwd and variables are unchanged since it last
+#                succeeded, as recorded in .gclient_hooks_cache/. Use
+#                --force-hooks to run it anyway.
 #
 #   Example:
 #     hooks = [
@@ -86,6 +104,7 @@ __version__ = '0.7'
 
 import collections
 import copy
+import hashlib
 import json
 import logging
 import optparse
@@ -107,6 +126,7 @@ import fix_encoding
 import gclient_eval
 import gclient_scm
 import gclient_paths
+import gclient_timings
 import gclient_utils
 import git_cache
 import metrics
@@ -115,6 +135,7 @@ from third_party.repo.progress import Progress
 import subcommand
 import subprocess2
 import setup_color
+import trace_events
 
 from third_party import six
 
@@ -177,7 +198,8 @@ class Hook(object):
   """Descriptor of command ran before/after sync or on demand."""
 
   def __init__(self, action, pattern=None, name=None, cwd=None, condition=None,
-               variables=None, verbose=False, cwd_base=None):
+               variables=None, verbose=False, cwd_base=None, depends_on=None,
+               resources=None, inputs=None):
     """Constructor.
 
     Arguments:
@@ -187,6 +209,9 @@ class Hook(object):
       cwd (basestring): working directory to use
       condition (basestring): condition when to run the hook
       variables (dict): variables for evaluating the condition
+      depends_on (list of basestring): names of hooks to run before this one
+      resources (list of basestring): resources this hook can't share
+      inputs (list of basestring): files the result of the hook depends on
     """
     self._action = gclient_utils.freeze(action)
     self._pattern = pattern
@@ -196,6 +221,9 @@ class Hook(object):
     self._variables = variables
     self._verbose = verbose
     self._cwd_base = cwd_base
+    self._depends_on = depends_on
+    self._resources = resources
+    self._inputs = inputs
 
   @staticmethod
   def from_dict(d, variables=None, verbose=False, conditions=None,
@@ -212,7 +240,10 @@ class Hook(object):
         variables=variables,
         # Always print the header if not printing to a TTY.
         verbose=verbose or not setup_color.IS_TTY,
-        cwd_base=cwd_base)
+        cwd_base=cwd_base,
+        depends_on=d.get('depends_on'),
+        resources=d.get('resources'),
+        inputs=d.get('inputs'))
 
   @property
   def action(self):
@@ -230,6 +261,27 @@ class Hook(object):
   def condition(self):
     return self._condition
 
+  @property
+  def depends_on(self):
+    return self._depends_on
+
+  @property
+  def resources(self):
+    return self._resources
+
+  @property
+  def inputs(self):
+    return self._inputs
+
+  @property
+  def variables(self):
+    return self._variables
+
+  @property
+  def can_run_concurrently(self):
+    """Whether this hook declared what it must not run concurrently with."""
+    return self._depends_on is not None or self._resources is not None
+
   @property
   def effective_cwd(self):
     cwd = self._cwd_base
@@ -244,8 +296,12 @@ class Hook(object):
     pattern = re.compile(self._pattern)
     return bool([f for f in file_list if pattern.search(f)])
 
-  def run(self):
-    """Executes the hook's command (provided the condition is met)."""
+  def run(self, out_fh=None):
+    """Executes the hook's command (provided the condition is met).
+
+    If out_fh is given, the output is written to it instead of stdout and a
+    failure raises instead of exiting, so that the hook can run in a worker.
+    """
     if (self._condition and
         not gclient_eval.EvaluateCondition(self._condition, self._variables)):
       return
@@ -259,10 +315,18 @@ class Hook(object):
 
     try:
       start_time = time.time()
-      gclient_utils.CheckCallAndFilter(
-          cmd, cwd=self.effective_cwd, print_stdout=True, show_header=True,
-          always_show_header=self._verbose)
+      if out_fh:
+        gclient_utils.CheckCallAndFilter(
+            cmd, cwd=self.effective_cwd, show_header=True,
+            always_show_header=True,
+            filter_fn=lambda line: out_fh.write(line.rstrip('\n') + '\n'))
+      else:
+        gclient_utils.CheckCallAndFilter(
+            cmd, cwd=self.effective_cwd, print_stdout=True, show_header=True,
+            always_show_header=self._verbose)
     except (gclient_utils.Error, subprocess2.CalledProcessError) as e:
+      if out_fh:
+        raise
       # Use a discrete exit status code of 2 to indicate that a hook action
       # failed.  Users of this script may wish to treat hook action failures
       # differently from VC failures.
@@ -272,7 +336,97 @@ class Hook(object):
       elapsed_time = time.time() - start_time
       if elapsed_time > 10:
         print("Hook '%s' took %.2f secs" % (
-            gclient_utils.CommandToStr(cmd), elapsed_time))
+            gclient_utils.CommandToStr(cmd), elapsed_time), file=out_fh)
+
+
+class HookCache(object):
+  """Records the inputs of the hooks that last succeeded.
+
+  Only hooks declaring "inputs" are cached. For each of them a stamp file in
+  .gclient_hooks_cache/ holds a hash of its action, cwd, variables and the
+  contents of its inputs.
+  """
+
+  DIRNAME = '.gclient_hooks_cache'
+
+  def __init__(self, root_dir, force=False):
+    self._cache_dir = os.path.join(root_dir, self.DIRNAME)
+    self._force = force
+
+  def _stamp_path(self, hook):
+    identity = json.dumps([hook.name, list(hook.action), hook.effective_cwd])
+    return os.path.join(
+        self._cache_dir, hashlib.sha1(identity.encode('utf-8')).hexdigest())
+
+  @staticmethod
+  def _hash_input(digest, path):
+    if os.path.isdir(path):
+      for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+          HookCache._hash_input(digest, os.path.join(dirpath, filename))
+      return
+    digest.update(path.encode('utf-8') + b'\0')
+    if not os.path.isfile(path):
+      digest.update(b'<missing>\0')
+      return
+    with open(path, 'rb') as f:
+      for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        digest.update(chunk)
+    digest.update(b'\0')
+
+  def _key(self, hook):
+    digest = hashlib.sha1()
+    variables = sorted((k, str(v)) for k, v in (hook.variables or {}).items())
+    digest.update(json.dumps([
+        list(hook.action), hook.effective_cwd, hook.condition, variables,
+    ]).encode('utf-8'))
+    for path in hook.inputs:
+      self._hash_input(digest, os.path.join(hook.effective_cwd, path))
+    return digest.hexdigest()
+
+  def is_up_to_date(self, hook):
+    """Returns True if the hook can be skipped."""
+    if self._force or hook.inputs is None:
+      return False
+    path = self._stamp_path(hook)
+    if not os.path.exists(path):
+      return False
+    return gclient_utils.FileRead(path).strip() == self._key(hook)
+
+  def update(self, hook):
+    """Records that the hook succeeded with its current inputs."""
+    if hook.inputs is None:
+      return
+    gclient_utils.safe_makedirs(self._cache_dir)
+    gclient_utils.FileWrite(self._stamp_path(hook), self._key(hook))
+
+
+class HookWorkItem(gclient_utils.WorkItem):
+  """Runs a Hook in an ExecutionQueue."""
+
+  def __init__(self, name, hook, requirements, owner=None, cache=None):
+    gclient_utils.WorkItem.__init__(self, name)
+    self.hook = hook
+    self.requirements = tuple(requirements)
+    self.resources = list(hook.resources or [])
+    # The Dependency declaring the hook, whose timings are updated.
+    self.owner = owner
+    self.cache = cache
+
+  # Arguments number differs from overridden method
+  # pylint: disable=arguments-differ
+  def run(self, work_queue):
+    if self.cache and self.cache.is_up_to_date(self.hook):
+      print('Skipping hook %r, its inputs are unchanged.' % self.name,
+            file=self.outbuf)
+      return
+    start = time.time()
+    self.hook.run(out_fh=self.outbuf)
+    if self.owner is not None:
+      self.owner.add_timing('hooks', time.time() - start)
+    if self.cache:
+      self.cache.update(self.hook)
 
 
 class DependencySettings(object):
@@ -439,6 +593,8 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     # The actual revision we ended up getting, or None if that information is
     # unavailable
     self._got_revision = None
+    # Seconds spent in each of gclient_timings.PHASES.
+    self._timings = {}
 
     # recursedeps is a mutable value that selectively overrides the default
     # 'no recursion' setting on a dep-by-dep basis.
@@ -719,8 +875,10 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
 
     local_scope = {}
     if deps_content:
+      parse_cache = self.GetDepsParseCache()
+      parse = parse_cache.Parse if parse_cache else gclient_eval.Parse
       try:
-        local_scope = gclient_eval.Parse(
+        local_scope = parse(
             deps_content, filepath, self.get_vars(), self.get_builtin_vars())
       except SyntaxError as e:
         gclient_utils.SyntaxErrorToError(filepath, e)
@@ -933,6 +1091,7 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
       options.revision = revision_override
       self._used_revision = options.revision
       self._used_scm = self.CreateSCM(out_cb=work_queue.out_cb)
+      scm_start = time.time()
       self._got_revision = self._used_scm.RunCommand(command, options, args,
                                                      file_list)
 
@@ -943,6 +1102,10 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
       if command == 'update' and patch_ref is not None:
         self._used_scm.apply_patch_ref(patch_repo, patch_ref, target_branch,
                                        options, file_list)
+      fetch_time = self._used_scm.timings.get('fetch', 0)
+      self._timings['fetch'] = fetch_time
+      self._timings['checkout'] = time.time() - scm_start - fetch_time
+      self._timings['fetch_bytes'] = self._used_scm.fetched_bytes
 
       if file_list:
         file_list = [os.path.join(self.name, f.strip()) for f in file_list]
@@ -961,7 +1124,9 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
           file_list[i] = file_list[i][1:]
 
     if self.should_recurse:
+      parse_start = time.time()
       self.ParseDepsFile()
+      self._timings['parse'] = time.time() - parse_start
 
     self._run_is_done(file_list or [])
 
@@ -1079,15 +1244,69 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     assert self.hooks_ran == False
     self._hooks_ran = True
     hooks = self.GetHooks(options)
+    owners = {}
+    for d in [self] + list(self.subtree(False)):
+      for hook in d.deps_hooks:
+        owners[id(hook)] = d
+    cache = HookCache(self.root.root_dir,
+                      force=getattr(options, 'force_hooks', False))
+    if any(hook.can_run_concurrently for hook in hooks):
+      self._RunHooksConcurrently(hooks, owners, cache, options, progress)
+      return
     if progress:
       progress._total = len(hooks)
     for hook in hooks:
       if progress:
         progress.update(extra=hook.name or '')
+      if cache.is_up_to_date(hook):
+        print('Skipping hook %r, its inputs are unchanged.' % (
+            hook.name or gclient_utils.CommandToStr(hook.action)))
+        continue
+      hook_start = time.time()
       hook.run()
+      owner = owners.get(id(hook))
+      if owner is not None:
+        owner.add_timing('hooks', time.time() - hook_start)
+      cache.update(hook)
     if progress:
       progress.end()
 
+  def _RunHooksConcurrently(self, hooks, owners, cache, options, progress):
+    """Runs hooks in parallel, up to options.jobs at a time.
+
+    A hook declaring 'depends_on' or 'resources' waits only for the earlier
+    hooks named in its 'depends_on'. Any other hook waits for all the hooks
+    before it. The output of each hook is printed once it completes.
+    """
+    work_queue = gclient_utils.ExecutionQueue(
+        options.jobs, progress, ignore_requirements=False, verbose=True)
+    item_names = []
+    items_by_hook_name = collections.defaultdict(list)
+    for hook in hooks:
+      name = hook.name or gclient_utils.CommandToStr(hook.action)
+      if name in item_names:
+        name = '%s (%d)' % (name, len(item_names) + 1)
+      if not hook.can_run_concurrently:
+        requirements = list(item_names)
+      else:
+        requirements = []
+        for dep_name in hook.depends_on or []:
+          if dep_name not in items_by_hook_name:
+            logging.warning('Hook %r depends on %r, which is not a preceding '
+                            'hook; ignoring.', name, dep_name)
+          requirements.extend(items_by_hook_name.get(dep_name, []))
+      work_queue.enqueue(
+          HookWorkItem(name, hook, requirements, owners.get(id(hook)), cache))
+      item_names.append(name)
+      if hook.name:
+        items_by_hook_name[hook.name].append(name)
+    try:
+      work_queue.flush()
+    except (gclient_utils.Error, subprocess2.CalledProcessError) as e:
+      # Same exit status as Hook.run() when hooks run one at a time.
+      print('Error: %s' % str(e), file=sys.stderr)
+      sys.exit(2)
+
   def RunPreDepsHooks(self):
     assert self.processed
     assert self.deps_parsed
@@ -1106,6 +1325,11 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
       return None
     return self.root.GetCipdRoot()
 
+  def GetDepsParseCache(self):
+    if self.root is self:
+      return None
+    return self.root.GetDepsParseCache()
+
   def subtree(self, include_all):
     """Breadth first recursion excluding root node."""
     dependencies = self.dependencies
@@ -1176,6 +1400,16 @@ class Dependency(gclient_utils.WorkItem, DependencySettings):
     """SCMWrapper instance for this dependency or None if not processed yet."""
     return self._used_scm
 
+  @property
+  @gclient_utils.lockedmethod
+  def timings(self):
+    """Seconds spent in each of gclient_timings.PHASES by this dependency."""
+    return dict(self._timings)
+
+  @gclient_utils.lockedmethod
+  def add_timing(self, phase, seconds):
+    self._timings[phase] = self._timings.get(phase, 0) + seconds
+
   @property
   @gclient_utils.lockedmethod
   def got_revision(self):
@@ -1377,6 +1611,7 @@ solutions = %(solution_list)s
     self._enforced_cpu = detect_host_arch.HostArch(),
     self._root_dir = root_dir
     self._cipd_root = None
+    self._deps_parse_cache = None
     self.config_content = None
 
   def _CheckConfig(self):
@@ -1574,6 +1809,25 @@ it or fix the checkout.
       gclient_utils.SyntaxErrorToError(filename, e)
     return scope.get('entries', {})
 
+  def _GetTimingStore(self):
+    """Returns the gclient_timings.TimingStore of the .gclient_timings file.
+
+    The .gclient_timings file lives in the same directory as .gclient.
+    """
+    return gclient_timings.TimingStore(
+        os.path.join(self.root_dir, self._options.timings_filename))
+
+  def _SaveTimings(self, store, durations):
+    """Records the timings of this sync in the .gclient_timings file."""
+    deps = {}
+    for name, (duration, requirements) in durations.items():
+      deps[name] = {'total': duration, 'requirements': list(requirements)}
+    for d in self.subtree(False):
+      if d.name in deps:
+        deps[d.name].update(d.timings)
+    store.add_run(deps)
+    store.save()
+
   def _EnforceRevisions(self):
     """Checks for revision overrides."""
     revision_overrides = {}
@@ -1757,14 +2011,20 @@ it or fix the checkout.
         pm = Progress('Syncing projects', 1)
       elif command in ('recurse', 'validate'):
         pm = Progress(' '.join(args), 1)
+    timing_store = None
+    priorities = None
+    if command == 'update':
+      timing_store = self._GetTimingStore()
+      priorities = timing_store.priorities()
     work_queue = gclient_utils.ExecutionQueue(
         self._options.jobs, pm, ignore_requirements=ignore_requirements,
-        verbose=self._options.verbose)
+        verbose=self._options.verbose, priorities=priorities)
     for s in self.dependencies:
       if s.should_process:
         work_queue.enqueue(s)
     work_queue.flush(revision_overrides, command, args, options=self._options,
                      patch_refs=patch_refs, target_branches=target_branches)
+    self._SaveDepsParseCache()
 
     if revision_overrides:
       print('Please fix your script, having invalid --revision flags will soon '
@@ -1800,6 +2060,8 @@ it or fix the checkout.
         pm = Progress('Running hooks', 1)
       self.RunHooksRecursively(self._options, pm)
 
+    if timing_store:
+      self._SaveTimings(timing_store, work_queue.durations)
 
     return 0
 
@@ -1814,6 +2076,7 @@ it or fix the checkout.
         work_queue.enqueue(s)
     work_queue.flush({}, None, [], options=self._options, patch_refs=None,
                      target_branches=None)
+    self._SaveDepsParseCache()
 
     def ShouldPrintRevision(dep):
       return (not self._options.filter
@@ -1875,6 +2138,116 @@ it or fix the checkout.
           print('%s: %s' % (x, entries[x]))
     logging.info(str(self))
 
+  def PlanSync(self):
+    """Computes what 'sync' would do to each dependency, without doing it.
+
+    The tree is built from the DEPS files already on disk, so dependencies of
+    dependencies that aren't checked out yet are not listed. Revisions that
+    aren't full hashes are resolved in the git cache mirror if there is one,
+    or with 'git ls-remote' otherwise. Estimates come from the timings of the
+    last sync.
+
+    Returns:
+      A dict with a 'deps' dict of dependency name to a dict describing the
+      'action' ('clone', 'fetch', 'checkout', 'skip' or 'cipd'), 'url',
+      'revision', 'resolved_revision', 'current_revision',
+      'estimated_seconds' and 'estimated_bytes', as well as the sums of the
+      known estimates.
+    """
+    if not self.dependencies:
+      raise gclient_utils.Error('No solution specified')
+    revision_overrides = self._EnforceRevisions()
+    # Load the whole tree without touching the checkouts, like revinfo.
+    work_queue = gclient_utils.ExecutionQueue(
+        self._options.jobs, None, False, verbose=self._options.verbose)
+    for s in self.dependencies:
+      if s.should_process:
+        work_queue.enqueue(s)
+    work_queue.flush({}, None, [], options=self._options, patch_refs=None,
+                     target_branches=None)
+    self._SaveDepsParseCache()
+
+    history = self._GetTimingStore().latest
+    deps = {}
+    for d in self.subtree(False):
+      url, revision = gclient_utils.SplitUrlRevision(d.url or '')
+      override = revision_overrides.get(d.FuzzyMatchUrl(revision_overrides))
+      entry = {
+          'url': url or None,
+          'revision': override or revision,
+          'current_revision': None,
+          'estimated_seconds': None,
+          'estimated_bytes': None,
+      }
+      deps[d.name] = entry
+      if not d.should_process or not d.url:
+        entry['action'] = 'skip'
+        continue
+      if d.GetScmName() == 'cipd':
+        entry['action'] = 'cipd'
+        continue
+      entry.update(self._PlanGitDependency(d, entry['revision']))
+      past = history.get(d.name, {})
+      if entry['action'] in ('clone', 'fetch'):
+        entry['estimated_seconds'] = (
+            past.get('fetch', 0) + past.get('checkout', 0) if past else None)
+        entry['estimated_bytes'] = past.get('fetch_bytes')
+      elif entry['action'] == 'checkout':
+        entry['estimated_seconds'] = past.get('checkout')
+        entry['estimated_bytes'] = 0
+      else:
+        entry['estimated_seconds'] = 0
+        entry['estimated_bytes'] = 0
+
+    return {
+        'deps': deps,
+        'estimated_seconds': sum(
+            e['estimated_seconds'] or 0 for e in deps.values()),
+        'estimated_bytes': sum(
+            e['estimated_bytes'] or 0 for e in deps.values()),
+    }
+
+  def _PlanGitDependency(self, dep, revision):
+    """Returns the planned 'action' and the revisions of a git dependency."""
+    scm_wrapper = dep.CreateSCM()
+    git = gclient_scm.scm.GIT
+    mirror = scm_wrapper.GetCacheMirror()
+    if mirror and not mirror.exists():
+      mirror = None
+
+    resolved = revision
+    if not gclient_utils.IsFullGitSha(revision or ''):
+      try:
+        if mirror:
+          resolved = git.Capture(
+              ['rev-parse', '--verify', '%s^{commit}' % (revision or 'HEAD')],
+              cwd=mirror.mirror_path)
+        else:
+          ref = revision or 'HEAD'
+          output = git.Capture(
+              ['ls-remote', scm_wrapper.url, ref], cwd=self.root_dir)
+          resolved = output.split()[0] if output else None
+      except subprocess2.CalledProcessError:
+        resolved = None
+
+    plan = {'resolved_revision': resolved}
+    checkout_path = scm_wrapper.checkout_path
+    if not os.path.isdir(os.path.join(checkout_path, '.git')):
+      plan['action'] = 'clone'
+      return plan
+    try:
+      plan['current_revision'] = git.Capture(
+          ['rev-parse', 'HEAD'], cwd=checkout_path)
+    except subprocess2.CalledProcessError:
+      pass
+    if resolved and resolved == plan.get('current_revision'):
+      plan['action'] = 'skip'
+    elif resolved and git.IsValidRevision(checkout_path, resolved):
+      plan['action'] = 'checkout'
+    else:
+      plan['action'] = 'fetch'
+    return plan
+
   def ParseDepsFile(self):
     """No DEPS to parse for a .gclient file."""
     raise gclient_utils.Error('Internal error')
@@ -1896,6 +2269,17 @@ it or fix the checkout.
           'https://chrome-infra-packages.appspot.com')
     return self._cipd_root
 
+  @gclient_utils.lockedmethod
+  def GetDepsParseCache(self):
+    if not self._deps_parse_cache:
+      self._deps_parse_cache = gclient_eval.ParseCache(
+          os.path.join(self.root_dir, self._options.deps_cache_filename))
+    return self._deps_parse_cache
+
+  def _SaveDepsParseCache(self):
+    if self._deps_parse_cache:
+      self._deps_parse_cache.Save()
+
   @property
   def root_dir(self):
     """Root directory of gclient checkout."""
@@ -2355,6 +2739,12 @@ def _HooksToLines(name, hooks):
       s.append('    "pattern": "%s",' % hook.pattern)
     if hook.condition is not None:
       s.append('    "condition": %r,' % hook.condition)
+    if hook.depends_on is not None:
+      s.append('    "depends_on": %s,' % json.dumps(list(hook.depends_on)))
+    if hook.resources is not None:
+      s.append('    "resources": %s,' % json.dumps(list(hook.resources)))
+    if hook.inputs is not None:
+      s.append('    "inputs": %s,' % json.dumps(list(hook.inputs)))
     # Flattened hooks need to be written relative to the root gclient dir
     cwd = os.path.relpath(os.path.normpath(hook.effective_cwd))
     s.extend(
@@ -2708,6 +3098,18 @@ def CMDsync(parser, args):
   parser.add_option('--no-reset-patch-ref', action='store_false',
                     dest='reset_patch_ref', default=True,
                     help='Bypass calling reset after patching the ref.')
+  parser.add_option('--force-hooks', action='store_true',
+                    help='Run the hooks declaring "inputs" even if their '
+                         'inputs are unchanged since they last succeeded.')
+  parser.add_option('--dry-run-plan', action='store_true',
+                    help='Don\'t sync. Print, as JSON, whether each '
+                         'dependency would be cloned, fetched, checked out or '
+                         'skipped, with the time and bytes it took last time.')
+  parser.add_option('--timings', action='store_true',
+                    help='Print the slowest dependencies of this sync, with '
+                         'the time they spent fetching, checking out, parsing '
+                         'DEPS and running hooks, and how it compares to '
+                         'previous syncs.')
   (options, args) = parser.parse_args(args)
   client = GClient.LoadCurrentConfig(options)
 
@@ -2718,6 +3120,10 @@ def CMDsync(parser, args):
     # TODO(maruel): Make it a parser.error if it doesn't break any builder.
     print('Warning: you cannot use both --head and --revision')
 
+  if options.dry_run_plan:
+    print(json.dumps(client.PlanSync(), indent=2, sort_keys=True))
+    return 0
+
   if options.verbose:
     client.PrintLocationAndContents()
   ret = client.RunOnDeps('update', args)
@@ -2733,6 +3139,8 @@ def CMDsync(parser, args):
       }
     with open(options.output_json, 'w') as f:
       json.dump({'solutions': slns}, f)
+  if options.timings:
+    print('\n'.join(client._GetTimingStore().report()))
   return ret
 
 
@@ -2810,6 +3218,9 @@ def CMDrunhooks(parser, args):
                          'references')
   parser.add_option('-f', '--force', action='store_true', default=True,
                     help='Deprecated. No effect.')
+  parser.add_option('--force-hooks', action='store_true',
+                    help='Run the hooks declaring "inputs" even if their '
+                         'inputs are unchanged since they last succeeded.')
   (options, args) = parser.parse_args(args)
   client = GClient.LoadCurrentConfig(options)
   if not client:
@@ -3065,6 +3476,11 @@ class OptionParser(optparse.OptionParser):
     self.add_option(
         '--no-nag-max', default=False, action='store_true',
         help='Ignored for backwards compatibility.')
+    self.add_option(
+        '--trace-file',
+        help='Write a trace of the subprocesses, tasks and network requests '
+             'to this file, in the Chrome trace format. Load it in '
+             'chrome://tracing.')
 
   def parse_args(self, args=None, _values=None):
     """Integrates standard options processing."""
@@ -3093,8 +3509,12 @@ class OptionParser(optparse.OptionParser):
     if not options.config_filename:
       options.config_filename = self.gclientfile_default
     options.entries_filename = options.config_filename + '_entries'
+    options.timings_filename = options.config_filename + '_timings'
+    options.deps_cache_filename = options.config_filename + '_deps_cache'
     if options.jobs < 1:
       self.error('--jobs must be 1 or higher')
+    if options.trace_file:
+      trace_events.start(options.trace_file)
 
     # These hacks need to die.
     if not hasattr(options, 'revisions'):
@@ -4,8 +4,11 @@
 
 import ast
 import collections
+import hashlib
 import logging
+import os
 import sys
+import threading
 import tokenize
 
 import gclient_utils
@@ -17,9 +20,11 @@ if six.PY2:
   # We use cStringIO.StringIO because it is equivalent to Py3's io.StringIO.
   from cStringIO import StringIO
   import collections as collections_abc
+  import cPickle as pickle
 else:
   from collections import abc as collections_abc
   from io import StringIO
+  import pickle
   # pylint: disable=redefined-builtin
   basestring = str
 
@@ -130,6 +135,22 @@ _GCLIENT_HOOKS_SCHEMA = [
         # Optional condition string. The hook will only be run
         # if the condition evaluates to True.
         schema.Optional('condition'): basestring,
+
+        # Names of the hooks that must have run before this one. Hooks that
+        # declare 'depends_on' or 'resources' can run concurrently with the
+        # other hooks; hooks that declare neither wait for all the hooks listed
+        # before them.
+        schema.Optional('depends_on'): [schema.Optional(basestring)],
+
+        # Resources (e.g. a directory the hook writes to) used by this hook.
+        # Hooks sharing a resource never run at the same time.
+        schema.Optional('resources'): [schema.Optional(basestring)],
+
+        # Files or directories, relative to the hook's working directory, that
+        # determine the hook's result. Declaring them lets gclient skip the
+        # hook when they, the action, cwd and variables are all unchanged since
+        # it last succeeded.
+        schema.Optional('inputs'): [schema.Optional(basestring)],
     })
 ]
 
@@ -494,101 +515,267 @@ def Parse(content, filename, vars_override=None, builtin_vars=None):
   return result
 
 
-def EvaluateCondition(condition, variables, referenced_variables=None):
-  """Safely evaluates a boolean condition. Returns the result."""
-  if not referenced_variables:
-    referenced_variables = set()
-  _allowed_names = {'None': None, 'True': True, 'False': False}
-  main_node = ast.parse(condition, mode='eval')
-  if isinstance(main_node, ast.Expression):
-    main_node = main_node.body
-  def _convert(node, allow_tuple=False):
+def _ToPlain(value):
+  """Converts the _NodeDict in a Parse() result to OrderedDict."""
+  if isinstance(value, collections_abc.Mapping):
+    return collections.OrderedDict(
+        (k, _ToPlain(v)) for k, v in value.items())
+  if isinstance(value, list):
+    return [_ToPlain(v) for v in value]
+  if isinstance(value, tuple):
+    return tuple(_ToPlain(v) for v in value)
+  return value
+
+
+class ParseCache(object):
+  """Persistent cache of Parse() results.
+
+  Results are keyed by a hash of the DEPS contents and of the variables they
+  are evaluated with, so an unchanged DEPS file skips the AST walk and schema
+  validation. They don't carry AST nodes or tokens, and each lookup returns a
+  new copy that the caller may modify.
+
+  Only the latest results of each DEPS file are kept, since most of them
+  change on every sync, so that the whole cache stays cheaper to load than
+  parsing the DEPS files it holds.
+  """
+
+  # Bump when the structure of the file or returned by Parse() changes.
+  VERSION = 2
+  # Maximum number of results kept on disk for each DEPS file, e.g. for
+  # different variables, least recently used are evicted.
+  MAX_ENTRIES_PER_FILE = 3
+  # Maximum number of results kept on disk, least recently used are evicted.
+  MAX_ENTRIES = 500
+
+  def __init__(self, path):
+    self._path = path
+    self._lock = threading.Lock()
+    # Key to (DEPS filename, pickled Parse() result), least recently used
+    # first.
+    self._entries = collections.OrderedDict()
+    self._dirty = False
+    self._load()
+
+  def _load(self):
+    if not os.path.exists(self._path):
+      return
+    try:
+      with open(self._path, 'rb') as f:
+        content = pickle.load(f)
+      if content.get('version') == self.VERSION:
+        self._entries = content['entries']
+    except Exception as e:  # pylint: disable=broad-except
+      # Any corruption just means starting with an empty cache.
+      logging.warning('Ignoring unreadable %s: %s', self._path, e)
+      self._entries = collections.OrderedDict()
+
+  def _key(self, content, vars_override, builtin_vars):
+    if not isinstance(content, bytes):
+      content = content.encode('utf-8')
+    digest = hashlib.sha1(content)
+    digest.update(repr((
+        sorted((vars_override or {}).items()),
+        sorted((builtin_vars or {}).items()),
+    )).encode('utf-8'))
+    return digest.hexdigest()
+
+  def Parse(self, content, filename, vars_override=None, builtin_vars=None):
+    """Same as Parse(), but returns the cached result if there is one."""
+    key = self._key(content, vars_override, builtin_vars)
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry:
+        self._entries[key] = entry
+        self._dirty = True
+        data = entry[1]
+    if not entry:
+      data = pickle.dumps(
+          _ToPlain(Parse(content, filename, vars_override, builtin_vars)),
+          protocol=2)
+      with self._lock:
+        self._entries[key] = (filename, data)
+        self._dirty = True
+    return pickle.loads(data)
+
+  def Save(self):
+    """Writes the cache to disk, evicting the least recently used results."""
+    with self._lock:
+      if not self._dirty:
+        return
+      per_file = collections.Counter()
+      keep = []
+      for key, entry in reversed(self._entries.items()):
+        if (len(keep) < self.MAX_ENTRIES and
+            per_file[entry[0]] < self.MAX_ENTRIES_PER_FILE):
+          per_file[entry[0]] += 1
+          keep.append((key, entry))
+      self._entries = collections.OrderedDict(reversed(keep))
+      tmp_path = self._path + '.tmp'
+      with open(tmp_path, 'wb') as f:
+        pickle.dump(
+            {'version': self.VERSION, 'entries': self._entries}, f, protocol=2)
+      if os.path.exists(self._path):
+        os.remove(self._path)
+      os.rename(tmp_path, self._path)
+      self._dirty = False
+
+
+# Maximum number of compiled conditions kept by CompileCondition().
+_MAX_COMPILED_CONDITIONS = 4096
+_compiled_conditions = collections.OrderedDict()
+_compiled_conditions_lock = threading.Lock()
+
+
+class CompiledCondition(object):
+  """A condition string parsed once into a tree of closures.
+
+  Calling it evaluates the condition against a dict of variables, with the same
+  semantics and errors as walking the AST of the condition every time.
+  """
+
+  _ALLOWED_NAMES = {'None': None, 'True': True, 'False': False}
+
+  def __init__(self, condition):
+    self.condition = condition
+    self._names = set()
+    main_node = ast.parse(condition, mode='eval')
+    if isinstance(main_node, ast.Expression):
+      main_node = main_node.body
+    self._evaluate = self._compile(main_node)
+    # Names referenced by the condition that may be variables.
+    self.variables = frozenset(self._names)
+
+  def __call__(self, variables, referenced_variables=frozenset()):
+    return self._evaluate(variables, referenced_variables)
+
+  def _error(self, message):
+    def _raise(_variables, _referenced_variables):
+      raise ValueError(message)
+    return _raise
+
+  def _compile(self, node, allow_tuple=False):
+    condition = self.condition
     if isinstance(node, ast.Str):
-      return node.s
+      value = node.s
+      return lambda _variables, _referenced_variables: value
     elif isinstance(node, ast.Tuple) and allow_tuple:
-      return tuple(map(_convert, node.elts))
+      elts = [self._compile(elt) for elt in node.elts]
+      return lambda variables, referenced_variables: tuple(
+          elt(variables, referenced_variables) for elt in elts)
     elif isinstance(node, ast.Name):
-      if node.id in referenced_variables:
-        raise ValueError(
-            'invalid cyclic reference to %r (inside %r)' % (
-                node.id, condition))
-      elif node.id in _allowed_names:
-        return _allowed_names[node.id]
-      elif node.id in variables:
-        value = variables[node.id]
-
-        # Allow using "native" types, without wrapping everything in strings.
-        # Note that schema constraints still apply to variables.
-        if not isinstance(value, basestring):
-          return value
-
-        # Recursively evaluate the variable reference.
-        return EvaluateCondition(
-            variables[node.id],
-            variables,
-            referenced_variables.union([node.id]))
-      else:
-        # Implicitly convert unrecognized names to strings.
-        # If we want to change this, we'll need to explicitly distinguish
-        # between arguments for GN to be passed verbatim, and ones to
-        # be evaluated.
-        return node.id
+      name = node.id
+      if name not in self._ALLOWED_NAMES:
+        self._names.add(name)
+      def _name(variables, referenced_variables):
+        if name in referenced_variables:
+          raise ValueError(
+              'invalid cyclic reference to %r (inside %r)' % (name, condition))
+        elif name in self._ALLOWED_NAMES:
+          return self._ALLOWED_NAMES[name]
+        elif name in variables:
+          value = variables[name]
+
+          # Allow using "native" types, without wrapping everything in
+          # strings. Note that schema constraints still apply to variables.
+          if not isinstance(value, basestring):
+            return value
+
+          # Recursively evaluate the variable reference.
+          return EvaluateCondition(
+              value, variables, referenced_variables.union([name]))
+        else:
+          # Implicitly convert unrecognized names to strings.
+          # If we want to change this, we'll need to explicitly distinguish
+          # between arguments for GN to be passed verbatim, and ones to
+          # be evaluated.
+          return name
+      return _name
     elif not sys.version_info[:2] < (3, 4) and isinstance(
         node, ast.NameConstant):  # Since Python 3.4
-      return node.value
-    elif isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or):
-      bool_values = []
-      for value in node.values:
-        bool_values.append(_convert(value))
-        if not isinstance(bool_values[-1], bool):
-          raise ValueError(
-              'invalid "or" operand %r (inside %r)' % (
-                  bool_values[-1], condition))
-      return any(bool_values)
-    elif isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
-      bool_values = []
-      for value in node.values:
-        bool_values.append(_convert(value))
-        if not isinstance(bool_values[-1], bool):
-          raise ValueError(
-              'invalid "and" operand %r (inside %r)' % (
-                  bool_values[-1], condition))
-      return all(bool_values)
+      value = node.value
+      return lambda _variables, _referenced_variables: value
+    elif isinstance(node, ast.BoolOp) and isinstance(
+        node.op, (ast.Or, ast.And)):
+      op_name, reduce_fn = (
+          ('or', any) if isinstance(node.op, ast.Or) else ('and', all))
+      operands = [self._compile(value) for value in node.values]
+      def _bool_op(variables, referenced_variables):
+        bool_values = []
+        for operand in operands:
+          bool_values.append(operand(variables, referenced_variables))
+          if not isinstance(bool_values[-1], bool):
+            raise ValueError(
+                'invalid "%s" operand %r (inside %r)' % (
+                    op_name, bool_values[-1], condition))
+        return reduce_fn(bool_values)
+      return _bool_op
     elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
-      value = _convert(node.operand)
-      if not isinstance(value, bool):
-        raise ValueError(
-            'invalid "not" operand %r (inside %r)' % (value, condition))
-      return not value
+      operand = self._compile(node.operand)
+      def _not(variables, referenced_variables):
+        value = operand(variables, referenced_variables)
+        if not isinstance(value, bool):
+          raise ValueError(
+              'invalid "not" operand %r (inside %r)' % (value, condition))
+        return not value
+      return _not
     elif isinstance(node, ast.Compare):
       if len(node.ops) != 1:
-        raise ValueError(
+        return self._error(
             'invalid compare: exactly 1 operator required (inside %r)' % (
                 condition))
       if len(node.comparators) != 1:
-        raise ValueError(
+        return self._error(
             'invalid compare: exactly 1 comparator required (inside %r)' % (
                 condition))
 
-      left = _convert(node.left)
-      right = _convert(
+      left = self._compile(node.left)
+      right = self._compile(
           node.comparators[0], allow_tuple=isinstance(node.ops[0], ast.In))
 
       if isinstance(node.ops[0], ast.Eq):
-        return left == right
-      if isinstance(node.ops[0], ast.NotEq):
-        return left != right
-      if isinstance(node.ops[0], ast.In):
-        return left in right
-
-      raise ValueError(
-          'unexpected operator: %s %s (inside %r)' % (
-              node.ops[0], ast.dump(node), condition))
+        compare = lambda l, r: l == r
+      elif isinstance(node.ops[0], ast.NotEq):
+        compare = lambda l, r: l != r
+      elif isinstance(node.ops[0], ast.In):
+        compare = lambda l, r: l in r
+      else:
+        message = 'unexpected operator: %s %s (inside %r)' % (
+            node.ops[0], ast.dump(node), condition)
+        def compare(_l, _r):
+          raise ValueError(message)
+      return lambda variables, referenced_variables: compare(
+          left(variables, referenced_variables),
+          right(variables, referenced_variables))
     else:
-      raise ValueError(
+      return self._error(
           'unexpected AST node: %s %s (inside %r)' % (
               node, ast.dump(node), condition))
-  return _convert(main_node)
+
+
+def CompileCondition(condition):
+  """Returns the CompiledCondition for condition, parsing it only once.
+
+  The most recently used compiled conditions are kept in a bounded cache.
+  """
+  with _compiled_conditions_lock:
+    compiled = _compiled_conditions.pop(condition, None)
+    if compiled is not None:
+      _compiled_conditions[condition] = compiled
+      return compiled
+  compiled = CompiledCondition(condition)
+  with _compiled_conditions_lock:
+    _compiled_conditions[condition] = compiled
+    while len(_compiled_conditions) > _MAX_COMPILED_CONDITIONS:
+      _compiled_conditions.popitem(last=False)
+  return compiled
+
+
+def EvaluateCondition(condition, variables, referenced_variables=None):
+  """Safely evaluates a boolean condition. Returns the result."""
+  if not referenced_variables:
+    referenced_variables = set()
+  return CompileCondition(condition)(variables, referenced_variables)
 
 
 def RenderDEPSFile(gclient_dict):
@@ -17,6 +17,7 @@ import re
 import sys
 import tempfile
 import threading
+import time
 import traceback
 
 try:
@@ -36,6 +37,10 @@ THIS_FILE_PATH = os.path.abspath(__file__)
 GSUTIL_DEFAULT_PATH = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), 'gsutil.py')
 
+# Remote of the checkouts of partial git cache mirrors, from which they fetch
+# the objects the mirror doesn't have.
+PROMISOR_REMOTE = 'cache-upstream'
+
 
 class NoUsableRevError(gclient_utils.Error):
   """Raised if requested revision isn't found in checkout."""
@@ -111,6 +116,28 @@ class SCMWrapper(object):
     self.out_fh = out_fh
     self.out_cb = out_cb
     self.print_outbuf = print_outbuf
+    # Seconds spent in each phase (see gclient_timings.PHASES) by this wrapper.
+    self.timings = collections.defaultdict(float)
+    self._timed_phase = None
+    # Approximate number of bytes of packfiles fetched into the checkout.
+    self.fetched_bytes = 0
+
+  @contextlib.contextmanager
+  def _Timed(self, phase):
+    """Adds the time spent in the block to self.timings[phase].
+
+    Nested blocks are accounted to the outermost one.
+    """
+    if self._timed_phase:
+      yield
+      return
+    self._timed_phase = phase
+    start = time.time()
+    try:
+      yield
+    finally:
+      self._timed_phase = None
+      self.timings[phase] += time.time() - start
 
   def Print(self, *args, **kwargs):
     kwargs.setdefault('file', self.out_fh)
@@ -245,6 +272,15 @@ class GitWrapper(SCMWrapper):
   def GetCheckoutRoot(self):
     return scm.GIT.GetCheckoutRoot(self.checkout_path)
 
+  def _PackBytes(self):
+    """Returns the total size of the packfiles of the checkout."""
+    pack_dir = os.path.join(self.checkout_path, '.git', 'objects', 'pack')
+    try:
+      return sum(os.path.getsize(os.path.join(pack_dir, f))
+                 for f in os.listdir(pack_dir) if f.endswith('.pack'))
+    except OSError:
+      return 0
+
   def GetRevisionDate(self, _revision):
     """Returns the given revision's date in ISO-8601 format (which contains the
     time zone)."""
@@ -419,7 +455,8 @@ class GitWrapper(SCMWrapper):
     self.Print('Revision to patch is %r @ %r.' % (patch_repo, patch_rev))
     self.Print('Current dir is %r' % self.checkout_path)
     self._Capture(['reset', '--hard'])
-    self._Capture(['fetch', '--no-tags', patch_repo, patch_rev])
+    with self._Timed('fetch'):
+      self._Capture(['fetch', '--no-tags', patch_repo, patch_rev])
     patch_rev = self._Capture(['rev-parse', 'FETCH_HEAD'])
 
     if not options.rebase_patch_ref:
@@ -544,6 +581,15 @@ class GitWrapper(SCMWrapper):
       # Reset to a clean state
       self._Scrub('HEAD', options)
 
+    # On warm checkouts the pinned commit is usually present already, either
+    # in the checkout or in the git cache through the alternates. In that case
+    # neither the mirror nor the checkout need to be fetched.
+    has_revision = False
+    if (rev_type == 'hash' and gclient_utils.IsFullGitSha(revision) and
+        os.path.isdir(os.path.join(self.checkout_path, '.git'))):
+      has_revision = bool(
+          scm.GIT.GetExistingCommits(self.checkout_path, [revision]))
+
     if (not os.path.exists(self.checkout_path) or
         (os.path.isdir(self.checkout_path) and
          not os.path.exists(os.path.join(self.checkout_path, '.git')))):
@@ -579,7 +625,11 @@ class GitWrapper(SCMWrapper):
 
     self._maybe_break_locks(options)
 
-    if mirror:
+    if has_revision:
+      if options.verbose:
+        self.Print('skipping fetch, rev=%s is already present' % revision,
+                   timestamp=False)
+    elif mirror:
       self._UpdateMirrorIfNotContains(mirror, options, rev_type, revision)
 
     # See if the url has changed (the unittests use git://foo for the url, let
@@ -660,7 +710,8 @@ class GitWrapper(SCMWrapper):
     self._SetFetchConfig(options)
 
     # Fetch upstream if we don't already have |revision|.
-    if not scm.GIT.IsValidRevision(self.checkout_path, revision, sha_only=True):
+    if not has_revision and not scm.GIT.IsValidRevision(
+        self.checkout_path, revision, sha_only=True):
       self._Fetch(options, prune=options.force)
 
       if not scm.GIT.IsValidRevision(self.checkout_path, revision,
@@ -988,13 +1039,26 @@ class GitWrapper(SCMWrapper):
         depth = 10000
     else:
       depth = None
-    mirror.populate(verbose=options.verbose,
-                    bootstrap=not getattr(options, 'no_bootstrap', False),
-                    depth=depth,
-                    ignore_lock=getattr(options, 'ignore_locks', False),
-                    lock_timeout=getattr(options, 'lock_timeout', 0))
+    with self._Timed('fetch'):
+      mirror.populate(verbose=options.verbose,
+                      bootstrap=not getattr(options, 'no_bootstrap', False),
+                      depth=depth,
+                      ignore_lock=getattr(options, 'ignore_locks', False),
+                      lock_timeout=getattr(options, 'lock_timeout', 0))
     mirror.unlock()
 
+  @contextlib.contextmanager
+  def _ReadingMirror(self, url):
+    """Keeps the git cache mirror at |url|, if any, from being replaced.
+
+    Other readers of the mirror don't have to wait, nor does a fetch into it.
+    """
+    if not self.cache_dir:
+      yield
+      return
+    with git_cache.MirrorLock(url).shared():
+      yield
+
   def _Clone(self, revision, url, options):
     """Clone a git repository from the given URL.
 
@@ -1048,11 +1112,13 @@ class GitWrapper(SCMWrapper):
       else:
         print_stdout = False
         filter_fn = self.filter
-      self._Run(clone_cmd, options, cwd=self._root_dir, retry=True,
-                print_stdout=print_stdout, filter_fn=filter_fn)
+      with self._Timed('fetch'), self._ReadingMirror(url):
+        self._Run(clone_cmd, options, cwd=self._root_dir, retry=True,
+                  print_stdout=print_stdout, filter_fn=filter_fn)
       gclient_utils.safe_makedirs(self.checkout_path)
       gclient_utils.safe_rename(os.path.join(tmp_dir, '.git'),
                                 os.path.join(self.checkout_path, '.git'))
+      self.fetched_bytes += self._PackBytes()
     except:
       traceback.print_exc(file=self.out_fh)
       raise
@@ -1063,6 +1129,8 @@ class GitWrapper(SCMWrapper):
       if template_dir:
         gclient_utils.rmtree(template_dir)
     self._SetFetchConfig(options)
+    if self.cache_dir:
+      self._SetPromisorConfig(url, options)
     self._Fetch(options, prune=options.force)
     revision = self._AutoFetchRef(options, revision)
     remote_ref = scm.GIT.RefToRemoteRef(revision, self.remote)
@@ -1340,11 +1408,34 @@ class GitWrapper(SCMWrapper):
       fetch_cmd.append('--no-tags')
     elif quiet:
       fetch_cmd.append('--quiet')
-    self._Run(fetch_cmd, options, show_header=options.verbose, retry=True)
+    pack_bytes = self._PackBytes()
+    with self._Timed('fetch'):
+      self._Run(fetch_cmd, options, show_header=options.verbose, retry=True)
+    self.fetched_bytes += max(0, self._PackBytes() - pack_bytes)
 
     # Return the revision that was fetched; this will be stored in 'FETCH_HEAD'
     return self._Capture(['rev-parse', '--verify', 'FETCH_HEAD'])
 
+  def _SetPromisorConfig(self, mirror_path, options):
+    """Lets a checkout of a partial git cache mirror get the objects it lacks.
+
+    The mirror can't serve objects it doesn't have, so the checkout fetches
+    them on demand from the upstream of the mirror, through a promisor remote
+    which has no refs.
+    """
+    partial_clone_filter = scm.GIT.GetConfig(
+        mirror_path, 'remote.origin.partialclonefilter')
+    if not partial_clone_filter:
+      return
+    upstream = scm.GIT.GetConfig(mirror_path, 'remote.origin.url')
+    remote = 'remote.%s.' % PROMISOR_REMOTE
+    self._Run(['config', 'core.repositoryformatversion', '1'], options)
+    self._Run(['config', 'extensions.partialClone', PROMISOR_REMOTE], options)
+    self._Run(['config', remote + 'url', upstream], options)
+    self._Run(['config', remote + 'promisor', 'true'], options)
+    self._Run(['config', remote + 'partialclonefilter', partial_clone_filter],
+              options)
+
   def _SetFetchConfig(self, options):
     """Adds, and optionally fetches, "branch-heads" and "tags" refspecs
     if requested."""
@@ -0,0 +1,132 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Persistent record of how long each dependency took to sync.
+
+The record lives in a JSON file next to .gclient_entries and keeps the timings
+of the last MAX_RUNS syncs, so that slow or regressing dependencies can be
+found, and so that the slowest dependencies can be started first.
+"""
+
+from __future__ import print_function
+
+import json
+import logging
+import os
+import time
+
+import gclient_utils
+
+
+# Number of past runs kept in the file.
+MAX_RUNS = 20
+
+# Phases recorded for each dependency, in the order they happen.
+#   fetch:    cloning or fetching from the remote, or from the git cache.
+#   checkout: the rest of the SCM update, e.g. checkout, rebase and patching.
+#   parse:    reading and evaluating the DEPS file.
+#   hooks:    running the hooks declared in the DEPS file, once every
+#             dependency is synced.
+PHASES = ('fetch', 'checkout', 'parse', 'hooks')
+
+# Besides the PHASES, each dependency records 'total', the time it took to
+# sync, which doesn't include its hooks, and 'requirements'. It may also record
+# 'fetch_bytes', the approximate size of the packfiles it fetched.
+
+
+class TimingStore(object):
+  """Reads and writes the timings file of a gclient checkout."""
+
+  def __init__(self, path):
+    self.path = path
+    self.runs = []
+    self._load()
+
+  def _load(self):
+    if not os.path.exists(self.path):
+      return
+    try:
+      with open(self.path) as f:
+        content = json.load(f)
+      runs = content.get('runs')
+      for run in runs or []:
+        if not isinstance(run.get('deps'), dict):
+          raise ValueError('Invalid run %r' % run)
+      self.runs = list(runs or [])
+    except (IOError, ValueError, TypeError, AttributeError) as e:
+      logging.warning('Ignoring unreadable %s: %s', self.path, e)
+      self.runs = []
+
+  def save(self):
+    gclient_utils.FileWrite(
+        self.path, json.dumps({'runs': self.runs[-MAX_RUNS:]}, indent=2,
+                              sort_keys=True))
+
+  def add_run(self, deps, timestamp=None):
+    """Appends the timings of a run.
+
+    Args:
+      deps: dict of dependency name to a dict with the keys 'total',
+          'requirements' and any of PHASES, durations being in seconds.
+    """
+    self.runs.append({
+        'timestamp': time.time() if timestamp is None else timestamp,
+        'deps': deps,
+    })
+    self.runs = self.runs[-MAX_RUNS:]
+
+  @property
+  def latest(self):
+    """Returns the dependency timings of the most recent run."""
+    if not self.runs:
+      return {}
+    return self.runs[-1]['deps']
+
+  def priorities(self):
+    """Returns the ExecutionQueue priorities computed from the latest run.
+
+    Only the 'total' sync time of the dependencies is weighed: the hooks run
+    after the sync, so starting their dependency early doesn't speed them up.
+    """
+    deps = self.latest
+    durations = {}
+    requirements = {}
+    for name, dep in deps.items():
+      durations[name] = dep.get('total', 0)
+      requirements[name] = dep.get('requirements', [])
+    return gclient_utils.CriticalPathPriorities(durations, requirements)
+
+  def report(self, limit=20):
+    """Returns the lines of a report of the slowest dependencies.
+
+    Each dependency of the latest run is listed with its phases and with the
+    difference between its total and its average total over previous runs.
+    """
+    deps = self.latest
+    if not deps:
+      return ['No timings recorded yet.']
+    history = {}
+    for run in self.runs[:-1]:
+      for name, dep in run['deps'].items():
+        history.setdefault(name, []).append(dep.get('total', 0))
+
+    lines = [
+        'Slowest dependencies of the last sync (%d runs recorded):' %
+        len(self.runs),
+        '%-50s %8s %8s %8s %8s %8s %9s' % (
+            ('dependency', 'total') + PHASES + ('trend',)),
+    ]
+    slowest = sorted(
+        deps.items(), key=lambda item: (-item[1].get('total', 0), item[0]))
+    for name, dep in slowest[:limit]:
+      total = dep.get('total', 0)
+      previous = history.get(name)
+      if previous:
+        trend = '%+8.1fs' % (total - sum(previous) / len(previous))
+      else:
+        trend = '%9s' % 'new'
+      lines.append('%-50s %7.1fs %7.1fs %7.1fs %7.1fs %7.1fs %s' % (
+          (name, total) + tuple(dep.get(phase, 0) for phase in PHASES) +
+          (trend,)))
+    return lines
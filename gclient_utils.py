@@ -11,6 +11,7 @@ import collections
 import contextlib
 import datetime
 import functools
+import heapq
 import io
 import logging
 import operator
@@ -25,6 +26,7 @@ import tempfile
 import threading
 import time
 import subprocess2
+import trace_events
 
 if sys.version_info.major == 2:
   from cStringIO import StringIO
@@ -516,6 +518,7 @@ class GClientChildren(object):
           print('  ', zombie.pid, file=sys.stderr)
 
 
+@trace_events.traced('subprocess')
 def CheckCallAndFilter(args, print_stdout=False, filter_fn=None,
                        show_header=False, always_show_header=False, retry=False,
                        **kwargs):
@@ -774,26 +777,75 @@ class WorkItem(object):
     return self._name
 
 
+def CriticalPathPriorities(durations, requirements):
+  """Computes the scheduling priority of each work item from its history.
+
+  The priority of an item is the length of the longest chain of work that
+  can't complete before it does, i.e. its own duration plus the priority of the
+  slowest item that requires it. Starting the items with the highest priority
+  first keeps a large item from being started last and running alone.
+
+  Args:
+    durations: dict of item name to the seconds it took to run last time.
+    requirements: dict of item name to the names of the items it requires.
+
+  Returns:
+    A dict of item name to priority, in seconds.
+  """
+  dependents = collections.defaultdict(set)
+  for name, reqs in requirements.items():
+    for req in reqs:
+      dependents[req].add(name)
+
+  priorities = {}
+  for start in sorted(set(durations) | set(dependents)):
+    if start in priorities:
+      continue
+    # Iterative post-order traversal, so that deep trees don't hit the
+    # recursion limit. Names already on the stack are ignored to survive
+    # cyclic (i.e. corrupted) history.
+    stack = [(start, iter(sorted(dependents.get(start, ()))))]
+    visiting = set([start])
+    while stack:
+      name, children = stack[-1]
+      child = next(children, None)
+      if child is None:
+        stack.pop()
+        visiting.discard(name)
+        priorities[name] = durations.get(name, 0) + max(
+            [priorities.get(d, 0) for d in dependents.get(name, ())] or [0])
+      elif child not in priorities and child not in visiting:
+        visiting.add(child)
+        stack.append((child, iter(sorted(dependents.get(child, ())))))
+  return priorities
+
+
 class ExecutionQueue(object):
   """Runs a set of WorkItem that have interdependencies and were WorkItem are
   added as they are processed.
 
   This class manages that all the required dependencies are run
-  before running each one.
+  before running each one. Among the items whose requirements are satisfied,
+  the one with the highest priority runs first; items without a priority run in
+  the order they were enqueued.
 
   Methods of this class are thread safe.
   """
-  def __init__(self, jobs, progress, ignore_requirements, verbose=False):
+  def __init__(self, jobs, progress, ignore_requirements, verbose=False,
+               priorities=None):
     """jobs specifies the number of concurrent tasks to allow. progress is a
-    Progress instance."""
+    Progress instance. priorities is an optional dict of WorkItem.name to a
+    number, usually computed by CriticalPathPriorities()."""
     # Set when a thread is done or a new item is enqueued.
     self.ready_cond = threading.Condition()
     # Maximum number of concurrent tasks.
     self.jobs = jobs
-    # List of WorkItem, for gclient, these are Dependency instances.
-    self.queued = []
-    # List of strings representing each Dependency.name that was run.
-    self.ran = []
+    # WorkItem waiting to run, in the order they were enqueued. For gclient,
+    # these are Dependency instances. Only the keys are used.
+    self.queued = collections.OrderedDict()
+    # Each Dependency.name that was run, in the order they ran. Only the keys
+    # are used.
+    self.ran = collections.OrderedDict()
     # List of items currently running.
     self.running = []
     # Exceptions thrown if any.
@@ -808,6 +860,18 @@ class ExecutionQueue(object):
     self.last_join = None
     self.last_subproc_output = None
 
+    self.priorities = priorities or {}
+    # Heap of (-priority, sequence number, WorkItem) of the queued items whose
+    # requirements are satisfied.
+    self._ready = []
+    # Dict of requirement name to the list of [missing names, WorkItem] of the
+    # queued items waiting for it.
+    self._blocked = collections.defaultdict(list)
+    self._sequence = 0
+    # Dict of WorkItem.name to (seconds, requirements) for each item that ran,
+    # so it can be fed back into CriticalPathPriorities() next time.
+    self.durations = {}
+
   def enqueue(self, d):
     """Enqueue one Dependency to be executed later once its requirements are
     satisfied.
@@ -815,7 +879,8 @@ class ExecutionQueue(object):
     assert isinstance(d, WorkItem)
     self.ready_cond.acquire()
     try:
-      self.queued.append(d)
+      self.queued[d] = None
+      self._schedule(d)
       total = len(self.queued) + len(self.ran) + len(self.running)
       if self.jobs == 1:
         total += 1
@@ -827,6 +892,68 @@ class ExecutionQueue(object):
     finally:
       self.ready_cond.release()
 
+  def _schedule(self, d):
+    """Adds d to the ready heap, or indexes it by its missing requirements."""
+    missing = set()
+    if not self.ignore_requirements:
+      missing = self._missing(d)
+    if not missing:
+      self._sequence += 1
+      heapq.heappush(
+          self._ready, (-self.priorities.get(d.name, 0), self._sequence, d))
+      return
+    entry = [missing, d]
+    for name in missing:
+      self._blocked[name].append(entry)
+
+  def _missing(self, d):
+    """Returns the set of requirements of d that didn't run yet."""
+    return set(r for r in d.requirements if r not in self.ran)
+
+  def _mark_ran(self, name):
+    """Records that name ran and unblocks the items that were waiting on it."""
+    self.ran[name] = None
+    for entry in self._blocked.pop(name, []):
+      entry[0].discard(name)
+      if not entry[0]:
+        self._sequence += 1
+        heapq.heappush(
+            self._ready,
+            (-self.priorities.get(entry[1].name, 0), self._sequence, entry[1]))
+
+  def _record_duration(self, task_item):
+    if task_item.start and task_item.finish:
+      self.durations[task_item.name] = (
+          (task_item.finish - task_item.start).total_seconds(),
+          tuple(task_item.requirements))
+
+  def _pop_ready(self):
+    """Returns the highest priority ready item that can start now, or None."""
+    skipped = []
+    task = None
+    while self._ready:
+      entry = heapq.heappop(self._ready)
+      item = entry[2]
+      # Requirements may have grown since the item was enqueued, e.g. when a
+      # dependency of a parent directory was discovered in the meantime.
+      if not self.ignore_requirements:
+        missing = self._missing(item)
+        if missing:
+          blocked = [missing, item]
+          for name in missing:
+            self._blocked[name].append(blocked)
+          continue
+      if self._is_conflict(item):
+        skipped.append(entry)
+        continue
+      task = item
+      break
+    for entry in skipped:
+      heapq.heappush(self._ready, entry)
+    if task is not None:
+      del self.queued[task]
+    return task
+
   def out_cb(self, _):
     self.last_subproc_output = datetime.datetime.now()
     return True
@@ -867,7 +994,9 @@ class ExecutionQueue(object):
         while True:
           if not self.exceptions.empty():
             # Systematically flush the queue when an exception logged.
-            self.queued = []
+            self.queued.clear()
+            self._ready = []
+            self._blocked.clear()
           self._flush_terminated_threads()
           if (not self.queued and not self.running or
               self.jobs == len(self.running)):
@@ -875,17 +1004,12 @@ class ExecutionQueue(object):
             break
 
           # Check for new tasks to start.
-          for i in range(len(self.queued)):
-            # Verify its requirements.
-            if (self.ignore_requirements or
-                not (set(self.queued[i].requirements) - set(self.ran))):
-              if not self._is_conflict(self.queued[i]):
-                # Start one work item: all its requirements are satisfied.
-                self._run_one_task(self.queued.pop(i), args, kwargs)
-                break
-          else:
+          task_item = self._pop_ready()
+          if task_item is None:
             # Couldn't find an item that could run. Break out the outher loop.
             break
+          # Start one work item: all its requirements are satisfied.
+          self._run_one_task(task_item, args, kwargs)
 
         if not self.queued and not self.running:
           # We're done.
@@ -958,7 +1082,8 @@ class ExecutionQueue(object):
               'gclient is confused, "%s" is already in "%s"' % (
                 t.item.name, ', '.join(self.ran)))
         if not t.item.name in self.ran:
-          self.ran.append(t.item.name)
+          self._record_duration(t.item)
+          self._mark_ran(t.item.name)
 
   def _run_one_task(self, task_item, args, kwargs):
     if self.jobs > 1:
@@ -973,11 +1098,13 @@ class ExecutionQueue(object):
       try:
         task_item.start = datetime.datetime.now()
         print('[%s] Started.' % Elapsed(task_item.start), file=task_item.outbuf)
-        task_item.run(*args, **kwargs)
+        with trace_events.span(task_item.name, 'task'):
+          task_item.run(*args, **kwargs)
         task_item.finish = datetime.datetime.now()
         print(
             '[%s] Finished.' % Elapsed(task_item.finish), file=task_item.outbuf)
-        self.ran.append(task_item.name)
+        self._record_duration(task_item)
+        self._mark_ran(task_item.name)
         if self.verbose:
           if self.progress:
             print('')
@@ -1011,7 +1138,8 @@ class ExecutionQueue(object):
       try:
         self.item.start = datetime.datetime.now()
         print('[%s] Started.' % Elapsed(self.item.start), file=self.item.outbuf)
-        self.item.run(*self.args, **self.kwargs)
+        with trace_events.span(self.item.name, 'task'):
+          self.item.run(*self.args, **self.kwargs)
         self.item.finish = datetime.datetime.now()
         print(
             '[%s] Finished.' % Elapsed(self.item.finish), file=self.item.outbuf)
@@ -32,6 +32,7 @@ import gclient_utils
 import metrics
 import metrics_utils
 import subprocess2
+import trace_events
 
 from third_party import six
 from six.moves import urllib
@@ -417,6 +418,9 @@ def ReadHttpResponse(conn, accept_statuses=frozenset([200])):
     response, contents = conn.request(**conn.req_params)
     contents = contents.decode('utf-8', 'replace')
 
+    trace_events.complete(
+        '%s %s' % (conn.req_params['method'], conn.req_host), 'http',
+        before_response, uri=conn.req_params['uri'], status=response.status)
     response_time = time.time() - before_response
     metrics.collector.add_repeated(
         'http_requests',
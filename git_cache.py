@@ -9,15 +9,23 @@ from __future__ import print_function
 
 import contextlib
 import errno
+import heapq
 import logging
 import optparse
 import os
 import re
+import shutil
 import subprocess
 import sys
 import tempfile
 import threading
 import time
+from multiprocessing.pool import ThreadPool
+
+try:
+  import fcntl  # pylint: disable=import-error
+except ImportError:  # Windows
+  fcntl = None
 
 try:
   import urlparse
@@ -26,6 +34,7 @@ except ImportError:  # For Py3 compatibility
 
 from download_from_google_storage import Gsutil
 import gclient_utils
+import scm
 import subcommand
 
 # Analogous to gc.autopacklimit git config.
@@ -33,6 +42,40 @@ GC_AUTOPACKLIMIT = 50
 
 GIT_CACHE_CORRUPT_MESSAGE = 'WARNING: The Git cache is corrupt.'
 
+# Git config key recording the snapshot generation a mirror was bootstrapped
+# from, or last caught up with through a delta bundle.
+BOOTSTRAP_GENERATION_KEY = 'cache.bootstrapGeneration'
+
+# Number of previous snapshots update_bootstrap creates delta bundles from.
+MAX_BOOTSTRAP_DELTAS = 3
+
+# Existing mirrors only look for a delta bundle when they haven't fetched for
+# this many seconds. Mirrors fetched more recently catch up faster from origin
+# than by listing the bucket on every populate.
+BOOTSTRAP_DELTA_MIN_AGE = 24 * 60 * 60
+
+# Delta bundles are fetched into this namespace, so that they never rewind the
+# refs of the mirror. The refs are deleted once populate fetched from origin.
+SNAPSHOT_REFS_PREFIX = 'refs/snapshot/'
+
+# Seconds "git cache maintain" spends on a mirror at most, by default.
+MAINTENANCE_BUDGET = 300
+
+# Git config key which, when set to a number of seconds, makes populate run
+# the maintenance of the mirror after fetching, within that budget.
+MAINTENANCE_BUDGET_KEY = 'cache.maintenanceBudget'
+
+# Git config key which, when set to a filter spec such as blob:none or tree:0,
+# makes new mirrors partial clones, see Mirror.populate().
+PARTIAL_CLONE_FILTER_KEY = 'cache.partialCloneFilter'
+
+# The multi-pack-index repack caps its batches to this size, like
+# "git maintenance" does, so that the largest packs are left alone.
+MAX_REPACK_BATCH_SIZE = 2 * 1024 * 1024 * 1024
+
+# Host of the CIPD packages listed in .gclient_entries, which aren't git repos.
+CIPD_HOST = 'chrome-infra-packages.appspot.com'
+
 try:
   # pylint: disable=undefined-variable
   WinErr = WindowsError
@@ -192,6 +235,289 @@ class Lockfile(object):
     return self.is_locked() and self.pid == self._read_pid()
 
 
+class MirrorLock(object):
+  """Reader/writer lock of a mirror, held with flock() on <mirror>.rwlock.
+
+  Readers, e.g. clones from the mirror, hold it shared, and only the steps
+  which delete or replace files that readers may be using hold it exclusive:
+  replacing the mirror with a snapshot, deleting a corrupt mirror and
+  removing packs. Fetches update refs atomically, so readers don't have to
+  wait for them; writers are serialized with the Lockfile instead.
+
+  Waits block in the kernel until the lock is available. The lock is
+  released when its file is closed, even if the process is killed. Where
+  flock() isn't available, it is a no-op.
+  """
+
+  def __init__(self, path):
+    self.path = os.path.abspath(path) + '.rwlock'
+
+  def shared(self):
+    return self._hold(fcntl and fcntl.LOCK_SH)
+
+  def exclusive(self):
+    return self._hold(fcntl and fcntl.LOCK_EX)
+
+  @contextlib.contextmanager
+  def _hold(self, operation):
+    if fcntl is None:
+      yield
+      return
+    gclient_utils.safe_makedirs(os.path.dirname(self.path))
+    # Each hold opens the file, so that threads of a process exclude each
+    # other too.
+    fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+      fcntl.flock(fd, operation)
+      yield
+    finally:
+      os.close(fd)
+
+
+class RevisionIndex(object):
+  """Sorted list of the commits of a mirror, kept up to date by populate.
+
+  It answers whether a mirror has given commits without running git. The
+  file, in the mirror's directory, holds:
+    - the stamp of the last fetch the index includes, see _stamp();
+    - the number of ref tips, then their ids, which are also looked up, so
+      that annotated tags are found;
+    - the ids of all the commits reachable from the tips, sorted, one per
+      line, so that they can be binary searched without being loaded.
+
+  Updates drop the commits which are no longer reachable from the refs, and
+  gc only prunes unreachable commits, during fetches or update_bootstrap,
+  which are followed by an update. So while nothing was fetched since the
+  last update, the index lists exactly the commits of the mirror. Otherwise
+  it isn't used, since gc may have pruned some of them.
+  """
+
+  FILENAME = 'revision_index'
+  _RECORD_SIZE = 41
+
+  def __init__(self, mirror_path):
+    self.mirror_path = mirror_path
+    self.path = os.path.join(mirror_path, self.FILENAME)
+
+  def _stamp(self):
+    # Every fetch rewrites FETCH_HEAD.
+    try:
+      st = os.stat(os.path.join(self.mirror_path, 'FETCH_HEAD'))
+    except OSError:
+      return 'none'
+    return '%r %d' % (st.st_mtime, st.st_size)
+
+  @staticmethod
+  def _read_header(f):
+    stamp = f.readline().decode('utf-8').strip()
+    count = int(f.readline())
+    tips = set(f.readline().decode('utf-8').strip() for _ in range(count))
+    return stamp, tips
+
+  def _search(self, f, start, count, sha):
+    lo, hi = 0, count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      f.seek(start + mid * self._RECORD_SIZE)
+      if f.read(40) < sha:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo == count:
+      return False
+    f.seek(start + lo * self._RECORD_SIZE)
+    return f.read(40) == sha
+
+  def lookup(self, revisions):
+    """Looks up full commit ids in the index.
+
+    Returns (found, unknown): the revisions which are in the mirror, and
+    those the index can't tell about, e.g. refs, or everything when the
+    index is missing or stale.
+    """
+    try:
+      f = open(self.path, 'rb')
+    except IOError:
+      return set(), list(revisions)
+    with f:
+      try:
+        stamp, tips = self._read_header(f)
+      except ValueError:
+        return set(), list(revisions)
+      if stamp != self._stamp():
+        return set(), list(revisions)
+      start = f.tell()
+      count = (os.fstat(f.fileno()).st_size - start) // self._RECORD_SIZE
+      found = set()
+      unknown = []
+      for revision in revisions:
+        if not gclient_utils.IsFullGitSha(revision):
+          unknown.append(revision)
+        elif (revision.lower() in tips or
+              self._search(f, start, count, revision.lower().encode('ascii'))):
+          found.add(revision)
+    return found, unknown
+
+  def _rev_list(self, git_exe, args, revisions):
+    """Returns the set of commits git rev-list lists, one per line."""
+    proc = subprocess.Popen(
+        [git_exe, 'rev-list', '--stdin'] + args,
+        cwd=self.mirror_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = proc.communicate(''.join(
+        '%s\n' % revision for revision in sorted(revisions)).encode('utf-8'))
+    if proc.returncode:
+      raise subprocess.CalledProcessError(proc.returncode, 'git rev-list')
+    return set(line + b'\n' for line in out.split())
+
+  def _any_missing(self, git_exe, objects):
+    """Returns whether any of |objects| is missing from the mirror."""
+    proc = subprocess.Popen(
+        [git_exe, 'cat-file', '--batch-check'], cwd=self.mirror_path,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = proc.communicate(''.join(
+        '%s\n' % obj for obj in sorted(objects)).encode('utf-8'))
+    if proc.returncode:
+      raise subprocess.CalledProcessError(proc.returncode, 'git cat-file')
+    return any(line.endswith(b' missing') for line in out.splitlines())
+
+  def update(self, git_exe, rebuild=False):
+    """Adds the commits fetched since the last update and drops those which
+    are no longer reachable, or rebuilds it all."""
+    stamp = self._stamp()
+    old_tips = set()
+    old = None
+    if not rebuild:
+      try:
+        old = open(self.path, 'rb')
+        _, old_tips = self._read_header(old)
+      except (IOError, ValueError):
+        old = None
+    try:
+      tips = set(subprocess.check_output(
+          [git_exe, 'for-each-ref', '--format=%(objectname)'],
+          cwd=self.mirror_path).decode('utf-8').split())
+      # Commits only become unreachable when a ref was deleted or rewound,
+      # i.e. one of the previous tips isn't a tip anymore. If gc pruned that
+      # tip, the commits it pruned with it can't be listed anymore.
+      dropped = old_tips - tips
+      if dropped and self._any_missing(git_exe, dropped):
+        old.close()
+        old = None
+        old_tips = set()
+      # Only the commits which aren't reachable from the previous tips are
+      # new.
+      new = sorted(self._rev_list(
+          git_exe, ['--all'], ['^%s' % tip for tip in old_tips]))
+      gone = set()
+      if old_tips - tips:
+        gone = self._rev_list(git_exe, ['--not', '--all'], old_tips)
+      tmp = self.path + '.tmp'
+      with open(tmp, 'wb') as f:
+        tips = sorted(tips)
+        f.write(('%s\n%d\n' % (stamp, len(tips))).encode('utf-8'))
+        f.write(''.join('%s\n' % tip for tip in tips).encode('utf-8'))
+        previous = None
+        for line in heapq.merge(old or [], new):
+          if line != previous and line not in gone:
+            f.write(line)
+          previous = line
+    finally:
+      if old:
+        old.close()
+    if sys.platform.startswith('win') and os.path.exists(self.path):
+      os.remove(self.path)
+    os.rename(tmp, self.path)
+
+
+class _GsutilStorage(object):
+  """Bootstrap snapshots stored in Google Storage."""
+
+  def __init__(self, gsutil_exe):
+    self._gsutil = Gsutil(gsutil_exe, boto_path=None)
+
+  def ls(self, path):
+    """Returns the set of entries in |path|, and an error message if any.
+
+    Directories end with a '/'.
+    """
+    _, out, err = self._gsutil.check_call('ls', path)
+    return set(out.strip().splitlines()), err
+
+  def download_dir(self, src, dst):
+    """Copies the contents of the |src| directory into the |dst| directory."""
+    return self._gsutil.call('-m', 'cp', '-r', src + '/*', dst) == 0
+
+  def download_file(self, src, dst):
+    return self._gsutil.call('cp', src, dst) == 0
+
+  def upload_dir(self, src, dst):
+    self._gsutil.call('-m', 'cp', '-r', src, dst)
+
+  def upload_file(self, src, dst):
+    self._gsutil.call('cp', src, dst)
+
+  def rm(self, path):
+    if path.endswith('/'):
+      self._gsutil.call('-m', 'rm', '-r', path)
+    else:
+      self._gsutil.call('rm', path)
+
+
+class _LocalStorage(object):
+  """Bootstrap snapshots stored in a local directory, e.g. for tests.
+
+  Has the same interface as _GsutilStorage.
+  """
+
+  def ls(self, path):
+    if not os.path.isdir(path):
+      return set(), 'No such directory: %s' % path
+    entries = set()
+    for name in os.listdir(path):
+      entry = os.path.join(path, name)
+      entries.add(entry + '/' if os.path.isdir(entry) else entry)
+    return entries, ''
+
+  def download_dir(self, src, dst):
+    for name in os.listdir(src):
+      if os.path.isdir(os.path.join(src, name)):
+        gclient_utils.safe_makedirs(os.path.join(dst, name))
+        self.download_dir(os.path.join(src, name), os.path.join(dst, name))
+      else:
+        shutil.copy2(os.path.join(src, name), os.path.join(dst, name))
+    return True
+
+  def download_file(self, src, dst):
+    if not os.path.isfile(src):
+      return False
+    shutil.copy2(src, dst)
+    return True
+
+  def upload_dir(self, src, dst):
+    if os.path.exists(dst):
+      gclient_utils.rmtree(dst)
+    shutil.copytree(src, dst)
+
+  def upload_file(self, src, dst):
+    # Readers must never see a partially written file.
+    gclient_utils.safe_makedirs(os.path.dirname(dst))
+    shutil.copy2(src, dst + '.tmp')
+    os.rename(dst + '.tmp', dst)
+
+  def rm(self, path):
+    gclient_utils.rm_file_or_tree(path.rstrip('/'))
+
+
+class _NoSlots(object):
+  """Stands for a semaphore with unlimited slots."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_args):
+    pass
+
+
 class Mirror(object):
 
   git_exe = 'git.bat' if sys.platform.startswith('win') else 'git'
@@ -243,6 +569,7 @@ class Mirror(object):
 
   @property
   def bootstrap_bucket(self):
+    """The Google Storage bucket of the snapshots, or a local directory."""
     b = os.getenv('OVERRIDE_BOOTSTRAP_BUCKET')
     if b:
       return b
@@ -258,8 +585,15 @@ class Mirror(object):
 
   @property
   def _gs_path(self):
+    if os.path.isabs(self.bootstrap_bucket):
+      return '%s/v2/%s' % (self.bootstrap_bucket, self.basedir)
     return 'gs://%s/v2/%s' % (self.bootstrap_bucket, self.basedir)
 
+  def _storage(self):
+    if os.path.isabs(self.bootstrap_bucket):
+      return _LocalStorage()
+    return _GsutilStorage(self.gsutil_exe)
+
   @classmethod
   def FromPath(cls, path):
     return cls(cls.CacheDirToUrl(path))
@@ -312,6 +646,34 @@ class Mirror(object):
                            '$GIT_CACHE_PATH is set.')
       return ret
 
+  @classmethod
+  def GetMaintenanceBudget(cls):
+    """Returns the budget of the maintenance after a populate, if enabled."""
+    try:
+      return int(subprocess.check_output(
+          [cls.git_exe, 'config'] + cls._GIT_CONFIG_LOCATION +
+          [MAINTENANCE_BUDGET_KEY]).strip())
+    except (subprocess.CalledProcessError, ValueError):
+      return None
+
+  @classmethod
+  def GetDefaultPartialCloneFilter(cls):
+    """Returns the filter of new mirrors, or None to make full mirrors."""
+    try:
+      return subprocess.check_output(
+          [cls.git_exe, 'config'] + cls._GIT_CONFIG_LOCATION +
+          [PARTIAL_CLONE_FILTER_KEY]).decode('utf-8').strip() or None
+    except subprocess.CalledProcessError:
+      return None
+
+  @classmethod
+  def GetGitVersion(cls):
+    if not hasattr(cls, 'git_version'):
+      out = subprocess.check_output([cls.git_exe, '--version']).decode('utf-8')
+      match = re.search(r'(\d+)\.(\d+)', out)
+      cls.git_version = tuple(int(x) for x in match.groups()) if match else ()
+    return cls.git_version
+
   @staticmethod
   def _GetMostRecentCacheDirectory(ls_out_set):
     ready_file_pattern = re.compile(r'.*/(\d+).ready$')
@@ -350,7 +712,37 @@ class Mirror(object):
     self.print('running "git %s" in "%s"' % (' '.join(cmd), cwd))
     gclient_utils.CheckCallAndFilter([self.git_exe] + cmd, **kwargs)
 
-  def config(self, cwd=None, reset_fetch_config=False):
+  def GetPartialCloneFilter(self, cwd=None):
+    """Returns the filter of the mirror if it is a partial clone, or None."""
+    try:
+      return subprocess.check_output(
+          [self.git_exe, 'config', 'remote.origin.partialclonefilter'],
+          cwd=cwd or self.mirror_path).decode('utf-8').strip() or None
+    except subprocess.CalledProcessError:
+      return None
+
+  def _config_partial_clone(self, cwd, partial_clone_filter):
+    """Makes the mirror a partial clone, if it doesn't have full history yet.
+
+    Fetches from origin then omit the objects excluded by the filter. They are
+    fetched on demand, by the mirror or by checkouts, see
+    gclient_scm.GitWrapper._SetPromisorConfig().
+    """
+    if not self.GetPartialCloneFilter(cwd):
+      has_refs = subprocess.check_output(
+          [self.git_exe, 'for-each-ref', '--count=1'], cwd=cwd).strip()
+      if has_refs:
+        self.print('%s is a full mirror already, not filtering it with %s.' %
+                   (self.mirror_path, partial_clone_filter))
+        return
+    self.RunGit(['config', 'core.repositoryformatversion', '1'], cwd=cwd)
+    self.RunGit(['config', 'extensions.partialClone', 'origin'], cwd=cwd)
+    self.RunGit(['config', 'remote.origin.promisor', 'true'], cwd=cwd)
+    self.RunGit(['config', 'remote.origin.partialclonefilter',
+                 partial_clone_filter], cwd=cwd)
+
+  def config(self, cwd=None, reset_fetch_config=False,
+             partial_clone_filter=None):
     if cwd is None:
       cwd = self.mirror_path
 
@@ -389,6 +781,9 @@ class Mirror(object):
           ['config', '--replace-all', 'remote.origin.fetch', spec, value_regex],
           cwd=cwd)
 
+    if partial_clone_filter:
+      self._config_partial_clone(cwd, partial_clone_filter)
+
   def bootstrap_repo(self, directory):
     """Bootstrap the repo from Google Storage if possible.
 
@@ -397,14 +792,13 @@ class Mirror(object):
     if not self.bootstrap_bucket:
       return False
 
-    gsutil = Gsutil(self.gsutil_exe, boto_path=None)
+    storage = self._storage()
 
     # Get the most recent version of the directory.
     # This is determined from the most recent version of a .ready file.
     # The .ready file is only uploaded when an entire directory has been
     # uploaded to GS.
-    _, ls_out, ls_err = gsutil.check_call('ls', self._gs_path)
-    ls_out_set = set(ls_out.strip().splitlines())
+    ls_out_set, ls_err = storage.ls(self._gs_path)
     latest_dir = self._GetMostRecentCacheDirectory(ls_out_set)
 
     if not latest_dir:
@@ -420,41 +814,148 @@ class Mirror(object):
       self.print('Downloading files in %s/* into %s.' %
                  (latest_dir, tempdir))
       with self.print_duration_of('download'):
-        code = gsutil.call('-m', 'cp', '-r', latest_dir + "/*",
-                           tempdir)
-      if code:
-        return False
+        if not storage.download_dir(latest_dir, tempdir):
+          return False
+      # Remember which snapshot this is, so that later populates can catch
+      # up with a delta bundle instead of a full snapshot.
+      self.RunGit(['config', BOOTSTRAP_GENERATION_KEY,
+                   self._GenerationOf(latest_dir)], cwd=tempdir)
     except Exception as e:
       self.print('Encountered error: %s' % str(e), file=sys.stderr)
       gclient_utils.rmtree(tempdir)
       return False
-    # delete the old directory
-    if os.path.exists(directory):
-      gclient_utils.rmtree(directory)
-    self.Rename(tempdir, directory)
+    with MirrorLock(directory).exclusive():
+      # delete the old directory
+      if os.path.exists(directory):
+        gclient_utils.rmtree(directory)
+      self.Rename(tempdir, directory)
     return True
 
-  def contains_revision(self, revision):
-    if not self.exists():
+  @staticmethod
+  def _GenerationOf(path):
+    """Returns the generation of a snapshot, delta or refs file path."""
+    return re.match(r'(\d+)', path.rstrip('/').rsplit('/', 1)[-1]).group(1)
+
+  def _GetBootstrapGeneration(self):
+    """Returns the generation of the last snapshot or delta applied, if any."""
+    try:
+      return int(subprocess.check_output(
+          [self.git_exe, 'config', '--get', BOOTSTRAP_GENERATION_KEY],
+          cwd=self.mirror_path).strip())
+    except (subprocess.CalledProcessError, ValueError):
+      return None
+
+  def _seconds_since_fetch(self):
+    """Returns how long ago the mirror last fetched, or None if it never did.
+    """
+    try:
+      # Every fetch rewrites FETCH_HEAD.
+      return time.time() - os.path.getmtime(
+          os.path.join(self.mirror_path, 'FETCH_HEAD'))
+    except OSError:
+      return None
+
+  def apply_bootstrap_delta(self):
+    """Catches up with a later snapshot by applying a delta bundle.
+
+    Only mirrors which were bootstrapped from a snapshot know their
+    generation. If there are bundles from that generation, the one to the
+    latest snapshot is downloaded and fetched from, which is much smaller
+    than the full snapshot. Its refs go to SNAPSHOT_REFS_PREFIX, see
+    _drop_snapshot_refs().
+
+    Returns True if a bundle was applied.
+    """
+    current = self._GetBootstrapGeneration()
+    if current is None or not self.bootstrap_bucket:
+      return False
+    storage = self._storage()
+    prefix = '%s/deltas/%d-' % (self._gs_path, current)
+    latest = current
+    for path in storage.ls(self._gs_path + '/deltas')[0]:
+      if not path.startswith(prefix):
+        continue
+      m = re.match(r'(\d+)\.bundle$', path[len(prefix):])
+      if m:
+        latest = max(latest, int(m.group(1)))
+    if latest <= current:
+      self.print('No delta bundle from %d for %s' % (
+          current, self.mirror_path))
       return False
+    delta = '%s%d.bundle' % (prefix, latest)
 
-    if sys.platform.startswith('win'):
-      # Windows .bat scripts use ^ as escape sequence, which means we have to
-      # escape it with itself for every .bat invocation.
-      needle = '%s^^^^{commit}' % revision
-    else:
-      needle = '%s^{commit}' % revision
+    tempdir = tempfile.mkdtemp(prefix='_cache_tmp', dir=self.GetCachePath())
     try:
-      # cat-file exits with 0 on success, that is git object of given hash was
-      # found.
-      self.RunGit(['cat-file', '-e', needle])
+      bundle = os.path.join(tempdir, 'delta.bundle')
+      with self.print_duration_of('download of delta %d-%d' % (
+          current, latest)):
+        if not storage.download_file(delta, bundle):
+          return False
+      self.RunGit(['fetch', bundle, '+refs/*:%s*' % SNAPSHOT_REFS_PREFIX])
+      self.RunGit(['config', BOOTSTRAP_GENERATION_KEY, str(latest)])
       return True
-    except subprocess.CalledProcessError:
+    except subprocess.CalledProcessError as e:
+      self.print('Failed to apply %s: %s' % (delta, e))
       return False
+    finally:
+      gclient_utils.rmtree(tempdir)
+
+  def _drop_snapshot_refs(self):
+    """Deletes the refs apply_bootstrap_delta() fetched a bundle into.
+
+    They only let the following fetch from origin know which commits the
+    mirror already has. Keeping them would make them part of the snapshots
+    and bundles this mirror uploads.
+    """
+    refs = subprocess.check_output(
+        [self.git_exe, 'for-each-ref', '--format=%(refname)',
+         SNAPSHOT_REFS_PREFIX], cwd=self.mirror_path).decode('utf-8').split()
+    if not refs:
+      return
+    proc = subprocess.Popen(
+        [self.git_exe, 'update-ref', '--stdin'], cwd=self.mirror_path,
+        stdin=subprocess.PIPE)
+    proc.communicate(''.join('delete %s\n' % ref for ref in refs).encode(
+        'utf-8'))
+    if proc.returncode:
+      raise subprocess.CalledProcessError(proc.returncode, 'git update-ref')
+
+  def contains_revision(self, revision):
+    return revision in self.contains_revisions([revision])
+
+  def contains_revisions(self, revisions):
+    """Returns the subset of |revisions| which are commits of the mirror.
+
+    Full commit ids are looked up in the RevisionIndex. The revisions it
+    can't tell about are looked up with a single git cat-file.
+    """
+    if not self.exists():
+      return set()
+    with self.lock_shared():
+      found, unknown = RevisionIndex(self.mirror_path).lookup(revisions)
+      if unknown:
+        found.update(scm.GIT.GetExistingCommits(self.mirror_path, unknown))
+    return found
+
+  def update_revision_index(self, rebuild=False):
+    try:
+      RevisionIndex(self.mirror_path).update(self.git_exe, rebuild=rebuild)
+    except (subprocess.CalledProcessError, IOError, OSError) as e:
+      # Lookups fall back to git when the index is stale or missing.
+      self.print('Failed to update the revision index of %s: %s' % (
+          self.mirror_path, e))
 
   def exists(self):
     return os.path.isfile(os.path.join(self.mirror_path, 'config'))
 
+  def lock_shared(self):
+    """Returns a context manager keeping the mirror from being replaced."""
+    return MirrorLock(self.mirror_path).shared()
+
+  def lock_exclusive(self):
+    """Returns a context manager waiting for the readers of the mirror."""
+    return MirrorLock(self.mirror_path).exclusive()
+
   def supported_project(self):
     """Returns true if this repo is known to have a bootstrap zip file."""
     u = urlparse.urlparse(self.url)
@@ -481,7 +982,12 @@ class Mirror(object):
                    '%s and "git cache fetch" again.'
                    % os.path.join(self.mirror_path, 'config'))
 
-  def _ensure_bootstrapped(self, depth, bootstrap, force=False):
+  def _ensure_bootstrapped(self, depth, bootstrap, force=False,
+                           bootstrap_slots=None):
+    """Bootstraps the mirror if it's missing or has too many packs.
+
+    Returns True if a delta bundle was applied to an existing mirror instead.
+    """
     pack_dir = os.path.join(self.mirror_path, 'objects', 'pack')
     pack_files = []
     if os.path.isdir(pack_dir):
@@ -497,7 +1003,12 @@ class Mirror(object):
       if depth and os.path.exists(os.path.join(self.mirror_path, 'shallow')):
         logging.warn(
             'Shallow fetch requested, but repo cache already exists.')
-      return
+      elif not depth and bootstrap:
+        age = self._seconds_since_fetch()
+        if age is None or age > BOOTSTRAP_DELTA_MIN_AGE:
+          with bootstrap_slots or _NoSlots():
+            return self.apply_bootstrap_delta()
+      return False
 
     if self.exists():
       # Re-bootstrapping an existing mirror; preserve existing fetch spec.
@@ -507,11 +1018,16 @@ class Mirror(object):
         # If the mirror path exists but self.exists() returns false, we're
         # in an unexpected state. Nuke the previous mirror directory and
         # start fresh.
-        gclient_utils.rmtree(self.mirror_path)
+        with self.lock_exclusive():
+          gclient_utils.rmtree(self.mirror_path)
       os.mkdir(self.mirror_path)
 
-    bootstrapped = (not depth and bootstrap and
-                    self.bootstrap_repo(self.mirror_path))
+    bootstrapped = False
+    if not depth and bootstrap:
+      # Downloading and unpacking a snapshot is mostly disk bound, so when
+      # mirrors are populated concurrently only a few of them do it at once.
+      with bootstrap_slots or _NoSlots():
+        bootstrapped = self.bootstrap_repo(self.mirror_path)
 
     if not bootstrapped:
       if not self.exists() or not self.supported_project():
@@ -526,9 +1042,11 @@ class Mirror(object):
             'Git cache has a lot of pack files (%d). Tried to re-bootstrap '
             'but failed. Continuing with non-optimized repository.'
             % len(pack_files))
+    return False
 
-  def _fetch(self, rundir, verbose, depth, no_fetch_tags, reset_fetch_config):
-    self.config(rundir, reset_fetch_config)
+  def _fetch(self, rundir, verbose, depth, no_fetch_tags, reset_fetch_config,
+             partial_clone_filter=None):
+    self.config(rundir, reset_fetch_config, partial_clone_filter)
     v = []
     d = []
     t = []
@@ -561,63 +1079,259 @@ class Mirror(object):
                verbose=False,
                ignore_lock=False,
                lock_timeout=0,
-               reset_fetch_config=False):
+               reset_fetch_config=False,
+               bootstrap_slots=None,
+               partial_clone_filter=None):
+    """Creates or updates the mirror.
+
+    bootstrap_slots (threading.Semaphore): if set, held while downloading a
+        bootstrap snapshot, see PopulateMany().
+    partial_clone_filter (str): if set, e.g. to blob:none or tree:0, a new
+        mirror is a partial clone which only has the objects the filter
+        keeps. Defaults to the cache.partialCloneFilter git config for new
+        mirrors, and to their filter for existing ones. Partial mirrors
+        aren't bootstrapped, since snapshots have all the objects.
+    """
     assert self.GetCachePath()
     if shallow and not depth:
       depth = 10000
     gclient_utils.safe_makedirs(self.GetCachePath())
+    if partial_clone_filter is None:
+      if self.exists():
+        partial_clone_filter = self.GetPartialCloneFilter()
+      else:
+        partial_clone_filter = self.GetDefaultPartialCloneFilter()
+    if partial_clone_filter:
+      bootstrap = False
 
     lockfile = Lockfile(self.mirror_path, lock_timeout)
     if not ignore_lock:
       lockfile.lock()
 
+    delta_applied = False
     try:
-      self._ensure_bootstrapped(depth, bootstrap)
-      self._fetch(self.mirror_path, verbose, depth, no_fetch_tags,
-                  reset_fetch_config)
-    except ClobberNeeded:
-      # This is a major failure, we need to clean and force a bootstrap.
-      gclient_utils.rmtree(self.mirror_path)
-      self.print(GIT_CACHE_CORRUPT_MESSAGE)
-      self._ensure_bootstrapped(depth, bootstrap, force=True)
-      self._fetch(self.mirror_path, verbose, depth, no_fetch_tags,
-                  reset_fetch_config)
+      try:
+        delta_applied = self._ensure_bootstrapped(
+            depth, bootstrap, bootstrap_slots=bootstrap_slots)
+        self._fetch(self.mirror_path, verbose, depth, no_fetch_tags,
+                    reset_fetch_config, partial_clone_filter)
+      except ClobberNeeded:
+        # This is a major failure, we need to clean and force a bootstrap.
+        delta_applied = False
+        with self.lock_exclusive():
+          gclient_utils.rmtree(self.mirror_path)
+        self.print(GIT_CACHE_CORRUPT_MESSAGE)
+        self._ensure_bootstrapped(depth, bootstrap, force=True,
+                                  bootstrap_slots=bootstrap_slots)
+        self._fetch(self.mirror_path, verbose, depth, no_fetch_tags,
+                    reset_fetch_config, partial_clone_filter)
+      if delta_applied:
+        delta_applied = False
+        self._drop_snapshot_refs()
+      self.update_revision_index()
+      budget = self.GetMaintenanceBudget()
+      if budget and not depth:
+        self._maintain(budget)
+    finally:
+      try:
+        # When the fetch failed, the next runs won't apply the delta again,
+        # so they wouldn't delete them.
+        if delta_applied:
+          self._drop_snapshot_refs()
+      except subprocess.CalledProcessError as e:
+        self.print('Failed to delete the %s refs of %s: %s' % (
+            SNAPSHOT_REFS_PREFIX, self.mirror_path, e))
+      finally:
+        if not ignore_lock:
+          lockfile.unlock()
+
+  def _pack_sizes(self):
+    pack_dir = os.path.join(self.mirror_path, 'objects', 'pack')
+    if not os.path.isdir(pack_dir):
+      return []
+    return sorted(os.path.getsize(os.path.join(pack_dir, f))
+                  for f in os.listdir(pack_dir) if f.endswith('.pack'))
+
+  def maintain(self, budget=MAINTENANCE_BUDGET, ignore_lock=False,
+               lock_timeout=0):
+    """Keeps reads from the mirror fast after many incremental fetches.
+
+    See _maintain(). Returns the names of the steps which were run.
+    """
+    lockfile = Lockfile(self.mirror_path, lock_timeout)
+    if not ignore_lock:
+      lockfile.lock()
+    try:
+      return self._maintain(budget)
     finally:
       if not ignore_lock:
         lockfile.unlock()
 
+  def _maintain(self, budget):
+    """Runs the maintenance steps in order until |budget| seconds are spent.
+
+    Every step is incremental, so a step which doesn't fit in the budget is
+    left for the next run:
+      commit-graph: adds a layer for the new commits, which speeds up the
+          history walks of fetches, clones and contains_revision.
+      loose-objects: packs the objects which small fetches left loose.
+      repack: combines the small packs left by incremental fetches, through
+          the multi-pack-index, like the incremental-repack task of "git
+          maintenance". Packs repacked by the previous run are removed first,
+          so that running clones had time to stop using them.
+      multi-pack-index: indexes the objects of all packs at once, with a
+          reachability bitmap when git supports it (2.34+) and the packs
+          hold every reachable object.
+    """
+    deadline = time.time() + budget
+    steps = []
+
+    def run_step(name, cmds, exclusive=False):
+      if time.time() >= deadline:
+        self.print('Maintenance budget of %ds spent, skipping %s.' % (
+            budget, name))
+        return False
+      with self.print_duration_of('maintenance %s' % name):
+        if exclusive:
+          with self.lock_exclusive():
+            for cmd in cmds:
+              self.RunGit(cmd)
+        else:
+          for cmd in cmds:
+            self.RunGit(cmd)
+      steps.append(name)
+      return True
+
+    if not self.exists():
+      return steps
+    self.RunGit(['config', 'core.commitGraph', 'true'])
+    self.RunGit(['config', 'core.multiPackIndex', 'true'])
+
+    run_step('commit-graph', [
+        ['commit-graph', 'write', '--reachable', '--split']])
+    run_step('loose-objects', [['repack', '-d', '-l', '-q']])
+
+    sizes = self._pack_sizes()
+    if len(sizes) > 1:
+      # Packs smaller than the second largest one are combined, once their
+      # total size reaches it.
+      batch_size = min(sizes[-2] + 1, MAX_REPACK_BATCH_SIZE)
+      # Readers may still be using the packs which expire removes.
+      run_step('repack', [
+          ['multi-pack-index', 'write'],
+          ['multi-pack-index', 'expire'],
+          ['multi-pack-index', 'repack', '--batch-size=%d' % batch_size]],
+               exclusive=True)
+
+    midx = ['multi-pack-index', 'write']
+    try:
+      if self.GetGitVersion() >= (2, 34):
+        run_step('multi-pack-index', [midx + ['--bitmap']])
+      else:
+        run_step('multi-pack-index', [midx])
+    except subprocess.CalledProcessError:
+      # e.g. objects only reachable through alternates, which can't be in
+      # a bitmap.
+      self.print('Failed to write a bitmap, writing the index without one.')
+      run_step('multi-pack-index', [midx])
+    return steps
+
+  def _GetGenerationNumber(self):
+    return subprocess.check_output(
+        [self.git_exe, 'number', 'master'],
+        cwd=self.mirror_path).decode('utf-8').strip()
+
+  def _UploadDeltas(self, storage, ls_out_set, gen_number):
+    """Uploads bundles from the most recent snapshots to |gen_number|.
+
+    A bundle from generation N holds the objects reachable from the refs of
+    this mirror but not from the refs of snapshot N, recorded in N.refs.
+    """
+    ready = sorted(
+        (int(self._GenerationOf(path)), path[:-len('.ready')])
+        for path in ls_out_set if re.match(r'.*/\d+\.ready$', path))
+    tempdir = tempfile.mkdtemp(prefix='_cache_tmp', dir=self.GetCachePath())
+    try:
+      for base, base_prefix in ready[-MAX_BOOTSTRAP_DELTAS:]:
+        if base >= int(gen_number) or base_prefix + '.refs' not in ls_out_set:
+          continue
+        refs_file = os.path.join(tempdir, '%d.refs' % base)
+        if not storage.download_file(base_prefix + '.refs', refs_file):
+          continue
+        tips = set(line.split()[0] for line in
+                   gclient_utils.FileRead(refs_file).splitlines() if line)
+        # Tips which were since garbage collected can't be prerequisites.
+        check = subprocess.Popen(
+            [self.git_exe, 'cat-file', '--batch-check'], cwd=self.mirror_path,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        out, _ = check.communicate(''.join(
+            '%s\n' % tip for tip in sorted(tips)).encode('utf-8'))
+        tips = [line.split()[0] for line in out.decode('utf-8').splitlines()
+                if not line.endswith(' missing')]
+        if not tips:
+          continue
+        bundle = os.path.join(tempdir, '%d-%s.bundle' % (base, gen_number))
+        try:
+          self.RunGit(['bundle', 'create', bundle, '--all', '--not'] + tips)
+        except subprocess.CalledProcessError:
+          # e.g. nothing changed since |base|, git refuses empty bundles.
+          continue
+        storage.upload_file(bundle, '%s/deltas/%s' % (
+            self._gs_path, os.path.basename(bundle)))
+    finally:
+      gclient_utils.rmtree(tempdir)
+
   def update_bootstrap(self, prune=False, gc_aggressive=False):
+    if self.GetPartialCloneFilter():
+      raise RuntimeError(
+          'Snapshots must have all the objects, but %s is a partial clone.' %
+          self.mirror_path)
     # The folder is <git number>
-    gen_number = subprocess.check_output(
-        [self.git_exe, 'number', 'master'], cwd=self.mirror_path).strip()
-    gsutil = Gsutil(path=self.gsutil_exe, boto_path=None)
+    gen_number = self._GetGenerationNumber()
+    storage = self._storage()
 
     src_name = self.mirror_path
     dest_prefix = '%s/%s' % (self._gs_path, gen_number)
 
     # ls_out lists contents in the format: gs://blah/blah/123...
-    _, ls_out, _ = gsutil.check_call('ls', self._gs_path)
+    ls_out_set, _ = storage.ls(self._gs_path)
 
     # Check to see if folder already exists in gs
-    ls_out_set = set(ls_out.strip().splitlines())
     if (dest_prefix + '/' in ls_out_set and
         dest_prefix + '.ready' in ls_out_set):
       print('Cache %s already exists.' % dest_prefix)
       return
 
+    # Left over if a populate was interrupted after applying a delta.
+    self._drop_snapshot_refs()
+
+    # Bots which have a previous snapshot only need to download these.
+    self._UploadDeltas(storage, ls_out_set, gen_number)
+
     # Run Garbage Collect to compress packfile.
     gc_args = ['gc', '--prune=all']
     if gc_aggressive:
       gc_args.append('--aggressive')
-    self.RunGit(gc_args)
+    with self.lock_exclusive():
+      self.RunGit(gc_args)
+    # gc pruned the commits which are no longer reachable.
+    self.update_revision_index(rebuild=True)
 
-    gsutil.call('-m', 'cp', '-r', src_name, dest_prefix)
+    storage.upload_dir(src_name, dest_prefix)
 
-    # Create .ready file and upload
+    # Record the refs of the snapshot, deltas to later snapshots start there,
+    # then create .ready file and upload.
+    refs_fd, refs_file_name = tempfile.mkstemp(suffix='.refs')
     _, ready_file_name =  tempfile.mkstemp(suffix='.ready')
     try:
-      gsutil.call('cp', ready_file_name, '%s.ready' % (dest_prefix))
+      with os.fdopen(refs_fd, 'wb') as f:
+        f.write(subprocess.check_output(
+            [self.git_exe, 'for-each-ref', '--format=%(objectname) %(refname)'],
+            cwd=self.mirror_path))
+      storage.upload_file(refs_file_name, '%s.refs' % dest_prefix)
+      storage.upload_file(ready_file_name, '%s.ready' % (dest_prefix))
     finally:
+      os.remove(refs_file_name)
       os.remove(ready_file_name)
 
     # remove all other directory/.ready files in the same gs_path
@@ -629,14 +1343,19 @@ class Mirror(object):
     prev_dest_prefix = self._GetMostRecentCacheDirectory(ls_out_set)
     if not prev_dest_prefix:
       return
+    prev_gen_number = self._GenerationOf(prev_dest_prefix)
     for path in ls_out_set:
       if (path == prev_dest_prefix + '/' or
-          path == prev_dest_prefix + '.ready'):
-        continue
-      if path.endswith('.ready'):
-        gsutil.call('rm', path)
+          path == prev_dest_prefix + '.ready' or
+          path == prev_dest_prefix + '.refs' or
+          path == self._gs_path + '/deltas/'):
         continue
-      gsutil.call('-m', 'rm', '-r', path)
+      storage.rm(path)
+    # Only deltas to the kept snapshots are useful.
+    for path in storage.ls(self._gs_path + '/deltas')[0]:
+      if not path.endswith(('-%s.bundle' % gen_number,
+                            '-%s.bundle' % prev_gen_number)):
+        storage.rm(path)
 
 
   @staticmethod
@@ -694,6 +1413,94 @@ class Mirror(object):
 
     return unlocked_repos
 
+def ReadGclientUrls(gclient_file):
+  """Returns the git urls of the solutions and dependencies of a checkout.
+
+  The dependencies are read from the .gclient_entries file written by the last
+  sync, if there is one.
+  """
+  urls = []
+  for filename, key in ((gclient_file, 'solutions'),
+                        (gclient_file + '_entries', 'entries')):
+    if not os.path.exists(filename):
+      continue
+    scope = {}
+    try:
+      exec(gclient_utils.FileRead(filename), scope)
+    except SyntaxError as e:
+      gclient_utils.SyntaxErrorToError(filename, e)
+    values = scope.get(key) or []
+    if key == 'solutions':
+      values = [solution.get('url') for solution in values]
+    else:
+      values = values.values()
+    for url in values:
+      if not url:
+        continue
+      url, _ = gclient_utils.SplitUrlRevision(url)
+      if urlparse.urlparse(url).netloc == CIPD_HOST:
+        continue
+      if url not in urls:
+        urls.append(url)
+  return urls
+
+
+def PopulateMany(urls, jobs, bootstrap_jobs=1, refs=None, print_func=print,
+                 **kwargs):
+  """Populates the mirrors of |urls|, |jobs| of them at a time.
+
+  At most |bootstrap_jobs| mirrors download a bootstrap snapshot at once.
+  Output lines are prefixed with the mirror they come from. Other arguments
+  are passed to Mirror.populate().
+
+  Returns a list of (url, seconds, error) tuples, in the order of |urls|,
+  where error is None if the mirror was populated successfully.
+  """
+  print_lock = threading.Lock()
+  bootstrap_slots = threading.Semaphore(bootstrap_jobs)
+  done = [0]
+
+  def locked_print(message):
+    with print_lock:
+      print_func(message)
+
+  def populate(url):
+    prefix = '[%s] ' % Mirror.UrlToCacheDir(url)
+    mirror = Mirror(url, refs=refs,
+                    print_func=lambda message: locked_print(prefix + message))
+    start = time.time()
+    error = None
+    try:
+      mirror.populate(bootstrap_slots=bootstrap_slots, **kwargs)
+    except Exception as e:
+      error = str(e) or e.__class__.__name__
+    duration = time.time() - start
+    with print_lock:
+      done[0] += 1
+      print_func('%s(%d/%d) %s in %.1fs' % (
+          prefix, done[0], len(urls), 'FAILED' if error else 'done',
+          duration))
+    return url, duration, error
+
+  pool = ThreadPool(max(1, min(jobs, len(urls))))
+  try:
+    return pool.map(populate, urls)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def PrintPopulateSummary(results, print_func=print):
+  """Prints the results of PopulateMany(), slowest mirrors first."""
+  failed = [r for r in results if r[2]]
+  print_func('Populated %d mirrors in %.1fs of fetch time, %d failed:' % (
+      len(results), sum(r[1] for r in results), len(failed)))
+  for url, duration, error in sorted(results, key=lambda r: (-r[1], r[0])):
+    print_func('  %7.1fs  %-6s  %s%s' % (
+        duration, 'FAILED' if error else 'ok', url,
+        ('\n           %s' % error) if error else ''))
+
+
 @subcommand.usage('[url of repo to check for caching]')
 def CMDexists(parser, args):
   """Check to see if there already is a cache of the given repo."""
@@ -740,9 +1547,13 @@ def CMDupdate_bootstrap(parser, args):
   return 0
 
 
-@subcommand.usage('[url of repo to add to or update in cache]')
+@subcommand.usage('[urls of repos to add to or update in cache]')
 def CMDpopulate(parser, args):
-  """Ensure that the cache has all up-to-date objects for the given repo."""
+  """Ensure that the cache has all up-to-date objects for the given repos.
+
+  Several repos can be given, or read from a .gclient file with --gclient-file,
+  in which case they are populated concurrently and a summary is printed.
+  """
   parser.add_option('--depth', type='int',
                     help='Only cache DEPTH commits of history')
   parser.add_option(
@@ -765,15 +1576,37 @@ def CMDpopulate(parser, args):
                     help='Break any existing lock instead of just ignoring it')
   parser.add_option('--reset-fetch-config', action='store_true', default=False,
                     help='Reset the fetch config before populating the cache.')
+  parser.add_option('--filter', dest='partial_clone_filter',
+                    help='Make new caches partial clones which only have the '
+                         'objects kept by this filter, e.g. blob:none or '
+                         'tree:0. Other objects are fetched when needed. '
+                         'Defaults to the cache.partialCloneFilter git '
+                         'config.')
+  parser.add_option('--gclient-file',
+                    help='Populate the caches of the solutions of this '
+                         '.gclient file, and of their dependencies if it was '
+                         'synced before.')
+  parser.add_option('-j', '--jobs', type='int', default=8,
+                    help='Number of repos to populate concurrently, when '
+                         'there are several. Default: %default')
+  parser.add_option('--bootstrap-jobs', type='int', default=2,
+                    help='Number of repos to bootstrap from Google Storage '
+                         'concurrently, when there are several. '
+                         'Default: %default')
 
   options, args = parser.parse_args(args)
-  if not len(args) == 1:
-    parser.error('git cache populate only takes exactly one repo url.')
-  url = args[0]
+  urls = list(args)
+  if options.gclient_file:
+    urls.extend(u for u in ReadGclientUrls(options.gclient_file)
+                if u not in urls)
+  if not urls:
+    parser.error('git cache populate takes at least one repo url.')
+  if options.jobs < 1 or options.bootstrap_jobs < 1:
+    parser.error('--jobs and --bootstrap-jobs must be 1 or higher.')
 
-  mirror = Mirror(url, refs=options.ref)
   if options.break_locks:
-    mirror.unlock()
+    for url in urls:
+      Mirror(url).unlock()
   kwargs = {
       'no_fetch_tags': options.no_fetch_tags,
       'verbose': options.verbose,
@@ -782,10 +1615,55 @@ def CMDpopulate(parser, args):
       'ignore_lock': options.ignore_locks,
       'lock_timeout': options.timeout,
       'reset_fetch_config': options.reset_fetch_config,
+      'partial_clone_filter': options.partial_clone_filter,
   }
   if options.depth:
     kwargs['depth'] = options.depth
-  mirror.populate(**kwargs)
+  if len(urls) == 1:
+    Mirror(urls[0], refs=options.ref).populate(**kwargs)
+    return 0
+
+  results = PopulateMany(urls, options.jobs, options.bootstrap_jobs,
+                         refs=options.ref, **kwargs)
+  PrintPopulateSummary(results)
+  return 1 if any(error for _, _, error in results) else 0
+
+
+@subcommand.usage('[urls of repos to maintain, or -a|--all]')
+def CMDmaintain(parser, args):
+  """Write commit-graphs and multi-pack-indexes, and combine small packs.
+
+  Keeps mirrors updated by many incremental fetches fast to clone from. The
+  work is bounded by --budget, and continues where it stopped on the next run.
+  It can also run after every populate, by setting the cache.maintenanceBudget
+  git config to a number of seconds.
+  """
+  parser.add_option('--all', '-a', action='store_true',
+                    help='Maintain all repository caches')
+  parser.add_option('--budget', type='int', default=MAINTENANCE_BUDGET,
+                    help='Seconds to spend on each repo at most. '
+                         'Default: %default')
+  parser.add_option('--ignore_locks', '--ignore-locks',
+                    action='store_true',
+                    help='Don\'t try to lock repository')
+  options, args = parser.parse_args(args)
+  if bool(args) == bool(options.all):
+    parser.error('git cache maintain takes repo urls, or --all')
+
+  if options.all:
+    cachepath = Mirror.GetCachePath()
+    mirrors = [Mirror.FromPath(os.path.join(cachepath, path))
+               for path in sorted(os.listdir(cachepath))
+               if os.path.isfile(os.path.join(cachepath, path, 'config'))]
+  else:
+    mirrors = [Mirror(url) for url in args]
+  for mirror in mirrors:
+    if not mirror.exists():
+      print('%s is not cached, skipping.' % mirror.url, file=sys.stderr)
+      continue
+    mirror.maintain(options.budget, ignore_lock=options.ignore_locks,
+                    lock_timeout=options.timeout)
+  return 0
 
 
 @subcommand.usage('Fetch new commits into cache and current checkout')
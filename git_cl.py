@@ -52,6 +52,7 @@ import setup_color
 import split_cl
 import subcommand
 import subprocess2
+import trace_events
 import watchlists
 
 from third_party import six
@@ -1426,12 +1427,14 @@ class Changelist(object):
       args.extend(['--issue', str(issue)])
     if patchset:
       args.extend(['--patchset', str(patchset)])
+    if trace_events.enabled():
+      args.extend(['--trace-file', trace_events.child_trace_file()])
 
     return args
 
   def RunHook(
       self, committing, may_prompt, verbose, parallel, upstream, description,
-      all_files):
+      all_files, use_cache=True, timing_report=None):
     """Calls sys.exit() if the hook fails; returns a HookResults otherwise."""
     args = self._GetCommonPresubmitArgs(verbose, upstream)
     args.append('--commit' if committing else '--upload')
@@ -1441,6 +1444,12 @@ class Changelist(object):
       args.append('--parallel')
     if all_files:
       args.append('--all_files')
+    if not use_cache:
+      args.append('--no-cache')
+    if timing_report == '-':
+      args.append('--timing-report')
+    elif timing_report:
+      args.extend(['--timing-report', timing_report])
 
     with gclient_utils.temporary_file() as description_file:
       with gclient_utils.temporary_file() as json_output:
@@ -1520,7 +1529,9 @@ class Changelist(object):
                                   parallel=options.parallel,
                                   upstream=base_branch,
                                   description=description,
-                                  all_files=False)
+                                  all_files=False,
+                                  use_cache=not options.no_cache,
+                                  timing_report=options.timing_report)
       self.ExtendCC(hook_results['more_cc'])
 
     print_stats(git_diff_args)
@@ -4114,6 +4125,12 @@ def CMDpresubmit(parser, args):
   parser.add_option('--parallel', action='store_true',
                     help='Run all tests specified by input_api.RunTests in all '
                          'PRESUBMIT files in parallel.')
+  parser.add_option('--no-cache', action='store_true',
+                    help='Run all the upload checks, instead of reusing the '
+                         'results of those whose inputs did not change.')
+  parser.add_option('--timing-report', metavar='FILE',
+                    help='Time each check, and write all of them to FILE in '
+                         'JSON, or print the slowest ones if FILE is "-".')
   options, args = parser.parse_args(args)
 
   if not options.force and git_common.is_dirty_git_tree('presubmit'):
@@ -4139,7 +4156,9 @@ def CMDpresubmit(parser, args):
       parallel=options.parallel,
       upstream=base_branch,
       description=description,
-      all_files=options.all)
+      all_files=options.all,
+      use_cache=not options.no_cache,
+      timing_report=options.timing_report)
   return 0
 
 
@@ -4325,6 +4344,14 @@ def CMDupload(parser, args):
   parser.add_option('--parallel', action='store_true',
                     help='Run all tests specified by input_api.RunTests in all '
                          'PRESUBMIT files in parallel.')
+  parser.add_option('--no-cache', action='store_true',
+                    help='Run all the presubmit upload checks, instead of '
+                         'reusing the results of those whose inputs did not '
+                         'change.')
+  parser.add_option('--timing-report', metavar='FILE',
+                    help='Time each presubmit check, and write all of them '
+                         'to FILE in JSON, or print the slowest ones if FILE '
+                         'is "-".')
   parser.add_option('--no-autocc', action='store_true',
                     help='Disables automatic addition of CC emails')
   parser.add_option('--private', action='store_true',
@@ -5370,6 +5397,11 @@ class OptionParser(optparse.OptionParser):
     self.add_option(
         '-v', '--verbose', action='count', default=0,
         help='Use 2 times for more debugging info')
+    self.add_option(
+        '--trace-file',
+        help='Write a trace of the subprocesses, HTTP requests and presubmit '
+             'checks to this file, in the Chrome trace format. Load it in '
+             'chrome://tracing.')
 
   def parse_args(self, args=None, _values=None):
     try:
@@ -5406,6 +5438,8 @@ class OptionParser(optparse.OptionParser):
         level=levels[min(options.verbose, len(levels) - 1)],
         format='[%(levelname).1s%(asctime)s %(process)d %(thread)d '
                '%(filename)s] %(message)s')
+    if options.trace_file:
+      trace_events.start(options.trace_file)
 
     return options, args
 
@@ -19,6 +19,7 @@ IMapIterator.__next__ = IMapIterator.next
 # TODO(iannucci): Monkeypatch all other 'wait' methods too.
 
 
+import atexit
 import binascii
 import collections
 import contextlib
@@ -306,6 +307,162 @@ class ProgressPrinter(object):
     del self._thread
 
 
+class CatFile(object):
+  """Long-lived 'git cat-file' processes reading objects of one repository.
+
+  Looking objects up through a single process is much cheaper than spawning a
+  'git rev-parse' or 'git cat-file' for each of them. A '--batch-check'
+  process answers the info() queries and a '--batch' process the read()
+  queries. Each process serves one request at a time, so an instance can be
+  shared between threads.
+
+  Object names are resolved when they are requested, so refs updated in the
+  meantime are seen.
+  """
+
+  # Most bytes of requests written before reading their answers. git doesn't
+  # read new requests while its output is full, so a chunk of requests must fit
+  # in the pipe buffer, which is only 4 KiB on some platforms.
+  CHUNK_BYTES = 4096
+
+  def __init__(self, cwd=None):
+    self.cwd = cwd or os.getcwd()
+    self._procs = {}
+    self._locks = {'--batch': threading.Lock(),
+                   '--batch-check': threading.Lock()}
+
+  def _proc(self, mode):
+    proc = self._procs.get(mode)
+    if proc is None or proc.poll() is not None:
+      proc = subprocess2.Popen(
+          (GIT_EXE, 'cat-file', mode), cwd=self.cwd, stdin=subprocess2.PIPE,
+          stdout=subprocess2.PIPE, stderr=subprocess2.VOID, shell=False)
+      self._procs[mode] = proc
+    return proc
+
+  @classmethod
+  def _chunks(cls, names):
+    """Yields the encoded requests for |names|, in chunks of the names they
+    ask for and the request bytes, at most CHUNK_BYTES unless a single name is
+    longer."""
+    # Checked before anything is written, which would leave answers unread.
+    for name in names:
+      if '\n' in name:
+        raise ValueError('Invalid object name %r' % name)
+    chunk, data = [], []
+    size = 0
+    for name in names:
+      request = (name + '\n').encode('utf-8')
+      if chunk and size + len(request) > cls.CHUNK_BYTES:
+        yield chunk, b''.join(data)
+        chunk, data = [], []
+        size = 0
+      chunk.append(name)
+      data.append(request)
+      size += len(request)
+    if chunk:
+      yield chunk, b''.join(data)
+
+  @staticmethod
+  def _request(proc, data):
+    proc.stdin.write(data)
+    proc.stdin.flush()
+
+  @staticmethod
+  def _header(proc):
+    """Returns the (hash, type, size) of the next answer, None if missing."""
+    line = proc.stdout.readline()
+    if not line:
+      raise IOError('git cat-file exited with %s' % proc.poll())
+    parts = line.decode('utf-8', 'replace').rstrip('\n').rsplit(' ', 2)
+    if len(parts) != 3 or not parts[2].isdigit():
+      # '<name> missing' or '<name> ambiguous'.
+      return None
+    return parts[0], parts[1], int(parts[2])
+
+  def info_multi(self, names):
+    """Returns a (hash, type, size) tuple for each name, None if missing."""
+    names = list(names)
+    ret = []
+    with self._locks['--batch-check']:
+      proc = self._proc('--batch-check')
+      for chunk, data in self._chunks(names):
+        self._request(proc, data)
+        ret.extend(self._header(proc) for _ in chunk)
+    return ret
+
+  def info(self, name):
+    """Returns the (hash, type, size) of the object |name|, None if missing."""
+    return self.info_multi([name])[0]
+
+  @staticmethod
+  def _content(proc):
+    """Returns the (hash, type, data) of the next answer, None if missing."""
+    header = CatFile._header(proc)
+    if header is None:
+      return None
+    sha, typ, size = header
+    data = proc.stdout.read(size + 1)[:size]
+    if len(data) != size:
+      raise IOError('git cat-file exited with %s' % proc.poll())
+    return sha, typ, data
+
+  def read_multi(self, names):
+    """Returns a (hash, type, data) tuple for each name, None if missing.
+
+    The requests are written ahead of reading the answers, so git streams the
+    objects without waiting for a round trip each.
+    """
+    names = list(names)
+    ret = []
+    with self._locks['--batch']:
+      proc = self._proc('--batch')
+      for chunk, data in self._chunks(names):
+        self._request(proc, data)
+        ret.extend(self._content(proc) for _ in chunk)
+    return ret
+
+  def read(self, name):
+    """Returns the (hash, type, data) of the object |name|, None if missing."""
+    return self.read_multi([name])[0]
+
+  def close(self):
+    for mode, proc in list(self._procs.items()):
+      with self._locks[mode]:
+        proc.stdin.close()
+        proc.wait()
+        proc.stdout.close()
+    self._procs.clear()
+
+
+_cat_files = {}
+_cat_files_lock = threading.Lock()
+
+
+def cat_file(cwd=None):
+  """Returns the CatFile of the repository at |cwd| (default: current dir).
+
+  Instances are shared within a process, and processes forked by ScopedPool
+  get their own.
+  """
+  key = (os.getpid(), os.path.realpath(cwd or os.getcwd()))
+  with _cat_files_lock:
+    if key not in _cat_files:
+      _cat_files[key] = CatFile(key[1])
+    return _cat_files[key]
+
+
+def close_cat_files():
+  """Stops the processes of all the CatFile instances of this process."""
+  with _cat_files_lock:
+    for key in list(_cat_files):
+      if key[0] == os.getpid():
+        _cat_files.pop(key).close()
+
+
+atexit.register(close_cat_files)
+
+
 def once(function):
   """@Decorates |function| so that it only performs its action once, no matter
   how many times the decorated |function| is called."""
@@ -551,15 +708,29 @@ def get_or_create_merge_base(branch, parent=None):
   return base
 
 
+def _is_object_name(reflike):
+  """Returns True if git resolves |reflike| the same way as cat-file would.
+
+  Ranges, negations and options only make sense to rev-parse.
+  """
+  return bool(reflike) and not (
+      reflike.startswith(('-', '^')) or '..' in reflike or
+      any(c.isspace() for c in reflike))
+
+
 def hash_multi(*reflike):
+  if all(_is_object_name(r) for r in reflike):
+    infos = cat_file().info_multi(reflike)
+    if all(infos):
+      return [info[0] for info in infos]
+  # Let rev-parse deal with (and report) anything cat-file couldn't resolve.
   return run('rev-parse', *reflike).splitlines()
 
 
 def hash_one(reflike, short=False):
-  args = ['rev-parse', reflike]
-  if short:
-    args.insert(1, '--short')
-  return run(*args)
+  if not short:
+    return hash_multi(reflike)[0]
+  return run('rev-parse', '--short', reflike)
 
 
 def in_rebase():
@@ -980,19 +1151,44 @@ def tree(treeref, recurse=False):
     ref is the hex encoded hash of the entry.
   """
   ret = {}
-  opts = ['ls-tree', '--full-tree']
-  if recurse:
-    opts.append('-r')
-  opts.append(treeref)
-  try:
-    for line in run(*opts).splitlines():
-      mode, typ, ref, name = line.split(None, 3)
-      ret[name] = (mode, typ, ref)
-  except subprocess2.CalledProcessError:
+  service = cat_file()
+  obj = service.read(treeref)
+  if obj is not None and obj[1] in ('commit', 'tag'):
+    # A '^{tree}' suffix would be taken as part of the path in 'rev:path'.
+    obj = service.read(obj[0] + '^{tree}')
+  if obj is None or obj[1] != 'tree':
     return None
+  pending = [('', obj[2])]
+  while pending:
+    prefix, data = pending.pop()
+    for mode, name, ref in _parse_tree(data):
+      name = prefix + name
+      if mode == '040000':
+        if recurse:
+          pending.append((name + '/', service.read(ref)[2]))
+          continue
+        typ = 'tree'
+      elif mode == '160000':
+        typ = 'commit'
+      else:
+        typ = 'blob'
+      ret[name] = (mode, typ, ref)
   return ret
 
 
+def _parse_tree(data):
+  """Yields the (mode, name, hex hash) of the entries of a raw tree object."""
+  pos = 0
+  while pos < len(data):
+    space = data.index(b' ', pos)
+    nul = data.index(b'\0', space)
+    mode = data[pos:space].decode('ascii').zfill(6)
+    name = data[space + 1:nul].decode('utf-8', 'replace')
+    ref = binascii.hexlify(data[nul + 1:nul + 21]).decode('ascii')
+    yield mode, name, ref
+    pos = nul + 21
+
+
 def get_remote_url(remote='origin'):
   try:
     return run('config', 'remote.%s.url' % remote)
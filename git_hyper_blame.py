@@ -11,10 +11,17 @@ from __future__ import unicode_literals
 
 import argparse
 import collections
+import hashlib
+import io
+import json
 import logging
+import multiprocessing
 import os
+import re
 import subprocess2
 import sys
+import tempfile
+import zlib
 
 import git_common
 import git_dates
@@ -26,6 +33,18 @@ logging.getLogger().setLevel(logging.INFO)
 
 DEFAULT_IGNORE_FILE_NAME = '.git-blame-ignore-revs'
 
+# Name of the directory, under the git dir, holding the BlameCache.
+CACHE_DIR_NAME = 'hyper-blame-cache'
+
+# Total size of the cached entries above which the least recently used ones
+# are removed.
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Bumped whenever the format of the cached entries changes.
+CACHE_VERSION = 2
+
+FULL_HASH_RE = re.compile(r'^[0-9a-f]{40}$')
+
 
 class Commit(object):
   """Info about a commit."""
@@ -53,11 +72,16 @@ BlameLine = collections.namedtuple(
     'commit context lineno_then lineno_now modified')
 
 
-def parse_blame(blameoutput):
-  """Parses the output of git blame -p into a data structure."""
+def parse_blame(blameoutput, commits=None):
+  """Parses the output of git blame -p into a data structure.
+
+  Args:
+    commits: An optional dict from (commithash, filename) to Commit, shared by
+             several blames so that each of their commits is only kept once.
+  """
   lines = blameoutput.split('\n')
   i = 0
-  commits = {}
+  seen = {}
 
   while i < len(lines):
     # Read a commit line and parse it.
@@ -71,10 +95,10 @@ def parse_blame(blameoutput):
     lineno_now = int(commitline[2])
 
     try:
-      commit = commits[commithash]
+      commit = seen[commithash]
     except KeyError:
       commit = Commit(commithash)
-      commits[commithash] = commit
+      seen[commithash] = commit
 
     # Read commit details until we find a context line.
     while i < len(lines):
@@ -91,6 +115,8 @@ def parse_blame(blameoutput):
       setattr(commit, key.replace('-', '_'), value)
 
     context = line[1:]
+    if commits is not None:
+      commit = commits.setdefault((commithash, commit.filename), commit)
 
     yield BlameLine(commit, context, lineno_then, lineno_now, False)
 
@@ -146,9 +172,165 @@ def pretty_print(outbuf, parsedblame, show_filenames=False):
   print_table(outbuf, table, align='llllrl' if show_filenames else 'lllrl')
 
 
-def get_parsed_blame(filename, revision='HEAD'):
+def serialize_blame(parsedblame):
+  """Returns a JSON-compatible form of the output of parse_blame."""
+  commits = []
+  indices = {}
+  lines = []
+  for line in parsedblame:
+    commithash = line.commit.commithash
+    if commithash not in indices:
+      indices[commithash] = len(commits)
+      commits.append(vars(line.commit))
+    lines.append([indices[commithash], line.lineno_then, line.lineno_now,
+                  line.context])
+  return {'commits': commits, 'lines': lines}
+
+
+def deserialize_blame(data, commits=None):
+  """Inverse of serialize_blame. |commits| is as for parse_blame."""
+  line_commits = []
+  for fields in data['commits']:
+    commit = Commit(fields['commithash'])
+    for key, value in fields.items():
+      setattr(commit, key, value)
+    if commits is not None:
+      commit = commits.setdefault((commit.commithash, commit.filename), commit)
+    line_commits.append(commit)
+  return [BlameLine(line_commits[index], context, lineno_then, lineno_now,
+                    False)
+          for index, lineno_then, lineno_now, context in data['lines']]
+
+
+class BlameCache(object):
+  """On-disk cache of parsed blames and diff hunks, shared by invocations.
+
+  Blames are keyed by (commit, path) and by |blame_inputs|, the
+  fingerprint of the mailmap and blame config they were made with (see
+  get_blame_inputs()). Diff hunks are keyed by the two 'commit:path' blobs
+  they compare. Only full commit hashes are used as keys, so an entry is only
+  reused for the exact inputs it was computed from. Each entry is a
+  zlib-compressed JSON file; once the entries take more than |max_bytes|,
+  trim() removes the least recently used ones.
+  """
+
+  def __init__(self, path, max_bytes=CACHE_MAX_BYTES, blame_inputs=''):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.blame_inputs = blame_inputs
+    self._written = False
+
+  @staticmethod
+  def cacheable(revision):
+    return bool(FULL_HASH_RE.match(revision.split(':', 1)[0]))
+
+  def _entry_path(self, kind, key):
+    digest = hashlib.sha1(
+        json.dumps([CACHE_VERSION, kind] + list(key)).encode('utf-8'))
+    digest = digest.hexdigest()
+    return os.path.join(self.path, digest[:2], digest[2:])
+
+  def get(self, kind, key):
+    """Returns the value stored for |kind| and |key|, or None."""
+    path = self._entry_path(kind, key)
+    try:
+      with open(path, 'rb') as f:
+        value = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+      # Record the use, for trim().
+      os.utime(path, None)
+      return value
+    except (IOError, OSError, ValueError, zlib.error):
+      return None
+
+  def set(self, kind, key, value):
+    path = self._entry_path(kind, key)
+    data = zlib.compress(json.dumps(value, separators=(',', ':')).encode(
+        'utf-8'))
+    try:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      if os.path.exists(path):
+        os.remove(path)
+      os.rename(tmp, path)
+      self._written = True
+    except (IOError, OSError) as e:
+      logging.debug('Could not write %s: %s', path, e)
+
+  def trim(self):
+    """Removes the least recently used entries beyond max_bytes."""
+    if not self._written:
+      return
+    entries = []
+    total = 0
+    for dirpath, _, filenames in os.walk(self.path):
+      for name in filenames:
+        path = os.path.join(dirpath, name)
+        try:
+          st = os.stat(path)
+        except OSError:
+          continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
+    self._written = False
+
+
+def get_blame_inputs():
+  """Returns a fingerprint of what git blame reads besides the commit and path.
+
+  That is the blame.* and mailmap.* config, the files they name and the
+  .mailmap at the root of the checkout (the current directory).
+  """
+  try:
+    config = git_common.run('config', '-z', '--get-regexp',
+                            r'^(blame|mailmap)\.')
+  except subprocess2.CalledProcessError:
+    # No such config.
+    config = ''
+  digest = hashlib.sha1(config.encode('utf-8'))
+  files = ['.mailmap']
+  for entry in config.split('\0'):
+    key, _, value = entry.partition('\n')
+    if key in ('blame.ignorerevsfile', 'mailmap.file'):
+      files.append(os.path.expanduser(value))
+    elif key == 'mailmap.blob':
+      try:
+        digest.update(git_common.hash_one(value).encode('utf-8'))
+      except subprocess2.CalledProcessError:
+        pass
+  for path in files:
+    digest.update(b'\0' + path.encode('utf-8') + b'\0')
+    try:
+      with open(path, 'rb') as f:
+        digest.update(hashlib.sha1(f.read()).hexdigest().encode('utf-8'))
+    except (IOError, OSError):
+      pass
+  return digest.hexdigest()
+
+
+def get_parsed_blame(filename, revision='HEAD', cache=None, commits=None):
+  use_cache = cache is not None and cache.cacheable(revision)
+  if use_cache:
+    key = (revision, filename, cache.blame_inputs)
+    data = cache.get('blame', key)
+    if data is not None:
+      return deserialize_blame(data, commits)
   blame = git_common.blame(filename, revision=revision, porcelain=True)
-  return list(parse_blame(blame))
+  parsed = list(parse_blame(blame, commits))
+  if use_cache:
+    cache.set('blame', key, serialize_blame(parsed))
+  return parsed
 
 
 # Map from (oldrev, newrev) to hunk list (caching the results of git diff, but
@@ -158,7 +340,7 @@ def get_parsed_blame(filename, revision='HEAD'):
 diff_hunks_cache = {}
 
 
-def cache_diff_hunks(oldrev, newrev):
+def cache_diff_hunks(oldrev, newrev, cache=None):
   def parse_start_length(s):
     # Chop the '-' or '+'.
     s = s[1:]
@@ -175,6 +357,15 @@ def cache_diff_hunks(oldrev, newrev):
   except KeyError:
     pass
 
+  use_cache = (cache is not None and cache.cacheable(oldrev) and
+               cache.cacheable(newrev))
+  if use_cache:
+    hunks = cache.get('hunks', (oldrev, newrev))
+    if hunks is not None:
+      hunks = [(tuple(old), tuple(new)) for old, new in hunks]
+      diff_hunks_cache[(oldrev, newrev)] = hunks
+      return hunks
+
   # Use -U0 to get the smallest possible hunks.
   diff = git_common.diff(oldrev, newrev, '-U0')
 
@@ -188,11 +379,13 @@ def cache_diff_hunks(oldrev, newrev):
     hunks.append(ranges)
 
   diff_hunks_cache[(oldrev, newrev)] = hunks
+  if use_cache:
+    cache.set('hunks', (oldrev, newrev), hunks)
   return hunks
 
 
 def approx_lineno_across_revs(filename, newfilename, revision, newrevision,
-                              lineno):
+                              lineno, cache=None):
   """Computes the approximate movement of a line number between two revisions.
 
   Consider line |lineno| in |filename| at |revision|. This function computes the
@@ -205,6 +398,7 @@ def approx_lineno_across_revs(filename, newfilename, revision, newrevision,
     revision: A git revision.
     newrevision: Another git revision. Note: Can be ahead or behind |revision|.
     lineno: Line number within |filename| at |revision|.
+    cache: An optional BlameCache for the diff hunks.
 
   Returns:
     Line number within |newfilename| at |newrevision|.
@@ -218,7 +412,7 @@ def approx_lineno_across_revs(filename, newfilename, revision, newrevision,
   # only way to diff a file that has been renamed.
   old = '%s:%s' % (revision, filename)
   new = '%s:%s' % (newrevision, newfilename)
-  hunks = cache_diff_hunks(old, new)
+  hunks = cache_diff_hunks(old, new, cache)
 
   cumulative_offset = 0
 
@@ -255,7 +449,7 @@ def approx_lineno_across_revs(filename, newfilename, revision, newrevision,
   return lineno + cumulative_offset
 
 
-def hyper_blame(outbuf, ignored, filename, revision):
+def hyper_blame(outbuf, ignored, filename, revision, cache=None, commits=None):
   # Map from commit to parsed blame from that commit.
   blame_from = {}
 
@@ -263,7 +457,7 @@ def hyper_blame(outbuf, ignored, filename, revision):
     try:
       return blame_from[commithash]
     except KeyError:
-      parsed = get_parsed_blame(filename, commithash)
+      parsed = get_parsed_blame(filename, commithash, cache, commits)
       blame_from[commithash] = parsed
       return parsed
 
@@ -299,7 +493,7 @@ def hyper_blame(outbuf, ignored, filename, revision):
       # same line on previouscommit.
       lineno_previous = approx_lineno_across_revs(
           line.commit.filename, previousfilename, line.commit.commithash,
-          previouscommit, line.lineno_then)
+          previouscommit, line.lineno_then, cache)
       logging.debug('ignore commit %s on line p%d/t%d/n%d',
                     line.commit.commithash, lineno_previous, line.lineno_then,
                     line.lineno_now)
@@ -325,6 +519,63 @@ def hyper_blame(outbuf, ignored, filename, revision):
   return 0
 
 
+def hyper_blame_files(outbuf, ignored, filenames, revision, cache=None,
+                      jobs=1):
+  """Runs hyper_blame on each of |filenames| using a pool of |jobs| threads.
+
+  The blames are written to |outbuf| in the order of |filenames|, each under a
+  header naming its file, as soon as they and the ones before them are done.
+  The Commit objects and the diff hunks are shared by all the files.
+
+  Returns:
+    The first non-zero return code of hyper_blame, or 0.
+  """
+  commits = {}
+
+  def blame_one(filename):
+    filebuf = io.BytesIO()
+    retval = hyper_blame(filebuf, ignored, filename, revision, cache, commits)
+    return filename, retval, filebuf.getvalue()
+
+  retval = 0
+  with git_common.ScopedPool(jobs, kind='threads') as pool:
+    results = pool.imap(blame_one, filenames)
+    for i, (filename, file_retval, output) in enumerate(results):
+      retval = retval or file_retval
+      header = '%s==> %s <==\n' % ('\n' if i else '', filename)
+      try:
+        outbuf.write(header.encode('utf-8') + output)
+      except IOError:  # pragma: no cover
+        # Can happen on Windows if the pipe is closed early.
+        pass
+  return retval
+
+
+def list_files(revision, directory):
+  """Lists the files under |directory| at |revision|, submodules excluded."""
+  files = []
+  output = git_common.run('ls-tree', '-r', '-z', revision, '--', directory)
+  for entry in output.split('\0'):
+    if not entry:
+      continue
+    info, path = entry.split('\t', 1)
+    if info.split()[1] == 'blob':
+      files.append(path)
+  return files
+
+
+def find_directories(revision, paths):
+  """Returns the indices of |paths| which are directories at |revision|.
+
+  |paths| are relative to the root of the repository. Missing paths and a bad
+  |revision| aren't directories, the blame reports them.
+  """
+  names = ['%s:%s' % (revision, '' if path == os.curdir else
+                      path.replace(os.sep, '/')) for path in paths]
+  infos = git_common.cat_file().info_multi(names)
+  return set(i for i, info in enumerate(infos) if info and info[1] == 'tree')
+
+
 def parse_ignore_file(ignore_file):
   for line in ignore_file:
     line = line.split('#', 1)[0].strip()
@@ -343,9 +594,19 @@ def main(args, outbuf):
   parser.add_argument('--no-default-ignores', dest='no_default_ignores',
                       action='store_true',
                       help='Do not ignore commits from .git-blame-ignore-revs.')
+  parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                      help='Do not read or write the blame cache kept under '
+                           '.git/%s.' % CACHE_DIR_NAME)
   parser.add_argument('revision', nargs='?', default='HEAD', metavar='REVISION',
                       help='revision to look at')
-  parser.add_argument('filename', metavar='FILE', help='filename to blame')
+  parser.add_argument('filenames', nargs='+', metavar='FILE',
+                      help='files to blame, or directories to blame all the '
+                           'files of at REVISION; REVISION must be given when '
+                           'blaming several files')
+  parser.add_argument('-j', '--jobs', type=int,
+                      default=multiprocessing.cpu_count(),
+                      help='number of files to blame in parallel '
+                           '(default: %(default)s)')
 
   args = parser.parse_args(args)
   try:
@@ -354,14 +615,15 @@ def main(args, outbuf):
     sys.stderr.write(e.stderr.decode())
     return e.returncode
 
-  # Make filename relative to the repository root, and cd to the root dir (so
+  # Make filenames relative to the repository root, and cd to the root dir (so
   # all filenames throughout this script are relative to the root).
-  filename = os.path.relpath(args.filename, repo_root)
+  filenames = [os.path.relpath(f, repo_root) for f in args.filenames]
   os.chdir(repo_root)
 
-  # Normalize filename so we can compare it to other filenames git gives us.
-  filename = os.path.normpath(filename)
-  filename = os.path.normcase(filename)
+  # Normalize filenames so we can compare them to other filenames git gives us.
+  filenames = [os.path.normcase(os.path.normpath(f)) for f in filenames]
+  # Directories are expanded at REVISION, whatever the working tree has.
+  directories = find_directories(args.revision, filenames)
 
   ignored_list = list(args.ignored)
   if not args.no_default_ignores and os.path.exists(DEFAULT_IGNORE_FILE_NAME):
@@ -373,14 +635,44 @@ def main(args, outbuf):
       ignored_list.extend(parse_ignore_file(ignore_file))
 
   ignored = set()
-  for c in ignored_list:
+  try:
+    # Resolve the whole list at once, ignore files can be long.
+    ignored.update(git_common.hash_multi(*ignored_list))
+  except subprocess2.CalledProcessError:
+    for c in ignored_list:
+      try:
+        ignored.add(git_common.hash_one(c))
+      except subprocess2.CalledProcessError as e:
+        # Custom warning string (the message from git-rev-parse is
+        # inappropriate).
+        sys.stderr.write('warning: unknown revision \'%s\'.\n' % c)
+
+  cache = None
+  if not args.no_cache:
+    git_dir = os.path.abspath(git_common.run('rev-parse', '--git-common-dir'))
+    cache = BlameCache(os.path.join(git_dir, CACHE_DIR_NAME),
+                       blame_inputs=get_blame_inputs())
+
+  try:
+    if len(filenames) == 1 and not directories:
+      return hyper_blame(outbuf, ignored, filenames[0], args.revision, cache)
+
     try:
-      ignored.add(git_common.hash_one(c))
+      revision = git_common.hash_one(args.revision)
+      files = []
+      for i, filename in enumerate(filenames):
+        if i in directories:
+          files.extend(list_files(revision, filename))
+        else:
+          files.append(filename)
     except subprocess2.CalledProcessError as e:
-      # Custom warning string (the message from git-rev-parse is inappropriate).
-      sys.stderr.write('warning: unknown revision \'%s\'.\n' % c)
-
-  return hyper_blame(outbuf, ignored, filename, args.revision)
+      sys.stderr.write(e.stderr.decode())
+      return e.returncode
+    return hyper_blame_files(outbuf, ignored, files, revision, cache,
+                             max(1, args.jobs))
+  finally:
+    if cache is not None:
+      cache.trim()
 
 
 if __name__ == '__main__':  # pragma: no cover
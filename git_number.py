@@ -38,6 +38,8 @@ import subprocess2
 
 CHUNK_FMT = '!20sL'
 CHUNK_SIZE = struct.calcsize(CHUNK_FMT)
+HASH_SIZE = 20
+NUM_FMT = '!L'
 DIRTY_TREES = collections.defaultdict(int)
 REF = 'refs/number/commits'
 AUTHOR_NAME = 'git-number'
@@ -66,32 +68,128 @@ def pathlify(hash_prefix):
     return '/'.join('%02x' % ord(b) for b in hash_prefix)
 
 
+class NumberTree(object):
+  """The generation numbers of the commits of one prefix.
+
+  Maps full binary commit hashes to numbers, like a dict. The numbers loaded
+  from git are kept in the blob they are stored in, whose entries are sorted
+  by hash, and are binary searched in place. Only the numbers set since then
+  are kept in a dict. This takes 24 bytes per commit, instead of the ~130
+  bytes of a bytes object, an int and a dict slot.
+  """
+
+  def __init__(self, raw=b''):
+    self._raw = raw[:len(raw) - len(raw) % CHUNK_SIZE]
+    self._count = len(self._raw) // CHUNK_SIZE
+    self._added = {}
+
+  def _find(self, commit_hash):
+    """Returns the offset of the entry of |commit_hash| in the blob, or None."""
+    raw = self._raw
+    lo, hi = 0, self._count
+    while lo < hi:
+      mid = (lo + hi) // 2
+      start = mid * CHUNK_SIZE
+      entry_hash = raw[start:start + HASH_SIZE]
+      if entry_hash < commit_hash:
+        lo = mid + 1
+      elif entry_hash > commit_hash:
+        hi = mid
+      else:
+        return start
+    return None
+
+  def get(self, commit_hash, default=None):
+    num = self._added.get(commit_hash)
+    if num is not None:
+      return num
+    start = self._find(commit_hash)
+    if start is None:
+      return default
+    return struct.unpack_from(NUM_FMT, self._raw, start + HASH_SIZE)[0]
+
+  def __getitem__(self, commit_hash):
+    num = self.get(commit_hash)
+    if num is None:
+      raise KeyError(commit_hash)
+    return num
+
+  def __setitem__(self, commit_hash, num):
+    self._added[commit_hash] = num
+
+  def __contains__(self, commit_hash):
+    return self.get(commit_hash) is not None
+
+  def __len__(self):
+    return self._count + sum(
+        1 for h in self._added if self._find(h) is None)
+
+  def items(self):
+    """Yields the (commit hash, number) entries, the stored ones sorted."""
+    for commit_hash, num in _iter_number_tree(self._raw):
+      if commit_hash not in self._added:
+        yield commit_hash, num
+    for item in self._added.items():
+      yield item
+
+
 @git.memoize_one(threadsafe=False)
 def get_number_tree(prefix_bytes):
-  """Returns a dictionary of the git-number registry specified by
+  """Returns the NumberTree of the git-number registry specified by
   |prefix_bytes|.
 
-  This is in the form of {<full binary ref>: <gen num> ...}
+  This maps each <full binary ref> to its <gen num>.
 
-  >>> get_number_tree('\x83\xb4')
-  {'\x83\xb4\xe3\xe4W\xf9J*\x8f/c\x16\xecD\xd1\x04\x8b\xa9qz': 169, ...}
+  >>> tree = get_number_tree('\x83\xb4')
+  >>> tree['\x83\xb4\xe3\xe4W\xf9J*\x8f/c\x16\xecD\xd1\x04\x8b\xa9qz']
+  169
   """
   ref = '%s:%s' % (REF, pathlify(prefix_bytes))
 
-  try:
-    raw = git.run('cat-file', 'blob', ref, autostrip=False, decode=False)
-    return dict(struct.unpack_from(CHUNK_FMT, raw, i * CHUNK_SIZE)
-                for i in range(len(raw) // CHUNK_SIZE))
-  except subprocess2.CalledProcessError:
-    return {}
+  obj = git.cat_file().read(ref)
+  if obj is None or obj[1] != 'blob':
+    return NumberTree()
+  return NumberTree(obj[2])
+
+
+def _iter_number_tree(raw):
+  """Returns an iterator over the (commit hash, number) entries of a blob."""
+  raw = raw[:len(raw) - len(raw) % CHUNK_SIZE]
+  if hasattr(struct, 'iter_unpack'):
+    # Unpacks all the entries in C.
+    return struct.iter_unpack(CHUNK_FMT, raw)
+  return (struct.unpack_from(CHUNK_FMT, raw, i * CHUNK_SIZE)
+          for i in range(len(raw) // CHUNK_SIZE))
+
+
+def load_number_trees():
+  """Returns the number trees of all the prefixes, as {prefix: tree}.
+
+  All the blobs are read through a single 'git cat-file --batch' stream,
+  instead of a request and answer per prefix.
+  """
+  entries = git.tree(REF, recurse=True) or {}
+  prefixes = []
+  blobs = []
+  for path, (_, typ, ref) in sorted(entries.items()):
+    if typ == 'blob':
+      prefixes.append(binascii.unhexlify(path.replace('/', '')))
+      blobs.append(ref)
+  trees = dict((prefix, NumberTree()) for prefix in all_prefixes())
+  for prefix, obj in zip(prefixes, git.cat_file().read_multi(blobs)):
+    if obj is not None:
+      trees[prefix] = NumberTree(obj[2])
+  return trees
 
 
-@git.memoize_one(threadsafe=False)
 def get_num(commit_hash):
   """Returns the generation number for a commit.
 
   Returns None if the generation number for this commit hasn't been calculated
   yet (see load_generation_numbers()).
+
+  Not memoized: the NumberTree lookup is cheap, and a cache of every commit
+  looked up would take more memory than the trees themselves.
   """
   return get_number_tree(commit_hash[:PREFIX_LEN]).get(commit_hash)
 
@@ -99,7 +197,6 @@ def get_num(commit_hash):
 def clear_caches(on_disk=False):
   """Clears in-process caches for e.g. unit testing."""
   get_number_tree.clear()
-  get_num.clear()
   if on_disk:
     git.run('update-ref', '-d', REF)
 
@@ -178,16 +275,11 @@ def finalize(targets):
   DIRTY_TREES.clear()
 
 
-def preload_tree(prefix):
-  """Returns the prefix and parsed tree object for the specified prefix."""
-  return prefix, get_number_tree(prefix)
-
-
 def all_prefixes(depth=PREFIX_LEN):
   if sys.version_info.major == 3:
-    prefixes = [bytes([i]) for i in range(255)]
+    prefixes = [bytes([i]) for i in range(256)]
   else:
-    prefixes = [chr(i) for i in range(255)]
+    prefixes = [chr(i) for i in range(256)]
   for x in prefixes:
     # This isn't covered because PREFIX_LEN currently == 1
     if depth > 1:  # pragma: no cover
@@ -198,8 +290,8 @@ def all_prefixes(depth=PREFIX_LEN):
 
 
 def load_generation_numbers(targets):
-  """Populates the caches of get_num and get_number_tree so they contain
-  the results for |targets|.
+  """Populates the cache of get_number_tree so that get_num returns the
+  results for |targets|.
 
   Loads cached numbers from disk, and calculates missing numbers if one or
   more of |targets| is newer than the cached calculations.
@@ -225,8 +317,9 @@ def load_generation_numbers(targets):
         empty)
     git.run('update-ref', REF, commit_hash)
 
-  with git.ScopedPool(kind=POOL_KIND) as pool:
-    preload_iter = pool.imap_unordered(preload_tree, all_prefixes())
+  # The trees load while rev-list runs.
+  with git.ScopedPool(1, kind='threads') as pool:
+    trees = pool.apply_async(load_number_trees)
 
     rev_list = []
 
@@ -242,7 +335,10 @@ def load_generation_numbers(targets):
         rev_list.append((tokens[0], tokens[1:]))
         inc()
 
-    get_number_tree.update(preload_iter)
+    # Trees already in the cache may have numbers which aren't saved yet.
+    for prefix, tree in trees.get().items():
+      if get_number_tree.get(prefix) is None:
+        get_number_tree.set(prefix, tree)
 
   with git.ProgressPrinter('Counting: %%(count)d/%d' % len(rev_list)) as inc:
     for commit_hash, pars in rev_list:
@@ -251,7 +347,6 @@ def load_generation_numbers(targets):
       prefix = commit_hash[:PREFIX_LEN]
       get_number_tree(prefix)[commit_hash] = num
       DIRTY_TREES[prefix] += 1
-      get_num.set(commit_hash, num)
 
       inc()
 
@@ -137,8 +137,12 @@ def CheckAuthorizedAuthor(input_api, output_api, bot_whitelist=None):
 
 def CheckDoNotSubmitInFiles(input_api, output_api):
   """Checks that the user didn't add 'DO NOT ''SUBMIT' to any files."""
-  # We want to check every text file, not just source files.
-  file_filter = lambda x : x
+  return _RunLineChecks(
+      input_api, [_DoNotSubmitInFilesCheck(input_api, output_api)])[0]
+
+
+def _DoNotSubmitInFilesCheck(_input_api, output_api):
+  """Returns the _LineCheck of CheckDoNotSubmitInFiles()."""
   keyword = 'DO NOT ''SUBMIT'
   def DoNotSubmitRule(extension, line):
     try:
@@ -147,11 +151,14 @@ def CheckDoNotSubmitInFiles(input_api, output_api):
     except UnicodeDecodeError:
       return True
 
-  errors = _FindNewViolationsOfRule(DoNotSubmitRule, input_api, file_filter)
-  text = '\n'.join('Found %s in %s' % (keyword, loc) for loc in errors)
-  if text:
-    return [output_api.PresubmitError(text)]
-  return []
+  def report(errors):
+    text = '\n'.join('Found %s in %s' % (keyword, loc) for loc in errors)
+    if text:
+      return [output_api.PresubmitError(text)]
+    return []
+
+  # We want to check every text file, not just source files.
+  return _LineCheck(DoNotSubmitRule, report, file_filter=lambda x : x)
 
 
 def CheckChangeLintsClean(input_api, output_api, source_file_filter=None,
@@ -250,20 +257,26 @@ def CheckGenderNeutral(input_api, output_api, source_file_filter=None):
   """Checks that there are no gendered pronouns in any of the text files to be
   submitted.
   """
+  return _RunLineChecks(input_api, [_GenderNeutralCheck(
+      input_api, output_api, source_file_filter)])[0]
+
+
+def _GenderNeutralCheck(input_api, output_api, source_file_filter):
+  """Returns the _LineCheck of CheckGenderNeutral()."""
   gendered_re = input_api.re.compile(
       r'(^|\s|\(|\[)([Hh]e|[Hh]is|[Hh]ers?|[Hh]im|[Ss]he|[Gg]uys?)\\b')
 
-  errors = []
-  for f in input_api.AffectedFiles(include_deletes=False,
-                                   file_filter=source_file_filter):
-    for line_num, line in f.ChangedContents():
-      if gendered_re.search(line):
-        errors.append('%s (%d): %s' % (f.LocalPath(), line_num, line))
-
-  if len(errors):
-    return [output_api.PresubmitPromptWarning('Found a gendered pronoun in:',
-                                              long_text='\n'.join(errors))]
-  return []
+  def report(errors):
+    if len(errors):
+      return [output_api.PresubmitPromptWarning('Found a gendered pronoun in:',
+                                                long_text='\n'.join(errors))]
+    return []
+
+  return _LineCheck(
+      lambda _, line: not gendered_re.search(line), report,
+      file_filter=source_file_filter,
+      error_formatter=lambda filename, line_num, line: '%s (%d): %s' % (
+          filename, line_num, line))
 
 
 
@@ -272,6 +285,79 @@ def _ReportErrorFileAndLine(filename, line_num, dummy_line):
   return '%s:%s' % (filename, line_num)
 
 
+class _LineCheck(object):
+  """A canned check made of a per-line rule, to be run by _RunLineChecks().
+
+  Attributes:
+    rule: a callable taking a file extension and line of input and returning
+      True if the rule is satisfied and False if there was a problem.
+    report: a callable taking the list of errors found and returning the
+      results of the check.
+    file_filter: a filter for the affected files to check, None for all.
+    error_formatter: a callable taking (filename, line_number, line) and
+      returning a formatted error string.
+    file_rule: an optional callable taking (filename, lines) and returning the
+      errors of a whole file. It is used instead of |rule| for the files whose
+      extension is in |file_rule_extensions|, and its errors are reported
+      after the ones of |rule|.
+    file_rule_extensions: see |file_rule|.
+  """
+
+  def __init__(self, rule, report, file_filter=None,
+               error_formatter=_ReportErrorFileAndLine, file_rule=None,
+               file_rule_extensions=()):
+    self.rule = rule
+    self.report = report
+    self.file_filter = file_filter
+    self.error_formatter = error_formatter
+    self.file_rule = file_rule
+    self.file_rule_extensions = file_rule_extensions
+
+
+def _RunLineChecks(input_api, checks):
+  """Runs several _LineCheck with a single pass over the affected files.
+
+  Each file is listed, read and, when one of the rules fails on its new
+  contents, diffed once for all the checks, instead of once per check.
+
+  Returns:
+    A list of the results of each check, in the order of |checks|.
+  """
+  filters = set(check.file_filter for check in checks)
+  shared_filter = filters.pop() if len(filters) == 1 else None
+  line_errors = [[] for _ in checks]
+  file_errors = [[] for _ in checks]
+  for f, extension in _GenerateAffectedFileExtList(input_api, shared_filter):
+    if filters:
+      # The checks do not share a filter, so it is applied to each file.
+      active = [
+          i for i, check in enumerate(checks)
+          if check.file_filter is None or check.file_filter(f)]
+    else:
+      active = range(len(checks))
+    rule_indexes = []
+    new_contents = None
+    for i in active:
+      if extension in checks[i].file_rule_extensions:
+        if new_contents is None:
+          new_contents = f.NewContents()
+        file_errors[i].extend(checks[i].file_rule(f.LocalPath(), new_contents))
+      else:
+        rule_indexes.append(i)
+    if not rule_indexes:
+      continue
+    errors = _FindNewViolationsInFile(
+        f, extension,
+        [(checks[i].rule, checks[i].error_formatter) for i in rule_indexes],
+        new_contents)
+    for i, rule_errors in zip(rule_indexes, errors):
+      line_errors[i].extend(rule_errors)
+
+  return [
+      check.report(line_errors[i] + file_errors[i])
+      for i, check in enumerate(checks)]
+
+
 def _GenerateAffectedFileExtList(input_api, source_file_filter):
   """Generate a list of (file, extension) tuples from affected files.
 
@@ -291,6 +377,51 @@ def _GenerateAffectedFileExtList(input_api, source_file_filter):
     yield (f, extension)
 
 
+def _FindNewViolationsInFile(f, extension, rules, new_contents=None):
+  """Find the newly introduced violations of several per-line rules in a file.
+
+  Arguments:
+    f: the affected file.
+    extension: its file path extension.
+    rules: a list of (callable_rule, error_formatter) tuples, as taken by
+      _FindNewViolationsOfRuleForList().
+    new_contents: the new contents of |f|, if they were already read.
+
+  Returns:
+    A list of the newly-introduced violations of each rule.
+  """
+  # For speed, we do two passes, checking first the full file.  Shelling out
+  # to the SCM to determine the changed region can be quite expensive on
+  # Win32.  Assuming that most files will be kept problem-free, we can
+  # skip the SCM operations most of the time.
+  if new_contents is None:
+    new_contents = f.NewContents()
+  pending = list(range(len(rules)))
+  failed = []
+  for line in new_contents:
+    satisfied = []
+    for i in pending:
+      if rules[i][0](extension, line):
+        satisfied.append(i)
+      else:
+        failed.append(i)
+    pending = satisfied
+    if not pending:
+      break
+
+  errors = [[] for _ in rules]
+  if not failed:
+    return errors  # No violation found in full text: can skip the diff.
+
+  failed.sort()
+  for line_num, line in f.ChangedContents():
+    for i in failed:
+      callable_rule, error_formatter = rules[i]
+      if not callable_rule(extension, line):
+        errors[i].append(error_formatter(f.LocalPath(), line_num, line))
+  return errors
+
+
 def _FindNewViolationsOfRuleForList(callable_rule,
                                     file_ext_list,
                                     error_formatter=_ReportErrorFileAndLine):
@@ -312,17 +443,8 @@ def _FindNewViolationsOfRuleForList(callable_rule,
   """
   errors = []
   for f, extension in file_ext_list:
-    # For speed, we do two passes, checking first the full file.  Shelling out
-    # to the SCM to determine the changed region can be quite expensive on
-    # Win32.  Assuming that most files will be kept problem-free, we can
-    # skip the SCM operations most of the time.
-    if all(callable_rule(extension, line) for line in f.NewContents()):
-      continue  # No violation found in full text: can skip considering diff.
-
-    for line_num, line in f.ChangedContents():
-      if not callable_rule(extension, line):
-        errors.append(error_formatter(f.LocalPath(), line_num, line))
-
+    errors.extend(_FindNewViolationsInFile(
+        f, extension, [(callable_rule, error_formatter)])[0])
   return errors
 
 
@@ -352,6 +474,12 @@ def CheckChangeHasNoTabs(input_api, output_api, source_file_filter=None):
   """Checks that there are no tab characters in any of the text files to be
   submitted.
   """
+  return _RunLineChecks(input_api, [_NoTabsCheck(
+      input_api, output_api, source_file_filter)])[0]
+
+
+def _NoTabsCheck(input_api, output_api, source_file_filter):
+  """Returns the _LineCheck of CheckChangeHasNoTabs()."""
   # In addition to the filter, make sure that makefiles are blacklisted.
   if not source_file_filter:
     # It's the default filter.
@@ -362,43 +490,66 @@ def CheckChangeHasNoTabs(input_api, output_api, source_file_filter=None):
                  basename.endswith('.mk')) and
             source_file_filter(affected_file))
 
-  tabs = _FindNewViolationsOfRule(lambda _, line : '\t' not in line,
-                                  input_api, filter_more)
+  def report(tabs):
+    if tabs:
+      return [output_api.PresubmitPromptWarning('Found a tab character in:',
+                                                long_text='\n'.join(tabs))]
+    return []
 
-  if tabs:
-    return [output_api.PresubmitPromptWarning('Found a tab character in:',
-                                              long_text='\n'.join(tabs))]
-  return []
+  return _LineCheck(lambda _, line : '\t' not in line, report,
+                    file_filter=filter_more)
 
 
 def CheckChangeTodoHasOwner(input_api, output_api, source_file_filter=None):
   """Checks that the user didn't add TODO(name) without an owner."""
+  return _RunLineChecks(input_api, [_TodoHasOwnerCheck(
+      input_api, output_api, source_file_filter)])[0]
+
 
+def _TodoHasOwnerCheck(input_api, output_api, source_file_filter):
+  """Returns the _LineCheck of CheckChangeTodoHasOwner()."""
   unowned_todo = input_api.re.compile('TO''DO[^(]')
-  errors = _FindNewViolationsOfRule(lambda _, x : not unowned_todo.search(x),
-                                    input_api, source_file_filter)
-  errors = ['Found TO''DO with no owner in ' + x for x in errors]
-  if errors:
-    return [output_api.PresubmitPromptWarning('\n'.join(errors))]
-  return []
+
+  def report(errors):
+    errors = ['Found TO''DO with no owner in ' + x for x in errors]
+    if errors:
+      return [output_api.PresubmitPromptWarning('\n'.join(errors))]
+    return []
+
+  return _LineCheck(lambda _, x : not unowned_todo.search(x), report,
+                    file_filter=source_file_filter)
 
 
 def CheckChangeHasNoStrayWhitespace(input_api, output_api,
                                     source_file_filter=None):
   """Checks that there is no stray whitespace at source lines end."""
-  errors = _FindNewViolationsOfRule(lambda _, line : line.rstrip() == line,
-                                    input_api, source_file_filter)
-  if errors:
-    return [output_api.PresubmitPromptWarning(
-        'Found line ending with white spaces in:',
-        long_text='\n'.join(errors))]
-  return []
+  return _RunLineChecks(input_api, [_NoStrayWhitespaceCheck(
+      input_api, output_api, source_file_filter)])[0]
+
+
+def _NoStrayWhitespaceCheck(_input_api, output_api, source_file_filter):
+  """Returns the _LineCheck of CheckChangeHasNoStrayWhitespace()."""
+  def report(errors):
+    if errors:
+      return [output_api.PresubmitPromptWarning(
+          'Found line ending with white spaces in:',
+          long_text='\n'.join(errors))]
+    return []
+
+  return _LineCheck(lambda _, line : line.rstrip() == line, report,
+                    file_filter=source_file_filter)
 
 
 def CheckLongLines(input_api, output_api, maxlen, source_file_filter=None):
   """Checks that there aren't any lines longer than maxlen characters in any of
   the text files to be submitted.
   """
+  return _RunLineChecks(input_api, [_LongLinesCheck(
+      input_api, output_api, maxlen, source_file_filter)])[0]
+
+
+def _LongLinesCheck(input_api, output_api, maxlen, source_file_filter):
+  """Returns the _LineCheck of CheckLongLines()."""
   maxlens = {
       'java': 100,
       # This is specifically for Android's handwritten makefiles (Android.mk).
@@ -470,63 +621,58 @@ def CheckLongLines(input_api, output_api, maxlen, source_file_filter=None):
     # this is a local directive.
     return not any([c not in " \t#" for c in line[:pos]])
 
-  def check_python_long_lines(affected_files, error_formatter):
+  # As before the checks were run in a single pass, a global directive
+  # carries over to the Python files checked after it.
+  global_check_state = [True]
+
+  def check_python_long_lines(file_path, lines):
     errors = []
-    global_check_enabled = True
-
-    for f in affected_files:
-      file_path = f.LocalPath()
-      for idx, line in enumerate(f.NewContents()):
-        line_num = idx + 1
-        line_is_short = no_long_lines(PY_FILE_EXTS[0], line)
-
-        pos = line.find('pylint: disable=line-too-long')
-        if pos >= 0:
-          if is_global_pylint_directive(line, pos):
-            global_check_enabled = False  # Global disable
-          else:
-            continue  # Local disable.
-
-        do_check = global_check_enabled
-
-        pos = line.find('pylint: enable=line-too-long')
-        if pos >= 0:
-          if is_global_pylint_directive(line, pos):
-            global_check_enabled = True  # Global enable
-            do_check = True  # Ensure it applies to current line as well.
-          else:
-            do_check = True  # Local enable
-
-        if do_check and not line_is_short:
-          errors.append(error_formatter(file_path, line_num, line))
+    global_check_enabled = global_check_state[0]
+
+    for idx, line in enumerate(lines):
+      line_num = idx + 1
+      line_is_short = no_long_lines(PY_FILE_EXTS[0], line)
+
+      pos = line.find('pylint: disable=line-too-long')
+      if pos >= 0:
+        if is_global_pylint_directive(line, pos):
+          global_check_enabled = False  # Global disable
+        else:
+          continue  # Local disable.
+
+      do_check = global_check_enabled
 
+      pos = line.find('pylint: enable=line-too-long')
+      if pos >= 0:
+        if is_global_pylint_directive(line, pos):
+          global_check_enabled = True  # Global enable
+          do_check = True  # Ensure it applies to current line as well.
+        else:
+          do_check = True  # Local enable
+
+      if do_check and not line_is_short:
+        errors.append(format_error(file_path, line_num, line))
+
+    global_check_state[0] = global_check_enabled
     return errors
 
   def format_error(filename, line_num, line):
     return '%s, line %s, %s chars' % (filename, line_num, len(line))
 
-  file_ext_list = list(
-      _GenerateAffectedFileExtList(input_api, source_file_filter))
+  def report(errors):
+    if errors:
+      msg = 'Found lines longer than %s characters (first 5 shown).' % maxlen
+      return [output_api.PresubmitPromptWarning(msg, items=errors[:5])]
+    else:
+      return []
 
-  errors = []
-
-  # For non-Python files, a simple line-based rule check is enough.
-  non_py_file_ext_list = [x for x in file_ext_list if x[1] not in PY_FILE_EXTS]
-  if non_py_file_ext_list:
-    errors += _FindNewViolationsOfRuleForList(
-        no_long_lines, non_py_file_ext_list, error_formatter=format_error)
-
-  # However, Python files need more sophisticated checks that need parsing
-  # the whole source file.
-  py_file_list = [x[0] for x in file_ext_list if x[1] in PY_FILE_EXTS]
-  if py_file_list:
-    errors += check_python_long_lines(
-        py_file_list, error_formatter=format_error)
-  if errors:
-    msg = 'Found lines longer than %s characters (first 5 shown).' % maxlen
-    return [output_api.PresubmitPromptWarning(msg, items=errors[:5])]
-  else:
-    return []
+  # For non-Python files, a simple line-based rule check is enough. However,
+  # Python files need more sophisticated checks that need parsing the whole
+  # source file.
+  return _LineCheck(
+      no_long_lines, report, file_filter=source_file_filter,
+      error_formatter=format_error, file_rule=check_python_long_lines,
+      file_rule_extensions=PY_FILE_EXTS)
 
 
 def CheckLicense(input_api, output_api, license_re, source_file_filter=None,
@@ -1114,6 +1260,45 @@ def CheckSingletonInHeaders(input_api, output_api, source_file_filter=None):
   ]
 
 
+def _RunCannedLineChecks(input_api, output_api, checks):
+  """Runs canned checks made of per-line rules in a single pass.
+
+  Checks replaced in input_api.canned_checks, e.g. by --skip_canned, are
+  called as is instead.
+
+  Args:
+    checks: a list of (name, args) tuples, |args| being the arguments of the
+      check after input_api and output_api.
+  Returns:
+    A dict of the results of each check, by name.
+  """
+  results = {}
+  fused = []
+  for name, args in checks:
+    check = getattr(input_api.canned_checks, name)
+    make_line_check = _LINE_CHECKS.get(getattr(check, '__wrapped__', check))
+    if make_line_check:
+      fused.append((name, make_line_check(input_api, output_api, *args)))
+    else:
+      results[name] = check(input_api, output_api, *args)
+  if fused:
+    fused_results = _RunLineChecks(input_api, [c for _, c in fused])
+    results.update(zip([name for name, _ in fused], fused_results))
+  return results
+
+
+# The checks that _RunCannedLineChecks() can fuse, with the function returning
+# their _LineCheck.
+_LINE_CHECKS = {
+    CheckChangeHasNoStrayWhitespace: _NoStrayWhitespaceCheck,
+    CheckChangeHasNoTabs: _NoTabsCheck,
+    CheckChangeTodoHasOwner: _TodoHasOwnerCheck,
+    CheckDoNotSubmitInFiles: _DoNotSubmitInFilesCheck,
+    CheckGenderNeutral: _GenderNeutralCheck,
+    CheckLongLines: _LongLinesCheck,
+}
+
+
 def PanProjectChecks(input_api, output_api,
                      excluded_paths=None, text_files=None,
                      license_header=None, project_name=None,
@@ -1194,15 +1379,18 @@ def PanProjectChecks(input_api, output_api,
     results.extend(input_api.canned_checks.CheckOwners(
         input_api, output_api, source_file_filter=None))
 
-  snapshot("checking long lines")
-  results.extend(input_api.canned_checks.CheckLongLines(
-      input_api, output_api, maxlen, source_file_filter=sources))
-  snapshot( "checking tabs")
-  results.extend(input_api.canned_checks.CheckChangeHasNoTabs(
-      input_api, output_api, source_file_filter=sources))
-  snapshot( "checking stray whitespace")
-  results.extend(input_api.canned_checks.CheckChangeHasNoStrayWhitespace(
-      input_api, output_api, source_file_filter=sources))
+  snapshot("checking long lines, tabs and stray whitespace")
+  line_checks = [
+      ('CheckLongLines', (maxlen, sources)),
+      ('CheckChangeHasNoTabs', (sources,)),
+      ('CheckChangeHasNoStrayWhitespace', (sources,)),
+  ]
+  if input_api.is_committing:
+    line_checks.append(('CheckDoNotSubmitInFiles', ()))
+  line_results = _RunCannedLineChecks(input_api, output_api, line_checks)
+  results.extend(line_results['CheckLongLines'])
+  results.extend(line_results['CheckChangeHasNoTabs'])
+  results.extend(line_results['CheckChangeHasNoStrayWhitespace'])
   snapshot("checking license")
   results.extend(input_api.canned_checks.CheckLicense(
       input_api, output_api, license_header, source_file_filter=sources))
@@ -1216,9 +1404,7 @@ def PanProjectChecks(input_api, output_api,
         input_api, output_api))
     results.extend(input_api.canned_checks.CheckDoNotSubmitInDescription(
         input_api, output_api))
-    snapshot("checking do not submit in files")
-    results.extend(input_api.canned_checks.CheckDoNotSubmitInFiles(
-        input_api, output_api))
+    results.extend(line_results['CheckDoNotSubmitInFiles'])
   snapshot("done")
   return results
 
@@ -16,15 +16,19 @@ __version__ = '1.8.0'
 
 import argparse
 import ast  # Exposed through the API.
+import collections
 import contextlib
 import cpplint
 import fnmatch  # Exposed through the API.
+import functools
 import glob
+import hashlib
 import inspect
 import itertools
 import json  # Exposed through the API.
 import logging
 import multiprocessing
+import multiprocessing.pool
 import os  # Somewhat exposed through the API.
 import random
 import re  # Exposed through the API.
@@ -48,6 +52,7 @@ import owners_finder
 import presubmit_canned_checks
 import scm
 import subprocess2 as subprocess  # Exposed through the API.
+import trace_events
 
 if sys.version_info.major == 2:
   # TODO(1009814): Expose urllib2 only through urllib_request and urllib_error
@@ -63,6 +68,13 @@ else:
 # Ask for feedback only once in program lifetime.
 _ASKED_FOR_FEEDBACK = False
 
+# Name of the directory, under the git dir, holding the _ResultCache.
+RESULT_CACHE_DIR_NAME = 'presubmit-cache'
+
+# Total size of the cached results above which the least recently used ones
+# are removed.
+RESULT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
 
 def time_time():
   # Use this so that it can be mocked in tests without interfering with python
@@ -163,9 +175,81 @@ class Timer(object):
     self.completed = True
 
 
+class _CheckTimings(object):
+  """Records how long each presubmit check took, for --timing-report.
+
+  Each entry is a dict with the keys:
+    kind: 'script' for the CheckChangeOn* function of a PRESUBMIT file,
+          'canned' for a function of presubmit_canned_checks and 'command' for
+          a test run by the ThreadPool.
+    name: the name of the function or test.
+    path: the PRESUBMIT file, or the directory the test ran in.
+    duration: the wall time in seconds, including the checks it called.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.entries = []
+
+  def Add(self, kind, name, path, duration):
+    with self._lock:
+      self.entries.append({
+          'kind': kind, 'name': name, 'path': path, 'duration': duration})
+
+  def Extend(self, entries):
+    with self._lock:
+      self.entries.extend(entries)
+
+  def Slowest(self, limit=None):
+    """Returns the entries, slowest first."""
+    with self._lock:
+      entries = sorted(self.entries, key=lambda e: (
+          -e['duration'], e['kind'], e['name'], e['path'] or ''))
+    return entries[:limit] if limit else entries
+
+  def Report(self, limit=20):
+    """Returns the lines of a report of the slowest checks."""
+    if not self.entries:
+      return ['No presubmit checks were timed.']
+    lines = ['Slowest presubmit checks (%d timed):' % len(self.entries)]
+    for entry in self.Slowest(limit):
+      lines.append('%8.2fs  %-7s %s (%s)' % (
+          entry['duration'], entry['kind'], entry['name'], entry['path']))
+    return lines
+
+
+class _TimedCannedChecks(object):
+  """Exposes presubmit_canned_checks as input_api.canned_checks, recording
+  the duration of each check function called through it.
+  """
+
+  def __init__(self, timings, presubmit_path):
+    self._timings = timings
+    self._presubmit_path = presubmit_path
+
+  def __getattr__(self, name):
+    # Looked up on each access, so that canned_check_filter applies.
+    attr = getattr(presubmit_canned_checks, name)
+    if name.startswith('_') or not inspect.isfunction(attr):
+      return attr
+
+    @functools.wraps(attr)
+    def timed(*args, **kwargs):
+      start = time_time()
+      try:
+        return attr(*args, **kwargs)
+      finally:
+        self._timings.Add(
+            'canned', name, self._presubmit_path, time_time() - start)
+    # Set by functools.wraps in python 3 only.
+    timed.__wrapped__ = attr
+    return timed
+
+
 class ThreadPool(object):
-  def __init__(self, pool_size=None, timeout=None):
+  def __init__(self, pool_size=None, timeout=None, timings=None):
     self.timeout = timeout
+    self.timings = timings
     self._pool_size = pool_size or multiprocessing.cpu_count()
     self._messages = []
     self._messages_lock = threading.Lock()
@@ -214,6 +298,16 @@ class ThreadPool(object):
     This function converts invocation of .py files and invocations of 'python'
     to vpython invocations.
     """
+    if self.timings is None:
+      return self._CallCommand(test)
+    start = time_time()
+    try:
+      return self._CallCommand(test)
+    finally:
+      self.timings.Add(
+          'command', test.name, test.kwargs.get('cwd'), time_time() - start)
+
+  def _CallCommand(self, test):
     cmd = self._GetCommand(test)
     try:
       start = time_time()
@@ -528,7 +622,8 @@ class InputApi(object):
   )
 
   def __init__(self, change, presubmit_path, is_committing,
-      verbose, gerrit_obj, dry_run=None, thread_pool=None, parallel=False):
+      verbose, gerrit_obj, dry_run=None, thread_pool=None, parallel=False,
+      timings=None):
     """Builds an InputApi object.
 
     Args:
@@ -539,6 +634,7 @@ class InputApi(object):
       dry_run: if true, some Checks will be skipped.
       parallel: if true, all tests reported via input_api.RunTests for all
                 PRESUBMIT files will be run in parallel.
+      timings: a _CheckTimings recording the duration of the canned checks.
     """
     # Version number of the presubmit_support script.
     self.version = [int(x) for x in __version__.split('.')]
@@ -595,7 +691,10 @@ class InputApi(object):
     self._current_presubmit_path = os.path.dirname(presubmit_path)
 
     # We carry the canned checks so presubmit scripts can easily use them.
-    self.canned_checks = presubmit_canned_checks
+    if timings is None:
+      self.canned_checks = presubmit_canned_checks
+    else:
+      self.canned_checks = _TimedCannedChecks(timings, presubmit_path)
 
     # Temporary files we must manually remove at the end of a run.
     self._named_temporary_files = []
@@ -795,10 +894,96 @@ class InputApi(object):
 
 
 class _DiffCache(object):
-  """Caches diffs retrieved from a particular SCM."""
+  """Caches diffs and contents retrieved from a particular SCM.
+
+  A Change shares a single instance between all its files, so the InputApi
+  and PresubmitExecuter of each PRESUBMIT.py reuse what the others already
+  read or parsed. The cached contents are bounded by MAX_CONTENTS_BYTES, over
+  which large binary files are evicted first, then the other files, least
+  recently used first.
+  """
+
+  # Total size of the contents kept in memory.
+  MAX_CONTENTS_BYTES = 64 * 1024 * 1024
+  # Binary files at least this large are evicted before any other file.
+  LARGE_BINARY_BYTES = 1024 * 1024
+
   def __init__(self, upstream=None):
     """Stores the upstream revision against which all diffs will be computed."""
     self._upstream = upstream
+    self._paths = []
+    self._lock = threading.RLock()
+    # (kind, path) -> (value, size, is_binary), least recently used first.
+    self._contents = collections.OrderedDict()
+    self._contents_bytes = 0
+    # The keys of the large binary files among them, in the same order. Only
+    # the keys are used.
+    self._large_binaries = collections.OrderedDict()
+
+  def __getstate__(self):
+    # Sent to presubmit worker processes without the contents, which are
+    # cheap to read again compared to pickling them for each script.
+    state = self.__dict__.copy()
+    del state['_lock']
+    state['_contents'] = collections.OrderedDict()
+    state['_contents_bytes'] = 0
+    state['_large_binaries'] = collections.OrderedDict()
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._lock = threading.RLock()
+
+  def AddPaths(self, paths):
+    """Adds paths of the change, whose old contents may be read together."""
+    self._paths.extend(paths)
+
+  def Get(self, kind, path, load):
+    """Returns the |kind| contents of |path|, calling |load| if not cached.
+
+    The value returned must not be modified.
+    """
+    key = (kind, path)
+    with self._lock:
+      entry = self._contents.get(key)
+      if entry is None:
+        entry = self._Measure(load())
+      self._Put(key, entry)
+      return entry[0]
+
+  @staticmethod
+  def _Measure(value):
+    """Returns a (value, size, is_binary) cache entry for |value|.
+
+    |value| is either a string or a list of lines or (line number, line).
+    """
+    size = 0
+    is_binary = False
+    for item in (value if isinstance(value, list) else [value]):
+      if isinstance(item, tuple):
+        item = item[1]
+      size += len(item)
+      is_binary = is_binary or '\0' in item
+    return value, size, is_binary
+
+  def _Remove(self, key):
+    entry = self._contents.pop(key, None)
+    if entry is not None:
+      self._contents_bytes -= entry[1]
+      self._large_binaries.pop(key, None)
+
+  def _Put(self, key, entry):
+    """Caches |entry| as the most recently used, evicting others if needed."""
+    self._Remove(key)
+    _, size, is_binary = entry
+    if size > self.MAX_CONTENTS_BYTES:
+      return
+    self._contents[key] = entry
+    self._contents_bytes += size
+    if is_binary and size >= self.LARGE_BINARY_BYTES:
+      self._large_binaries[key] = None
+    while self._contents_bytes > self.MAX_CONTENTS_BYTES:
+      self._Remove(next(iter(self._large_binaries or self._contents)))
 
   def GetDiff(self, path, local_root):
     """Get the diff for a particular path."""
@@ -806,6 +991,10 @@ class _DiffCache(object):
 
   def GetOldContents(self, path, local_root):
     """Get the old version for a particular path."""
+    return self.Get('old', path,
+                    lambda: self._ReadOldContents(path, local_root))
+
+  def _ReadOldContents(self, path, local_root):
     raise NotImplementedError()
 
 
@@ -814,6 +1003,7 @@ class _GitDiffCache(_DiffCache):
   def __init__(self, upstream):
     super(_GitDiffCache, self).__init__(upstream=upstream)
     self._diffs_by_file = None
+    self._fetched_old_contents = False
 
   def GetDiff(self, path, local_root):
     if not self._diffs_by_file:
@@ -850,7 +1040,23 @@ class _GitDiffCache(_DiffCache):
 
     return self._diffs_by_file[path]
 
-  def GetOldContents(self, path, local_root):
+  def _ReadOldContents(self, path, local_root):
+    if not self._fetched_old_contents:
+      # The first time, read the old contents of all the files of the change
+      # with a single git command. Large files, and those which do not fit,
+      # are read one by one if needed.
+      self._fetched_old_contents = True
+      paths = set(self._paths)
+      paths.add(path)
+      old_contents = scm.GIT.GetOldContentsMulti(
+          local_root, sorted(paths), branch=self._upstream,
+          max_size=self.LARGE_BINARY_BYTES,
+          max_total_size=self.MAX_CONTENTS_BYTES)
+      for other_path, contents in old_contents.items():
+        if other_path != path:
+          self._Put(('old', other_path), self._Measure(contents))
+      if path in old_contents:
+        return old_contents[path]
     return scm.GIT.GetOldContents(local_root, path, branch=self._upstream)
 
 
@@ -866,9 +1072,7 @@ class AffectedFile(object):
     self._action = action
     self._local_root = repository_root
     self._is_directory = None
-    self._cached_changed_contents = None
-    self._cached_new_contents = None
-    self._diff_cache = diff_cache
+    self._diff_cache = diff_cache or self.DIFF_CACHE(None)
     logging.debug('%s(%s)', self.__class__.__name__, self._path)
 
   def LocalPath(self):
@@ -920,14 +1124,15 @@ class AffectedFile(object):
     Contents will be empty if the file is a directory or does not exist.
     Note: The carriage returns (LF or CR) are stripped off.
     """
-    if self._cached_new_contents is None:
-      self._cached_new_contents = []
-      try:
-        self._cached_new_contents = gclient_utils.FileRead(
-            self.AbsoluteLocalPath(), 'rU').splitlines()
-      except IOError:
-        pass  # File not found?  That's fine; maybe it was deleted.
-    return self._cached_new_contents[:]
+    return self._diff_cache.Get(
+        'new', self.LocalPath(), self._ReadNewContents)[:]
+
+  def _ReadNewContents(self):
+    try:
+      return gclient_utils.FileRead(
+          self.AbsoluteLocalPath(), 'rU').splitlines()
+    except IOError:
+      return []  # File not found?  That's fine; maybe it was deleted.
 
   def ChangedContents(self):
     """Returns a list of tuples (line number, line text) of all new lines.
@@ -937,9 +1142,11 @@ class AffectedFile(object):
 
      ^@@ <old line num>,<old size> <new line num>,<new size> @@$
     """
-    if self._cached_changed_contents is not None:
-      return self._cached_changed_contents[:]
-    self._cached_changed_contents = []
+    return self._diff_cache.Get(
+        'changed', self.LocalPath(), self._ParseChangedContents)[:]
+
+  def _ParseChangedContents(self):
+    changed_contents = []
     line_num = 0
 
     for line in self.GenerateScmDiff().splitlines():
@@ -948,10 +1155,10 @@ class AffectedFile(object):
         line_num = int(m.groups(1)[0])
         continue
       if line.startswith('+') and not line.startswith('++'):
-        self._cached_changed_contents.append((line_num, line[1:]))
+        changed_contents.append((line_num, line[1:]))
       if not line.startswith('-'):
         line_num += 1
-    return self._cached_changed_contents[:]
+    return changed_contents
 
   def __str__(self):
     return self.LocalPath()
@@ -1026,6 +1233,7 @@ class Change(object):
         self._AFFECTED_FILES(path, action.strip(), self._local_root, diff_cache)
         for action, path in files
     ]
+    diff_cache.AddPaths(f.LocalPath() for f in self._affected_files)
 
   def Name(self):
     """Returns the change name."""
@@ -1439,9 +1647,209 @@ def DoPostUploadExecuter(change,
   return exit_code
 
 
+def _Fingerprint(*values):
+  """Returns a hash of |values|, which must be JSON serializable."""
+  return hashlib.sha1(
+      json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _FileHash(path):
+  """Returns the SHA-1 of the content of the file at |path|."""
+  with open(path, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+
+def _SourceFingerprint():
+  """Returns a hash of the depot_tools code the checks may run.
+
+  Besides this file and the canned checks, that is the modules the canned
+  checks import, e.g. cpplint and owners, and the pylint wrappers and pylintrc
+  they run.
+  """
+  root = os.path.dirname(os.path.abspath(__file__))
+  sources = []
+  for name in sorted(os.listdir(root)):
+    path = os.path.join(root, name)
+    if (name.endswith('.py') or name.startswith('pylint')) and (
+        os.path.isfile(path)):
+      sources.append((name, _FileHash(path)))
+  return _Fingerprint(__version__, sources)
+
+
+class _AccessRecorder(object):
+  """Forwards the attribute lookups to an object, recording their names."""
+
+  def __init__(self, obj, ignored=()):
+    self._obj = obj
+    self._ignored = ignored
+    self.accessed = set()
+
+  def __getattr__(self, name):
+    if name not in self._ignored:
+      self.accessed.add(name)
+    return getattr(self._obj, name)
+
+
+class _ResultCache(object):
+  """Caches the results of presubmit scripts across runs, under the git dir.
+
+  An entry is looked up by the PRESUBMIT file's path and content, the check
+  function being run and the revision the change is based on. It is used if
+  the inputs the script consumed are unchanged: the affected files, and the
+  description and other metadata of the change if the script read them.
+  Scripts which use Gerrit or leave tests to the parallel ThreadPool are not
+  cached. Once the entries take more than |max_bytes|, Trim() removes the
+  least recently used ones.
+  """
+
+  # Change methods which only depend on the files of the change.
+  FILE_ATTRIBUTES = frozenset([
+      'AbsoluteLocalPaths', 'AffectedFiles', 'AffectedTestableFiles',
+      'AffectedTextFiles', 'AllFiles', 'LocalPaths', 'OriginalOwnersFiles',
+      'RepositoryRoot', 'RightHandSideLines', 'scm',
+  ])
+
+  RESULT_TYPES = dict((cls.__name__, cls) for cls in (
+      _PresubmitResult, _PresubmitError, _PresubmitPromptWarning,
+      _PresubmitNotifyResult, _MailTextResult))
+
+  def __init__(self, path, base, change, skip_canned=(),
+               max_bytes=RESULT_CACHE_MAX_BYTES):
+    """
+    Args:
+      path: The directory holding the entries.
+      base: The commit the change is based on.
+      change: The Change object.
+      skip_canned: The canned checks skipped with --skip_canned.
+    """
+    self.path = path
+    self.base = base
+    self.max_bytes = max_bytes
+    self._skip_canned = sorted(set(skip_canned))
+    self._root = change.RepositoryRoot()
+    self._source_fingerprint = _SourceFingerprint()
+    files = []
+    for f in sorted(change.AffectedFiles(), key=lambda f: f.LocalPath()):
+      try:
+        content = _FileHash(f.AbsoluteLocalPath())
+      except (IOError, OSError):
+        content = None
+      files.append((f.LocalPath(), f.Action(), content))
+    self._files_fingerprint = _Fingerprint(files)
+    self._metadata_fingerprint = _Fingerprint(
+        change.Name(), change.FullDescriptionText(), change.issue,
+        change.patchset, change.author_email)
+
+  @classmethod
+  def ForChange(cls, change, skip_canned=()):
+    """Returns the cache of a git change, or None if it can't be used."""
+    root = change.RepositoryRoot()
+    try:
+      upstream = change._upstream or scm.GIT.GetUpstreamBranch(root)
+      if not upstream:
+        return None
+      base = scm.GIT.Capture(['merge-base', upstream, 'HEAD'], cwd=root)
+      git_dir = scm.GIT.GetGitDir(root)
+    except (OSError, subprocess.CalledProcessError) as e:
+      logging.info('Not caching the presubmit results: %s', e)
+      return None
+    return cls(os.path.join(git_dir, RESULT_CACHE_DIR_NAME), base, change,
+               skip_canned)
+
+  def Key(self, script_text, presubmit_path, function_name, verbose, dry_run):
+    return _Fingerprint(
+        self._source_fingerprint, self.base, self._skip_canned,
+        normpath(os.path.relpath(presubmit_path, self._root)),
+        hashlib.sha1(script_text.encode('utf-8')).hexdigest(), function_name,
+        bool(verbose), bool(dry_run))
+
+  def _InputsFingerprint(self, read_metadata):
+    if read_metadata:
+      return _Fingerprint(self._files_fingerprint, self._metadata_fingerprint)
+    return _Fingerprint(self._files_fingerprint)
+
+  def Get(self, key):
+    """Returns the results and emails to cc stored for |key|, or None."""
+    path = os.path.join(self.path, key)
+    try:
+      with open(path) as f:
+        entry = json.loads(f.read())
+      if entry['fingerprint'] != self._InputsFingerprint(entry['metadata']):
+        return None
+      results = [
+          self.RESULT_TYPES[r['type']](r['message'], r['items'], r['long_text'])
+          for r in entry['results']]
+      # Record the use, for Trim().
+      os.utime(path, None)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+      return None
+    return results, entry['more_cc']
+
+  def Put(self, key, results, more_cc, read_metadata):
+    """Stores the results of a script, unless they can't be restored."""
+    entries = []
+    for result in results:
+      result_type = type(result).__name__
+      if self.RESULT_TYPES.get(result_type) is not type(result):
+        return
+      entries.append({
+          'type': result_type,
+          'message': result._message,
+          'items': [str(item) for item in result._items],
+          'long_text': result._long_text,
+      })
+    try:
+      content = json.dumps({
+          'fingerprint': self._InputsFingerprint(read_metadata),
+          'metadata': read_metadata,
+          'results': entries,
+          'more_cc': list(more_cc),
+      })
+      if not os.path.isdir(self.path):
+        os.makedirs(self.path)
+      fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+      with os.fdopen(fd, 'w') as f:
+        f.write(content)
+      path = os.path.join(self.path, key)
+      try:
+        os.rename(tmp, path)
+      except OSError:
+        # Windows can't rename over an existing file.
+        os.remove(path)
+        os.rename(tmp, path)
+    except (IOError, OSError, TypeError, ValueError) as e:
+      logging.info('Could not cache the presubmit results: %s', e)
+
+  def Trim(self):
+    """Removes the least recently used entries beyond max_bytes."""
+    entries = []
+    total = 0
+    try:
+      names = os.listdir(self.path)
+    except OSError:
+      return
+    for name in names:
+      path = os.path.join(self.path, name)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total += st.st_size
+    for _, size, path in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      total -= size
+
+
 class PresubmitExecuter(object):
   def __init__(self, change, committing, verbose,
-               gerrit_obj, dry_run=None, thread_pool=None, parallel=False):
+               gerrit_obj, dry_run=None, thread_pool=None, parallel=False,
+               timings=None, result_cache=None):
     """
     Args:
       change: The Change object.
@@ -1450,6 +1858,8 @@ class PresubmitExecuter(object):
       dry_run: if true, some Checks will be skipped.
       parallel: if true, all tests reported via input_api.RunTests for all
                 PRESUBMIT files will be run in parallel.
+      timings: a _CheckTimings recording the duration of the checks.
+      result_cache: a _ResultCache of the results of the scripts.
     """
     self.change = change
     self.committing = committing
@@ -1459,6 +1869,8 @@ class PresubmitExecuter(object):
     self.more_cc = []
     self.thread_pool = thread_pool
     self.parallel = parallel
+    self.timings = timings
+    self.result_cache = result_cache
 
   def ExecPresubmitScript(self, script_text, presubmit_path):
     """Executes a single presubmit script.
@@ -1471,17 +1883,42 @@ class PresubmitExecuter(object):
     Return:
       A list of result objects, empty if no problems.
     """
+    # These function names must change if we make substantial changes to
+    # the presubmit API that are not backwards compatible.
+    if self.committing:
+      function_name = 'CheckChangeOnCommit'
+    else:
+      function_name = 'CheckChangeOnUpload'
+
+    change = self.change
+    gerrit_obj = self.gerrit
+    cache_key = None
+    if self.result_cache is not None:
+      cache_key = self.result_cache.Key(
+          script_text, presubmit_path, function_name, self.verbose,
+          self.dry_run)
+      cached = self.result_cache.Get(cache_key)
+      if cached is not None:
+        logging.info('Using the cached results of %s', presubmit_path)
+        result, more_cc = cached
+        self.more_cc.extend(more_cc)
+        return result
+      change = _AccessRecorder(change, _ResultCache.FILE_ATTRIBUTES)
+      if gerrit_obj is not None:
+        gerrit_obj = _AccessRecorder(gerrit_obj)
 
     # Change to the presubmit file's directory to support local imports.
     main_path = os.getcwd()
     os.chdir(os.path.dirname(presubmit_path))
 
     # Load the presubmit script into context.
-    input_api = InputApi(self.change, presubmit_path, self.committing,
-                         self.verbose, gerrit_obj=self.gerrit,
+    input_api = InputApi(change, presubmit_path, self.committing,
+                         self.verbose, gerrit_obj=gerrit_obj,
                          dry_run=self.dry_run, thread_pool=self.thread_pool,
-                         parallel=self.parallel)
+                         parallel=self.parallel, timings=self.timings)
     output_api = OutputApi(self.committing)
+    pending_tests = (len(input_api.thread_pool._tests) +
+                     len(input_api.thread_pool._nonparallel_tests))
     context = {}
     try:
       exec(compile(script_text, 'PRESUBMIT.py', 'exec', dont_inherit=True),
@@ -1489,17 +1926,20 @@ class PresubmitExecuter(object):
     except Exception as e:
       raise PresubmitFailure('"%s" had an exception.\n%s' % (presubmit_path, e))
 
-    # These function names must change if we make substantial changes to
-    # the presubmit API that are not backwards compatible.
-    if self.committing:
-      function_name = 'CheckChangeOnCommit'
-    else:
-      function_name = 'CheckChangeOnUpload'
     if function_name in context:
       try:
         context['__args'] = (input_api, output_api)
         logging.debug('Running %s in %s', function_name, presubmit_path)
-        result = eval(function_name + '(*__args)', context)
+        start = time_time()
+        try:
+          with trace_events.span(function_name, 'presubmit',
+                                 path=presubmit_path):
+            result = eval(function_name + '(*__args)', context)
+        finally:
+          # Checks that raise are reported too.
+          if self.timings is not None:
+            self.timings.Add(
+                'script', function_name, presubmit_path, time_time() - start)
         logging.debug('Running %s done.', function_name)
         self.more_cc.extend(output_api.more_cc)
       finally:
@@ -1516,10 +1956,92 @@ class PresubmitExecuter(object):
     else:
       result = ()  # no error since the script doesn't care about current event.
 
+    if (cache_key is not None and
+        not getattr(gerrit_obj, 'accessed', None) and
+        pending_tests == len(input_api.thread_pool._tests) +
+                         len(input_api.thread_pool._nonparallel_tests)):
+      self.result_cache.Put(cache_key, result, output_api.more_cc,
+                            bool(change.accessed))
+
     # Return the process to the original working directory.
     os.chdir(main_path)
     return result
 
+
+def _ExecPresubmitScriptInWorker(executer_args, script_text, presubmit_path):
+  """Runs a presubmit script in a worker process of DoPresubmitChecks.
+
+  The working directory changes only affect the worker. Tests registered
+  through input_api.RunTests with --parallel are returned instead of run, so
+  that they share the ThreadPool of the main process.
+
+  Returns:
+    A tuple of the results, the emails to cc, the parallel and non-parallel
+    tests left to run, and the timing entries if timed.
+  """
+  (change, committing, verbose, gerrit_obj, dry_run, parallel, timed,
+   result_cache) = executer_args
+  timings = _CheckTimings() if timed else None
+  thread_pool = ThreadPool(timings=timings)
+  executer = PresubmitExecuter(change, committing, verbose, gerrit_obj,
+                               dry_run, thread_pool, parallel, timings,
+                               result_cache)
+  results = executer.ExecPresubmitScript(script_text, presubmit_path)
+  return (results, executer.more_cc, thread_pool._tests,
+          thread_pool._nonparallel_tests, timings and timings.entries)
+
+
+def _ExecPresubmitScripts(executer, scripts, jobs):
+  """Runs the presubmit scripts, in |jobs| worker processes if more than one.
+
+  Args:
+    executer: The PresubmitExecuter of the main process.
+    scripts: A list of (script_text, presubmit_path) tuples.
+    jobs: The number of worker processes.
+
+  Returns:
+    The results of the scripts, in the order of |scripts|. The emails to cc
+    are added to executer.more_cc in the same order.
+  """
+  if jobs <= 1 or len(scripts) <= 1:
+    results = []
+    for script_text, presubmit_path in scripts:
+      results += executer.ExecPresubmitScript(script_text, presubmit_path)
+    return results
+
+  executer_args = (executer.change, executer.committing, executer.verbose,
+                   executer.gerrit, executer.dry_run, executer.parallel,
+                   executer.timings is not None, executer.result_cache)
+  pool = multiprocessing.Pool(min(jobs, len(scripts)))
+  try:
+    pending = [
+        pool.apply_async(_ExecPresubmitScriptInWorker,
+                         (executer_args, script_text, presubmit_path))
+        for script_text, presubmit_path in scripts]
+    pool.close()
+    results = []
+    for (script_text, presubmit_path), async_result in zip(scripts, pending):
+      try:
+        (script_results, more_cc, tests, nonparallel_tests,
+         timing_entries) = async_result.get()
+      except multiprocessing.pool.MaybeEncodingError as e:
+        # Some results can't be sent back, run the script here instead.
+        logging.info('Running %s again in the main process: %s',
+                     presubmit_path, e)
+        results += executer.ExecPresubmitScript(script_text, presubmit_path)
+        continue
+      results += script_results
+      executer.more_cc.extend(more_cc)
+      executer.thread_pool.AddTests(tests)
+      executer.thread_pool.AddTests(nonparallel_tests, parallel=False)
+      if timing_entries:
+        executer.timings.Extend(timing_entries)
+    return results
+  finally:
+    pool.terminate()
+    pool.join()
+
+
 def DoPresubmitChecks(change,
                       committing,
                       verbose,
@@ -1528,7 +2050,10 @@ def DoPresubmitChecks(change,
                       gerrit_obj,
                       dry_run=None,
                       parallel=False,
-                      json_output=None):
+                      json_output=None,
+                      jobs=1,
+                      timing_report=None,
+                      result_cache=None):
   """Runs all presubmit checks that apply to the files in the change.
 
   This finds all PRESUBMIT.py files in directories enclosing the files in the
@@ -1549,6 +2074,14 @@ def DoPresubmitChecks(change,
     dry_run: if true, some Checks will be skipped.
     parallel: if true, all tests specified by input_api.RunTests in all
               PRESUBMIT files will be run in parallel.
+    json_output: a file to write the results to, in JSON.
+    jobs: the number of worker processes running the PRESUBMIT files. Their
+          results are merged in the same order as when run one by one.
+    timing_report: if set, the duration of each check is recorded. The
+                   slowest ones are printed if it is '-', otherwise they are
+                   all written to this file, in JSON.
+    result_cache: a _ResultCache to reuse the results of the scripts whose
+                  inputs did not change since they last ran.
 
   Return:
     1 if presubmit checks failed or 0 otherwise.
@@ -1568,22 +2101,27 @@ def DoPresubmitChecks(change,
         change.AbsoluteLocalPaths(), change.RepositoryRoot())
     if not presubmit_files and verbose:
       sys.stdout.write('Warning, no PRESUBMIT.py found.\n')
-    results = []
-    thread_pool = ThreadPool()
+    timings = _CheckTimings() if timing_report else None
+    thread_pool = ThreadPool(timings=timings)
     executer = PresubmitExecuter(change, committing, verbose, gerrit_obj,
-                                 dry_run, thread_pool, parallel)
+                                 dry_run, thread_pool, parallel, timings,
+                                 result_cache)
+    scripts = []
     if default_presubmit:
       if verbose:
         sys.stdout.write('Running default presubmit script.\n')
       fake_path = os.path.join(change.RepositoryRoot(), 'PRESUBMIT.py')
-      results += executer.ExecPresubmitScript(default_presubmit, fake_path)
+      scripts.append((default_presubmit, fake_path))
     for filename in presubmit_files:
       filename = os.path.abspath(filename)
       if verbose:
         sys.stdout.write('Running %s\n' % filename)
       # Accept CRLF presubmit script.
       presubmit_script = gclient_utils.FileRead(filename, 'rU')
-      results += executer.ExecPresubmitScript(presubmit_script, filename)
+      scripts.append((presubmit_script, filename))
+    results = _ExecPresubmitScripts(executer, scripts, jobs)
+    if result_cache is not None:
+      result_cache.Trim()
 
     results += thread_pool.RunAsync()
 
@@ -1612,6 +2150,13 @@ def DoPresubmitChecks(change,
       sys.stdout.write(
           'Presubmit checks took %.1fs to calculate.\n\n' % total_time)
 
+    if timing_report == '-':
+      sys.stdout.write('\n'.join(timings.Report()) + '\n\n')
+    elif timing_report:
+      gclient_utils.FileWrite(
+          timing_report, json.dumps({'checks': timings.Slowest()}, indent=2,
+                                    sort_keys=True))
+
     if not should_prompt and not presubmits_failed:
       sys.stdout.write('Presubmit checks passed.\n')
     elif should_prompt:
@@ -1810,8 +2355,20 @@ def main(argv=None):
                            'all PRESUBMIT files in parallel.')
   parser.add_argument('--json_output',
                       help='Write presubmit errors to json output.')
+  parser.add_argument('--timing-report', nargs='?', const='-',
+                      metavar='FILE',
+                      help='Time each check, and print the slowest ones, or '
+                           'write all of them to FILE in JSON.')
+  parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                      help='Run all the upload checks, instead of reusing the '
+                           'results of those whose inputs did not change.')
+  parser.add_argument('-j', '--jobs', type=int, default=1,
+                      help='Run the PRESUBMIT files in this many worker '
+                           'processes.')
   parser.add_argument('--all_files', action='store_true',
                       help='Mark all files under source control as modified.')
+  parser.add_argument('--trace-file',
+                      help='Write a Chrome trace of the checks to this file.')
   parser.add_argument('files', nargs='*',
                       help='List of files to be marked as modified when '
                       'executing presubmit or post-upload hooks. fnmatch '
@@ -1819,6 +2376,9 @@ def main(argv=None):
 
   options = parser.parse_args(argv)
 
+  if options.trace_file:
+    trace_events.start(options.trace_file)
+
   if options.verbose >= 2:
     logging.basicConfig(level=logging.DEBUG)
   elif options.verbose:
@@ -1837,6 +2397,9 @@ def main(argv=None):
           change,
           gerrit_obj,
           options.verbose)
+    result_cache = None
+    if options.use_cache and not options.commit and change.scm == 'git':
+      result_cache = _ResultCache.ForChange(change, options.skip_canned)
     with canned_check_filter(options.skip_canned):
       return DoPresubmitChecks(
           change,
@@ -1847,7 +2410,10 @@ def main(argv=None):
           gerrit_obj,
           options.dry_run,
           options.parallel,
-          options.json_output)
+          options.json_output,
+          options.jobs,
+          options.timing_report,
+          result_cache)
   except PresubmitFailure as e:
     print(e, file=sys.stderr)
     print('Maybe your depot_tools is out of date?', file=sys.stderr)
@@ -298,6 +298,100 @@ class GIT(object):
     except subprocess2.CalledProcessError:
       return ''
 
+  # Most bytes of requests GetOldContentsMulti() writes before reading the
+  # contents. git doesn't read new requests while its output is full, so a
+  # chunk of requests must fit in the pipe buffer, which is only 4 KiB on some
+  # platforms.
+  CAT_FILE_CHUNK_BYTES = 4096
+
+  @staticmethod
+  def GetOldContentsMulti(cwd, filenames, branch=None, max_size=None,
+                          max_total_size=None):
+    """Returns a dict of the contents of |filenames| at |branch|.
+
+    All the files are streamed from a single 'git cat-file --batch'. As with
+    GetOldContents(), files missing at |branch| have empty contents, and so
+    do directories. Files larger than |max_size| bytes, or which would take
+    the total over |max_total_size| bytes, are skipped without being read
+    into memory, and left out of the dict.
+    """
+    filenames = [f for f in filenames if '\n' not in f]
+    if not filenames:
+      return {}
+    if not branch:
+      branch = GIT.GetUpstreamBranch(cwd)
+    proc = subprocess2.Popen(
+        ['git', 'cat-file', '--batch'], cwd=cwd, stdin=subprocess2.PIPE,
+        stdout=subprocess2.PIPE, stderr=subprocess2.VOID,
+        env=GIT.ApplyEnvVars({}))
+
+    def read(size):
+      data = proc.stdout.read(size)
+      if len(data) != size:
+        raise IOError('git cat-file exited with %s' % proc.poll())
+      return data
+
+    def skip(size):
+      while size:
+        size -= len(read(min(size, 64 * 1024)))
+
+    contents = {}
+    total_size = 0
+    try:
+      requests = []
+      for filename in filenames:
+        needle = filename
+        if platform.system() == 'Windows':
+          # git cat-file <sha>:<path> wants a posix path.
+          needle = needle.replace('\\', '/')
+        requests.append(('%s:%s\n' % (branch, needle)).encode('utf-8'))
+      start = 0
+      while start < len(filenames):
+        end = start + 1
+        size = len(requests[start])
+        while (end < len(filenames) and
+               size + len(requests[end]) <= GIT.CAT_FILE_CHUNK_BYTES):
+          size += len(requests[end])
+          end += 1
+        chunk = filenames[start:end]
+        proc.stdin.write(b''.join(requests[start:end]))
+        proc.stdin.flush()
+        start = end
+        # git answers in order, with '<needle> missing' for unknown objects
+        # and '<sha> <type> <size>\n<contents>\n' otherwise.
+        for filename in chunk:
+          header = proc.stdout.readline()
+          if not header:
+            raise IOError('git cat-file exited with %s' % proc.poll())
+          header = header.decode('utf-8', 'replace').rstrip('\n').rsplit(' ', 2)
+          if len(header) != 3 or not header[2].isdigit():
+            contents[filename] = ''
+            continue
+          size = int(header[2])
+          if header[1] != 'blob':
+            skip(size + 1)
+            contents[filename] = ''
+          elif ((max_size is not None and size > max_size) or
+                (max_total_size is not None and
+                 total_size + size > max_total_size)):
+            skip(size + 1)
+          else:
+            data = read(size + 1)[:size]
+            contents[filename] = data.decode('utf-8', 'replace')
+            total_size += size
+    except (IOError, OSError):
+      # e.g. not a git checkout, like GetOldContents().
+      return dict((filename, '') for filename in filenames)
+    finally:
+      try:
+        proc.stdin.close()
+      except (IOError, OSError):
+        pass
+      # Unblocks git if it is still writing, e.g. after an exception.
+      proc.stdout.close()
+      proc.wait()
+    return contents
+
   @staticmethod
   def GenerateDiff(cwd, branch=None, branch_head='HEAD', full_move=False,
                    files=None):
@@ -395,6 +489,31 @@ class GIT(object):
     except subprocess2.CalledProcessError:
       return False
 
+  @staticmethod
+  def GetExistingCommits(cwd, revisions):
+    """Returns the subset of |revisions| naming commits present in the repo.
+
+    Objects reachable through alternates, e.g. in the git cache, count as
+    present. All the revisions are looked up with a single
+    'git cat-file --batch-check', so no remote is ever contacted.
+    """
+    revisions = list(revisions)
+    if not revisions:
+      return set()
+    needles = ''.join('%s^{commit}\n' % rev for rev in revisions)
+    try:
+      output = GIT.Capture(
+          ['cat-file', '--batch-check'], cwd=cwd,
+          stdin=needles.encode('utf-8'))
+    except subprocess2.CalledProcessError:
+      return set()
+    # git answers in order, with '<needle> missing' for unknown objects.
+    existing = set()
+    for rev, line in zip(revisions, output.splitlines()):
+      if not line.endswith(' missing'):
+        existing.add(rev)
+    return existing
+
   @classmethod
   def AssertVersion(cls, min_version):
     """Asserts git's version is at least min_version."""
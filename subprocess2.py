@@ -15,6 +15,9 @@ import os
 import subprocess
 import sys
 import threading
+import time
+
+import trace_events
 
 # Cache the string-escape codec to ensure subprocess can find it later.
 # See crbug.com/912292#c2 for context.
@@ -96,6 +99,13 @@ def get_english_env(env):
   return env
 
 
+def _to_text(value):
+  """Returns |value| as a str, decoding bytes on Python 3."""
+  if isinstance(value, bytes) and not isinstance(value, str):
+    return value.decode('utf-8', 'replace')
+  return value
+
+
 class Popen(subprocess.Popen):
   """Wraps subprocess.Popen() with various workarounds.
 
@@ -105,6 +115,7 @@ class Popen(subprocess.Popen):
     shell parameter to a value.
   - Adds support for VOID to not buffer when not needed.
   - Adds self.start property.
+  - Records the lifetime of the process when tracing is enabled.
 
   Note: Popen() can throw OSError when cwd or args[0] doesn't exist. Translate
   exceptions generated by cygwin when it fails trying to emulate fork().
@@ -140,15 +151,26 @@ class Popen(subprocess.Popen):
       kwargs['shell'] = bool(sys.platform=='win32')
 
     if isinstance(args, basestring):
-      tmp_str = args
+      tmp_str = _to_text(args)
     elif isinstance(args, (list, tuple)):
-      tmp_str = ' '.join(args)
+      tmp_str = ' '.join(_to_text(a) for a in args)
     else:
       raise CalledProcessError(None, args, kwargs.get('cwd'), None, None)
     if kwargs.get('cwd', None):
       tmp_str += ';  cwd=%s' % kwargs['cwd']
     logging.debug(tmp_str)
 
+    self.start = time.time()
+    self._trace_name = None
+    if trace_events.enabled():
+      # e.g. 'git fetch' for ['/usr/bin/git', 'fetch', 'origin'].
+      argv = args
+      if isinstance(argv, basestring):
+        argv = argv.split(b' ' if isinstance(argv, bytes) else ' ', 2)
+      argv = [_to_text(a) for a in argv[:2]]
+      self._trace_name = ' '.join(
+          [os.path.basename(a) for a in argv[:1]] + argv[1:2])
+      self._trace_cmd = tmp_str
     try:
       with self.popen_lock:
         super(Popen, self).__init__(args, **kwargs)
@@ -169,6 +191,27 @@ class Popen(subprocess.Popen):
                     'Check that %s or %s exist and have execution permission.'
                     % (str(e), kwargs.get('cwd'), args[0]))
 
+  def _trace_exit(self):
+    if self._trace_name is not None and self.returncode is not None:
+      name, self._trace_name = self._trace_name, None
+      trace_events.complete(
+          name, 'subprocess', self.start, cmd=self._trace_cmd,
+          returncode=self.returncode)
+
+  def wait(self, timeout=None):
+    if timeout is None:
+      # Python 2 doesn't support a timeout.
+      ret = super(Popen, self).wait()
+    else:
+      ret = super(Popen, self).wait(timeout)
+    self._trace_exit()
+    return ret
+
+  def poll(self, *args, **kwargs):
+    ret = super(Popen, self).poll(*args, **kwargs)
+    self._trace_exit()
+    return ret
+
 
 def communicate(args, **kwargs):
   """Wraps subprocess.Popen().communicate().
@@ -10,6 +10,11 @@ import os
 import sys
 import unittest
 
+if sys.version_info.major == 2:
+  import mock
+else:
+  from unittest import mock
+
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from third_party import schema
@@ -21,6 +26,7 @@ metrics.DISABLE_METRICS_COLLECTION = True
 import gclient
 import gclient_eval
 import gclient_utils
+from testing_support import trial_dir
 
 
 class GClientEvalTest(unittest.TestCase):
@@ -114,6 +120,17 @@ class ExecTest(unittest.TestCase):
         {'recursedeps': [['src/third_party/angle', 'DEPS.chromium']]},
         local_scope)
 
+  def test_hooks_depends_on_and_resources(self):
+    local_scope = gclient_eval.Exec(
+        'hooks = [{"name": "b", "action": ["b"], "depends_on": ["a"], '
+        '"resources": ["sysroot"]}]')
+    self.assertEqual(['a'], local_scope['hooks'][0]['depends_on'])
+    self.assertEqual(['sysroot'], local_scope['hooks'][0]['resources'])
+
+  def test_hooks_depends_on_wrong_type(self):
+    with self.assertRaises(gclient_utils.Error):
+      gclient_eval.Exec('hooks = [{"action": ["b"], "depends_on": "a"}]')
+
   def test_var(self):
     local_scope = gclient_eval.Exec('\n'.join([
         'vars = {',
@@ -237,6 +254,25 @@ class EvaluateConditionTest(unittest.TestCase):
   def test_true(self):
     self.assertTrue(gclient_eval.EvaluateCondition('True', {}))
 
+  def test_compiled_variables(self):
+    compiled = gclient_eval.CompileCondition(
+        'checkout_linux and (target_os == "android" or not True)')
+    self.assertEqual(
+        frozenset(['checkout_linux', 'target_os']), compiled.variables)
+    self.assertTrue(compiled({'checkout_linux': True, 'target_os': 'android'}))
+    self.assertFalse(compiled({'checkout_linux': True, 'target_os': 'ios'}))
+
+  def test_compiled_is_cached(self):
+    self.assertIs(gclient_eval.CompileCondition('foo == "bar"'),
+                  gclient_eval.CompileCondition('foo == "bar"'))
+
+  def test_compiled_cache_is_bounded(self):
+    with mock.patch('gclient_eval._MAX_COMPILED_CONDITIONS', 2):
+      first = gclient_eval.CompileCondition('a1')
+      gclient_eval.CompileCondition('a2')
+      gclient_eval.CompileCondition('a3')
+      self.assertIsNot(first, gclient_eval.CompileCondition('a1'))
+
   def test_variable(self):
     self.assertFalse(gclient_eval.EvaluateCondition('foo', {'foo': 'False'}))
 
@@ -1068,6 +1104,77 @@ class ParseTest(unittest.TestCase):
     }, local_scope)
 
 
+class ParseCacheTest(trial_dir.TestCase):
+  DEPS = '\n'.join([
+      'vars = {',
+      '  "foo": "bar",',
+      '}',
+      'deps = {',
+      '  "a_dep": "a{foo}b",',
+      '}',
+  ])
+
+  def setUp(self):
+    super(ParseCacheTest, self).setUp()
+    self.path = os.path.join(self.root_dir, '.gclient_deps_cache')
+
+  def test_same_result_as_parse(self):
+    cache = gclient_eval.ParseCache(self.path)
+    expected = gclient_eval.Parse(self.DEPS, '<unknown>', {'foo': 'baz'})
+    self.assertEqual(
+        expected, cache.Parse(self.DEPS, '<unknown>', {'foo': 'baz'}))
+    self.assertEqual(
+        expected, cache.Parse(self.DEPS, '<unknown>', {'foo': 'baz'}))
+
+  def test_persists_and_returns_copies(self):
+    cache = gclient_eval.ParseCache(self.path)
+    result = cache.Parse(self.DEPS, '<unknown>')
+    result['deps']['a_dep'] = 'modified'
+    cache.Save()
+
+    cache = gclient_eval.ParseCache(self.path)
+    with mock.patch('gclient_eval.Parse', return_value={}) as parse:
+      result = cache.Parse(self.DEPS, '<unknown>')
+      self.assertEqual('abarb', result['deps']['a_dep']['url'])
+      # A different variable value is a different entry.
+      cache.Parse(self.DEPS, '<unknown>', None, {'checkout_mac': True})
+    self.assertEqual(1, parse.call_count)
+
+  def test_evicts_least_recently_used(self):
+    cache = gclient_eval.ParseCache(self.path)
+    with mock.patch('gclient_eval.ParseCache.MAX_ENTRIES', 2), \
+        mock.patch('gclient_eval.ParseCache.MAX_ENTRIES_PER_FILE', 3):
+      for i in range(3):
+        cache.Parse('target_os = ["%d"]' % i, '<unknown>')
+      cache.Save()
+    cache = gclient_eval.ParseCache(self.path)
+    with mock.patch('gclient_eval.Parse', return_value={}) as parse:
+      cache.Parse('target_os = ["2"]', '<unknown>')
+      cache.Parse('target_os = ["0"]', '<unknown>')
+    parse.assert_called_once_with('target_os = ["0"]', '<unknown>', None, None)
+
+  def test_evicts_older_results_of_same_file(self):
+    cache = gclient_eval.ParseCache(self.path)
+    with mock.patch('gclient_eval.ParseCache.MAX_ENTRIES_PER_FILE', 2):
+      for i in range(3):
+        cache.Parse('target_os = ["%d"]' % i, 'DEPS')
+      cache.Parse('target_os = ["other"]', 'other/DEPS')
+      cache.Save()
+    cache = gclient_eval.ParseCache(self.path)
+    with mock.patch('gclient_eval.Parse', return_value={}) as parse:
+      cache.Parse('target_os = ["2"]', 'DEPS')
+      cache.Parse('target_os = ["1"]', 'DEPS')
+      cache.Parse('target_os = ["other"]', 'other/DEPS')
+      cache.Parse('target_os = ["0"]', 'DEPS')
+    parse.assert_called_once_with('target_os = ["0"]', 'DEPS', None, None)
+
+  def test_corrupted_file(self):
+    gclient_utils.FileWrite(self.path, 'garbage')
+    cache = gclient_eval.ParseCache(self.path)
+    self.assertEqual(
+        {'target_os': ['a']}, cache.Parse('target_os = ["a"]', '<unknown>'))
+
+
 if __name__ == '__main__':
   level = logging.DEBUG if '-v' in sys.argv else logging.FATAL
   logging.basicConfig(
@@ -574,6 +574,32 @@ class ManagedGitWrapperTestCase(BaseGitWrapperTestCase):
     rev_info = scm.revinfo(options, (), None)
     self.assertEqual(rev_info, '069c602044c5388d2d15c3f875b057c852003458')
 
+  def testCloneFromPartialMirror(self):
+    if not self.enabled:
+      return
+    subprocess2.check_call(
+        ['git', 'config', 'uploadpack.allowFilter', 'true'], cwd=self.base_path)
+    url = 'file://' + self.base_path
+    cache_dir = tempfile.mkdtemp()
+    self.addCleanup(gclient_utils.rmtree, cache_dir)
+    git_cache.Mirror.SetCachePath(cache_dir)
+    self.addCleanup(git_cache.Mirror.SetCachePath, None)
+    git_cache.Mirror(url).populate(partial_clone_filter='blob:none')
+
+    checkout_root = tempfile.mkdtemp()
+    self.addCleanup(gclient_utils.rmtree, checkout_root)
+    scm = gclient_scm.GitWrapper(url, checkout_root, 'dep')
+    scm.update(self.Options(), (), [])
+
+    checkout = join(checkout_root, 'dep')
+    self.assertEqual(['a', 'b'], sorted(os.listdir(checkout))[1:])
+    self.assertEqual(url, scm._Capture(
+        ['config', 'remote.%s.url' % gclient_scm.PROMISOR_REMOTE]))
+    # The blobs were fetched from the upstream into the checkout.
+    objects = scm._Capture(
+        ['rev-list', '--objects', '--missing=print', 'HEAD']).splitlines()
+    self.assertEqual([], [o for o in objects if o.startswith('?')])
+
 
 class ManagedGitWrapperTestCaseMock(unittest.TestCase):
   class OptionsObject(object):
@@ -1097,6 +1123,22 @@ class GerritChangesTest(fake_repos.FakeReposTestBase):
     self.setUpMirror()
     self.testCanCloneGerritChange()
 
+  def testSkipsFetchWhenRevisionIsPresent(self):
+    self.setUpMirror()
+    scm = gclient_scm.GitWrapper(self.url, self.root_dir, '.')
+    file_list = []
+
+    self.options.revision = self.githash('repo_1', 1)
+    scm.update(self.options, None, file_list)
+
+    self.options.revision = self.githash('repo_1', 2)
+    with mock.patch('git_cache.Mirror.populate') as populate, \
+         mock.patch('gclient_scm.GitWrapper._Fetch') as fetch:
+      scm.update(self.options, None, file_list)
+    populate.assert_not_called()
+    fetch.assert_not_called()
+    self.assertEqual(self.githash('repo_1', 2), self.gitrevparse(self.root_dir))
+
   def testCanSyncToGerritChangeMirror(self):
     self.setUpMirror()
     self.testCanSyncToGerritChange()
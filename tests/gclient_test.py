@@ -54,6 +54,8 @@ class SCMMock(object):
         root_dir.startswith(self.unit_test.root_dir), root_dir)
     self.name = name
     self.url = parsed_url
+    self.timings = {}
+    self.fetched_bytes = 0
 
   def RunCommand(self, command, options, args, file_list):
     self.unit_test.assertEqual('None', command)
@@ -316,6 +318,159 @@ class GclientTest(trial_dir.TestCase):
         [h.action for h in self._get_hooks()],
         [tuple(x['action']) for x in hooks])
 
+  def testHooksConcurrently(self):
+    hooks = [
+        {'name': 'a', 'action': ['cmd_a'], 'depends_on': []},
+        {'name': 'b', 'action': ['cmd_b'], 'resources': ['sysroot']},
+        {'name': 'c', 'action': ['cmd_c'], 'depends_on': ['a', 'unknown']},
+        {'name': 'd', 'action': ['cmd_d']},
+        {'name': 'd', 'action': ['cmd_d2']},
+    ]
+    write('.gclient',
+          'solutions = [{\n'
+          '  "name": "top",\n'
+          '  "url": "svn://example.com/top"\n'
+          '}]')
+    write(os.path.join('top', 'DEPS'),
+          'hooks =  %s' % repr(hooks))
+
+    parser = gclient.OptionParser()
+    options, _ = parser.parse_args(['--jobs', '4'])
+    client = gclient.GClient.LoadCurrentConfig(options)
+    work_queue = gclient_utils.ExecutionQueue(options.jobs, None, False)
+    for s in client.dependencies:
+      work_queue.enqueue(s)
+    work_queue.flush({}, None, [], options=options, patch_refs={},
+                     target_branches={})
+
+    queued = []
+    def flush(work_queue):
+      queued.extend(work_queue.queued)
+    with mock.patch('gclient_utils.ExecutionQueue.flush', flush):
+      client.RunHooksRecursively(options, None)
+
+    self.assertEqual(
+        [('a', ()), ('b', ()), ('c', ('a',)), ('d', ('a', 'b', 'c')),
+         ('d (5)', ('a', 'b', 'c', 'd'))],
+        [(item.name, item.requirements) for item in queued])
+    self.assertEqual([[], ['sysroot'], [], [], []],
+                     [item.resources for item in queued])
+
+  def testSaveTimingsKeepsHooksOutOfTotal(self):
+    write('.gclient',
+          'solutions = [{\n'
+          '  "name": "top",\n'
+          '  "url": "svn://example.com/top"\n'
+          '}]')
+    options, _ = gclient.OptionParser().parse_args([])
+    client = gclient.GClient.LoadCurrentConfig(options)
+    top = client.dependencies[0]
+    top.add_timing('fetch', 2)
+    top.add_timing('hooks', 30)
+    store = client._GetTimingStore()
+    client._SaveTimings(store, {'top': (5, ())})
+
+    self.assertEqual(
+        {'top': {'total': 5, 'requirements': [], 'fetch': 2, 'hooks': 30}},
+        client._GetTimingStore().latest)
+    self.assertEqual({'top': 5}, store.priorities())
+
+  def testPlanSync(self):
+    write('.gclient',
+          'solutions = [{\n'
+          '  "name": "top",\n'
+          '  "url": "svn://example.com/top"\n'
+          '}]')
+    write(os.path.join('top', 'DEPS'),
+          'deps = {\n'
+          '  "top/new": "svn://example.com/new@' + 'a' * 40 + '",\n'
+          '  "top/old": "svn://example.com/old@refs/heads/main",\n'
+          '}')
+    options, _ = gclient.OptionParser().parse_args([])
+    client = gclient.GClient.LoadCurrentConfig(options)
+    store = client._GetTimingStore()
+    store.add_run({
+        'top/new': {'total': 9, 'fetch': 5, 'checkout': 2, 'fetch_bytes': 100},
+        'top/old': {'total': 4, 'fetch': 1, 'checkout': 3},
+    })
+    store.save()
+
+    actions = {'top': 'skip', 'top/new': 'clone', 'top/old': 'checkout'}
+    def plan_git_dependency(dep, revision):
+      return {'action': actions[dep.name], 'resolved_revision': revision}
+    with mock.patch.object(client, '_PlanGitDependency', plan_git_dependency):
+      plan = client.PlanSync()
+
+    self.assertEqual(['top', 'top/new', 'top/old'], sorted(plan['deps']))
+    new = plan['deps']['top/new']
+    self.assertEqual(('clone', 'a' * 40, 7, 100), (
+        new['action'], new['revision'], new['estimated_seconds'],
+        new['estimated_bytes']))
+    old = plan['deps']['top/old']
+    self.assertEqual(('checkout', 'refs/heads/main', 3, 0), (
+        old['action'], old['revision'], old['estimated_seconds'],
+        old['estimated_bytes']))
+    self.assertEqual(10, plan['estimated_seconds'])
+    self.assertEqual(100, plan['estimated_bytes'])
+
+  def testPlanGitDependency(self):
+    options, _ = gclient.OptionParser().parse_args([])
+    client = gclient.GClient(self.root_dir, options)
+    os.makedirs(os.path.join(self.root_dir, 'dep', '.git'))
+    scm_wrapper = mock.Mock(
+        url='https://example.com/dep',
+        checkout_path=os.path.join(self.root_dir, 'dep'))
+    scm_wrapper.GetCacheMirror.return_value = None
+    dep = mock.Mock()
+    dep.CreateSCM.return_value = scm_wrapper
+    sha = 'a' * 40
+
+    with mock.patch('scm.GIT.Capture', return_value=sha), \
+         mock.patch('scm.GIT.IsValidRevision', return_value=False):
+      self.assertEqual('skip', client._PlanGitDependency(dep, sha)['action'])
+      plan = client._PlanGitDependency(dep, 'refs/heads/main')
+      self.assertEqual(
+          ('skip', sha), (plan['action'], plan['resolved_revision']))
+
+    with mock.patch('scm.GIT.Capture', return_value='b' * 40), \
+         mock.patch('scm.GIT.IsValidRevision', return_value=True):
+      self.assertEqual(
+          'checkout', client._PlanGitDependency(dep, sha)['action'])
+
+    with mock.patch('scm.GIT.Capture', return_value='b' * 40), \
+         mock.patch('scm.GIT.IsValidRevision', return_value=False):
+      self.assertEqual('fetch', client._PlanGitDependency(dep, sha)['action'])
+
+    scm_wrapper.checkout_path = os.path.join(self.root_dir, 'missing')
+    self.assertEqual('clone', client._PlanGitDependency(dep, sha)['action'])
+
+  def testHookCache(self):
+    write(os.path.join('inputs', 'a.txt'), 'a')
+    hook = gclient.Hook(['cmd'], name='h', cwd_base=self.root_dir,
+                        variables={'v': 'x'}, inputs=['inputs', 'missing'])
+    cache = gclient.HookCache(self.root_dir)
+    self.assertFalse(cache.is_up_to_date(hook))
+    cache.update(hook)
+    self.assertTrue(cache.is_up_to_date(hook))
+    self.assertFalse(
+        gclient.HookCache(self.root_dir, force=True).is_up_to_date(hook))
+
+    write(os.path.join('inputs', 'a.txt'), 'b')
+    self.assertFalse(cache.is_up_to_date(hook))
+    cache.update(hook)
+    other_vars = gclient.Hook(['cmd'], name='h', cwd_base=self.root_dir,
+                              variables={'v': 'y'},
+                              inputs=['inputs', 'missing'])
+    self.assertFalse(cache.is_up_to_date(other_vars))
+
+  def testHookCacheWithoutInputs(self):
+    hook = gclient.Hook(['cmd'], name='h', cwd_base=self.root_dir)
+    cache = gclient.HookCache(self.root_dir)
+    cache.update(hook)
+    self.assertFalse(cache.is_up_to_date(hook))
+    self.assertFalse(
+        os.path.exists(os.path.join(self.root_dir, gclient.HookCache.DIRNAME)))
+
   def testCustomHooks(self):
     extra_hooks = [{'name': 'append', 'pattern': '.', 'action': ['supercmd']}]
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env vpython3
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for gclient_timings.py."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gclient_timings
+import gclient_utils
+from testing_support import trial_dir
+
+
+class TimingStoreTest(trial_dir.TestCase):
+  def setUp(self):
+    super(TimingStoreTest, self).setUp()
+    self.path = os.path.join(self.root_dir, '.gclient_timings')
+
+  def _dep(self, total, requirements=(), **phases):
+    dep = {'total': total, 'requirements': list(requirements)}
+    dep.update(phases)
+    return dep
+
+  def testMissingFile(self):
+    store = gclient_timings.TimingStore(self.path)
+    self.assertEqual([], store.runs)
+    self.assertEqual({}, store.priorities())
+    self.assertEqual(['No timings recorded yet.'], store.report())
+
+  def testUnreadableFile(self):
+    gclient_utils.FileWrite(self.path, '{not json')
+    self.assertEqual([], gclient_timings.TimingStore(self.path).runs)
+
+  def testSaveAndLoad(self):
+    store = gclient_timings.TimingStore(self.path)
+    store.add_run({'src': self._dep(3, fetch=2, checkout=1)}, timestamp=10)
+    store.save()
+    store = gclient_timings.TimingStore(self.path)
+    self.assertEqual(
+        [{'timestamp': 10,
+          'deps': {'src': self._dep(3, fetch=2, checkout=1)}}],
+        store.runs)
+
+  def testKeepsLastRuns(self):
+    store = gclient_timings.TimingStore(self.path)
+    for i in range(gclient_timings.MAX_RUNS + 5):
+      store.add_run({'src': self._dep(i)}, timestamp=i)
+    store.save()
+    store = gclient_timings.TimingStore(self.path)
+    self.assertEqual(gclient_timings.MAX_RUNS, len(store.runs))
+    self.assertEqual(5, store.runs[0]['timestamp'])
+
+  def testPriorities(self):
+    store = gclient_timings.TimingStore(self.path)
+    store.add_run({
+        'src': self._dep(10),
+        'src/big': self._dep(100, ['src']),
+        'other': self._dep(50, hooks=1000),
+    })
+    self.assertEqual(
+        {'src': 110, 'src/big': 100, 'other': 50}, store.priorities())
+
+  def testReport(self):
+    store = gclient_timings.TimingStore(self.path)
+    store.add_run({'src': self._dep(10), 'src/a': self._dep(2, ['src'])})
+    store.add_run({'src': self._dep(20), 'src/a': self._dep(1, ['src']),
+                   'src/b': self._dep(5, ['src'], hooks=4)})
+    lines = store.report(limit=2)
+    self.assertEqual(4, len(lines))
+    self.assertIn('2 runs recorded', lines[0])
+    self.assertTrue(lines[2].startswith('src '), lines[2])
+    self.assertTrue(lines[2].endswith('+10.0s'), lines[2])
+    self.assertTrue(lines[3].startswith('src/b '), lines[3])
+    self.assertTrue(lines[3].endswith('new'), lines[3])
+
+
+if __name__ == '__main__':
+  unittest.main()
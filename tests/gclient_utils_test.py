@@ -279,6 +279,68 @@ class SplitUrlRevisionTestCase(unittest.TestCase):
     self.assertEqual(out_url, url)
 
 
+class ExecutionQueueTestCase(unittest.TestCase):
+  class WorkItemMock(gclient_utils.WorkItem):
+    def __init__(self, name, requirements=(), ran=None):
+      gclient_utils.WorkItem.__init__(self, name)
+      self.requirements = requirements
+      self._ran = ran
+
+    def run(self, work_queue):
+      self._ran.append(self.name)
+
+  def _run(self, items, priorities=None):
+    work_queue = gclient_utils.ExecutionQueue(1, None, False,
+                                              priorities=priorities)
+    for item in items:
+      work_queue.enqueue(item)
+    work_queue.flush()
+    return work_queue
+
+  def testFifoWithoutPriorities(self):
+    ran = []
+    self._run([
+        self.WorkItemMock('a', ran=ran),
+        self.WorkItemMock('a/b', ('a',), ran=ran),
+        self.WorkItemMock('c', ran=ran),
+    ])
+    self.assertEqual(['a', 'c', 'a/b'], ran)
+
+  def testPriorities(self):
+    ran = []
+    work_queue = self._run([
+        self.WorkItemMock('a', ran=ran),
+        self.WorkItemMock('a/b', ('a',), ran=ran),
+        self.WorkItemMock('c', ran=ran),
+        self.WorkItemMock('d', ran=ran),
+    ], priorities={'a': 1, 'a/b': 5, 'c': 3, 'd': 10})
+    self.assertEqual(['d', 'c', 'a', 'a/b'], ran)
+    self.assertEqual(['d', 'c', 'a', 'a/b'], list(work_queue.ran))
+    self.assertEqual(('a',), work_queue.durations['a/b'][1])
+
+  def testRequirementAddedAfterEnqueue(self):
+    ran = []
+    late = self.WorkItemMock('a/b', ran=ran)
+    work_queue = gclient_utils.ExecutionQueue(1, None, False)
+    work_queue.enqueue(late)
+    work_queue.enqueue(self.WorkItemMock('a', ran=ran))
+    late.requirements = ('a',)
+    work_queue.flush()
+    self.assertEqual(['a', 'a/b'], ran)
+
+  def testCriticalPathPriorities(self):
+    priorities = gclient_utils.CriticalPathPriorities(
+        {'src': 10, 'src/big': 100, 'src/small': 1, 'other': 50},
+        {'src/big': ['src'], 'src/small': ['src'], 'other': []})
+    self.assertEqual(
+        {'src': 110, 'src/big': 100, 'src/small': 1, 'other': 50}, priorities)
+
+  def testCriticalPathPrioritiesCycle(self):
+    priorities = gclient_utils.CriticalPathPriorities(
+        {'a': 1, 'b': 2}, {'a': ['b'], 'b': ['a']})
+    self.assertEqual(set(['a', 'b']), set(priorities))
+
+
 class GClientUtilsTest(trial_dir.TestCase):
   def testHardToDelete(self):
     # Use the fact that tearDown will delete the directory to make it hard to do
@@ -10,8 +10,15 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import unittest
 
+if sys.version_info.major == 2:
+  import mock
+else:
+  from unittest import mock
+
 DEPOT_TOOLS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, DEPOT_TOOLS_ROOT)
 
@@ -125,6 +132,280 @@ class GitCacheTest(unittest.TestCase):
     mirror = git_cache.Mirror(self.origin_dir)
     mirror.populate(reset_fetch_config=True)
 
+  def testPopulateMany(self):
+    self.git(['init', '-q'])
+    with open(os.path.join(self.origin_dir, 'foo'), 'w') as f:
+      f.write('touched\n')
+    self.git(['add', 'foo'])
+    self.git(['commit', '-m', 'foo'])
+    other_dir = tempfile.mkdtemp(suffix='other.git')
+    self.addCleanup(shutil.rmtree, other_dir, ignore_errors=True)
+    self.git(['clone', '-q', self.origin_dir, other_dir])
+    # Another process is populating this one.
+    locked_dir = os.path.join(self.cache_dir, 'locked')
+    with open(git_cache.Mirror(locked_dir).mirror_path + '.lock', 'w') as f:
+      f.write('1\n')
+
+    output = []
+    results = git_cache.PopulateMany(
+        [self.origin_dir, other_dir, locked_dir], 2, print_func=output.append)
+
+    self.assertEqual([self.origin_dir, other_dir, locked_dir],
+                     [url for url, _, _ in results])
+    self.assertEqual([False, False, True],
+                     [bool(error) for _, _, error in results])
+    self.assertTrue(git_cache.Mirror(self.origin_dir).exists())
+    self.assertTrue(git_cache.Mirror(other_dir).exists())
+    prefix = '[%s] ' % git_cache.Mirror.UrlToCacheDir(other_dir)
+    self.assertTrue(any(line.startswith(prefix) for line in output))
+
+    git_cache.PrintPopulateSummary(results, print_func=output.append)
+    self.assertIn('Populated 3 mirrors', output[-4])
+    self.assertIn('FAILED', ''.join(output[-3:]))
+
+  def testReadGclientUrls(self):
+    gclient_file = os.path.join(self.cache_dir, '.gclient')
+    with open(gclient_file, 'w') as f:
+      f.write('solutions = [{"name": "src", "url": "https://a/src.git"}]\n')
+    self.assertEqual(['https://a/src.git'],
+                     git_cache.ReadGclientUrls(gclient_file))
+    with open(gclient_file + '_entries', 'w') as f:
+      f.write('entries = {\n'
+              '  "src": "https://a/src.git",\n'
+              '  "src/dep": "https://a/dep.git@abc",\n'
+              '  "src/unpinned": "https://a/unpinned.git",\n'
+              '  "src/skipped": None,\n'
+              '  "src/cipd:pkg": "https://%s/pkg@version",\n'
+              '}\n' % git_cache.CIPD_HOST)
+    self.assertEqual(
+        ['https://a/dep.git', 'https://a/src.git', 'https://a/unpinned.git'],
+        sorted(git_cache.ReadGclientUrls(gclient_file)))
+
+  def _commit(self, name):
+    with open(os.path.join(self.origin_dir, name), 'w') as f:
+      f.write(name + '\n')
+    self.git(['add', name])
+    self.git(['commit', '-m', name])
+
+  def testMaintain(self):
+    self.git(['init', '-q'])
+    self._commit('foo')
+    mirror = git_cache.Mirror(self.origin_dir)
+    mirror.populate()
+    # Keep each fetch in its own pack, like fetches of many objects are.
+    self.git(['config', 'fetch.unpackLimit', '1'], cwd=mirror.mirror_path)
+    for name in ('bar', 'baz', 'qux'):
+      self._commit(name)
+      mirror.populate()
+    pack_dir = os.path.join(mirror.mirror_path, 'objects', 'pack')
+    self.assertGreater(len(mirror._pack_sizes()), 2)
+
+    self.assertEqual([], mirror.maintain(budget=0))
+    self.assertEqual(
+        ['commit-graph', 'loose-objects', 'repack', 'multi-pack-index'],
+        mirror.maintain(budget=60))
+    self.assertTrue(os.path.exists(os.path.join(
+        mirror.mirror_path, 'objects', 'info', 'commit-graphs')))
+    self.assertTrue(os.path.exists(os.path.join(pack_dir, 'multi-pack-index')))
+    # The packs which were combined are removed by the next run.
+    packs = set(os.listdir(pack_dir))
+    mirror.maintain(budget=60)
+    self.assertTrue(packs - set(os.listdir(pack_dir)))
+    self.git(['fsck', '--no-progress'], cwd=mirror.mirror_path)
+
+  @mock.patch('git_cache.Mirror._maintain')
+  def testPopulateMaintains(self, maintain_mock):
+    self.git(['init', '-q'])
+    self._commit('foo')
+    mirror = git_cache.Mirror(self.origin_dir)
+    with mock.patch('git_cache.Mirror.GetMaintenanceBudget',
+                    return_value=None):
+      mirror.populate()
+    maintain_mock.assert_not_called()
+    with mock.patch('git_cache.Mirror.GetMaintenanceBudget', return_value=30):
+      mirror.populate()
+    maintain_mock.assert_called_once_with(30)
+
+  def _head(self):
+    return subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'], cwd=self.origin_dir).decode().strip()
+
+  def testRevisionIndex(self):
+    self.git(['init', '-q'])
+    self._commit('foo')
+    first = self._head()
+    self.git(['tag', '-a', '-m', 'tag', 'tag'])
+    self._commit('bar')
+    second = self._head()
+    mirror = git_cache.Mirror(self.origin_dir)
+    mirror.populate()
+    tag = subprocess.check_output(
+        ['git', 'rev-parse', 'tag'], cwd=mirror.mirror_path).decode().strip()
+    missing = 'f' * 40
+
+    with mock.patch('scm.GIT.GetExistingCommits',
+                    side_effect=git_cache.scm.GIT.GetExistingCommits) as git:
+      self.assertEqual(
+          {first, second, tag},
+          mirror.contains_revisions([first, second, tag, missing]))
+      self.assertTrue(mirror.contains_revision(second.upper()))
+      self.assertFalse(mirror.contains_revision(missing))
+      git.assert_not_called()
+      # Refs are looked up by git.
+      self.assertTrue(mirror.contains_revision('master'))
+      git.assert_called_once_with(mirror.mirror_path, ['master'])
+
+      # Something else fetched, and may have pruned commits, so the index
+      # isn't used.
+      self._commit('baz')
+      third = self._head()
+      self.git(['fetch', '-q', self.origin_dir, 'master:master'],
+               cwd=mirror.mirror_path)
+      git.reset_mock()
+      self.assertEqual(
+          {first, third}, mirror.contains_revisions([first, third]))
+      git.assert_called_once_with(mirror.mirror_path, [first, third])
+
+      mirror.populate()
+      git.reset_mock()
+      self.assertTrue(mirror.contains_revision(third))
+      git.assert_not_called()
+
+      # Commits which are no longer reachable are dropped.
+      self.git(['reset', '-q', '--hard', second])
+      mirror.populate()
+      self.assertEqual(
+          {first, second}, mirror.contains_revisions([first, second, third]))
+      git.assert_not_called()
+
+      # The index is rebuilt when gc pruned a previous tip.
+      self._commit('qux')
+      fourth = self._head()
+      mirror.populate()
+      self.git(['update-ref', 'refs/heads/master', second],
+               cwd=mirror.mirror_path)
+      self.git(['reflog', 'expire', '--expire=now', '--all'],
+               cwd=mirror.mirror_path)
+      self.git(['gc', '-q', '--prune=now'], cwd=mirror.mirror_path)
+      mirror.update_revision_index()
+      self.assertEqual(
+          {second}, mirror.contains_revisions([second, fourth]))
+      git.assert_not_called()
+
+  def testPopulatePartialClone(self):
+    self.git(['init', '-q'])
+    self.git(['config', 'uploadpack.allowFilter', 'true'])
+    self._commit('foo')
+    mirror = git_cache.Mirror('file://' + self.origin_dir)
+    with mock.patch('git_cache.Mirror.bootstrap_repo') as bootstrap_repo:
+      mirror.populate(bootstrap=True, partial_clone_filter='blob:none')
+    bootstrap_repo.assert_not_called()
+    self.assertEqual('blob:none', mirror.GetPartialCloneFilter())
+    head = self._head()
+    self.assertTrue(mirror.contains_revision(head))
+    objects = subprocess.check_output(
+        ['git', 'rev-list', '--objects', '--missing=print', '--all'],
+        cwd=mirror.mirror_path).decode().splitlines()
+    self.assertEqual(1, len([o for o in objects if o.startswith('?')]))
+
+    # Later fetches are filtered too.
+    self._commit('bar')
+    mirror.populate()
+    self.assertTrue(mirror.contains_revision(self._head()))
+    objects = subprocess.check_output(
+        ['git', 'rev-list', '--objects', '--missing=print', '--all'],
+        cwd=mirror.mirror_path).decode().splitlines()
+    self.assertEqual(2, len([o for o in objects if o.startswith('?')]))
+    with self.assertRaises(RuntimeError):
+      mirror.update_bootstrap()
+
+  def testPopulateFullMirrorIgnoresFilter(self):
+    self.git(['init', '-q'])
+    self._commit('foo')
+    mirror = git_cache.Mirror(self.origin_dir)
+    mirror.populate()
+    mirror.populate(partial_clone_filter='blob:none')
+    self.assertIsNone(mirror.GetPartialCloneFilter())
+
+  def testBootstrapDelta(self):
+    bucket = tempfile.mkdtemp(prefix='git_cache_bucket_')
+    self.addCleanup(shutil.rmtree, bucket, ignore_errors=True)
+    other_cache_dir = tempfile.mkdtemp(prefix='git_cache_test_')
+    self.addCleanup(shutil.rmtree, other_cache_dir, ignore_errors=True)
+    self.git(['init', '-q'])
+    self._commit('foo')
+
+    with mock.patch.dict(os.environ, {'OVERRIDE_BOOTSTRAP_BUCKET': bucket}), \
+        mock.patch('git_cache.Mirror._GetGenerationNumber',
+                   side_effect=['1', '2']):
+      uploader = git_cache.Mirror(self.origin_dir)
+      uploader.populate()
+      uploader.update_bootstrap()
+
+      git_cache.Mirror.SetCachePath(other_cache_dir)
+      mirror = git_cache.Mirror(self.origin_dir)
+      mirror.populate(bootstrap=True)
+      self.assertEqual(1, mirror._GetBootstrapGeneration())
+
+      self._commit('bar')
+      git_cache.Mirror.SetCachePath(self.cache_dir)
+      uploader.populate()
+      uploader.update_bootstrap(prune=True)
+      self.assertEqual(
+          ['1-2.bundle'],
+          os.listdir(os.path.join(uploader._gs_path, 'deltas')))
+
+      # The mirror just fetched, so it doesn't look for deltas.
+      git_cache.Mirror.SetCachePath(other_cache_dir)
+      with mock.patch('git_cache.Mirror._fetch'), \
+          mock.patch('git_cache._LocalStorage.ls') as ls:
+        mirror.populate(bootstrap=True)
+      ls.assert_not_called()
+      self.assertEqual(1, mirror._GetBootstrapGeneration())
+
+      # Catch up through the delta bundle only, once it's stale.
+      old = time.time() - git_cache.BOOTSTRAP_DELTA_MIN_AGE - 60
+      os.utime(os.path.join(mirror.mirror_path, 'FETCH_HEAD'), (old, old))
+      master = subprocess.check_output(
+          ['git', 'rev-parse', 'master'], cwd=mirror.mirror_path)
+      # Even if the fetch from origin then fails.
+      with mock.patch('git_cache.Mirror._fetch',
+                      side_effect=subprocess.CalledProcessError(1, 'fetch')):
+        with self.assertRaises(subprocess.CalledProcessError):
+          mirror.populate(bootstrap=True)
+    self.assertEqual(2, mirror._GetBootstrapGeneration())
+    head = subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'], cwd=self.origin_dir).strip()
+    self.git(['cat-file', '-e', head.decode('utf-8')], cwd=mirror.mirror_path)
+    # The refs of the mirror are left to the fetch from origin.
+    self.assertEqual(master, subprocess.check_output(
+        ['git', 'rev-parse', 'master'], cwd=mirror.mirror_path))
+    self.assertEqual(b'', subprocess.check_output(
+        ['git', 'for-each-ref', git_cache.SNAPSHOT_REFS_PREFIX],
+        cwd=mirror.mirror_path))
+
+
+class MirrorLockTest(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp(prefix='git_cache_test_')
+    self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+    self.path = os.path.join(self.cache_dir, 'mirror')
+
+  @unittest.skipIf(git_cache.fcntl is None, 'flock() is not available')
+  def testReadersShareWritersWait(self):
+    acquired = threading.Event()
+    def write():
+      with git_cache.MirrorLock(self.path).exclusive():
+        acquired.set()
+
+    writer = threading.Thread(target=write)
+    with git_cache.MirrorLock(self.path).shared():
+      with git_cache.MirrorLock(self.path).shared():
+        writer.start()
+        self.assertFalse(acquired.wait(0.2))
+    writer.join(10)
+    self.assertTrue(acquired.is_set())
+
 
 class GitCacheDirTest(unittest.TestCase):
   def setUp(self):
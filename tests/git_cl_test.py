@@ -2846,7 +2846,9 @@ class ChangelistTest(unittest.TestCase):
         parallel=True,
         upstream='upstream',
         description='description',
-        all_files=True)
+        all_files=True,
+        use_cache=False,
+        timing_report='timings.json')
 
     self.assertEqual(expected_results, results)
     subprocess2.Popen.assert_called_once_with([
@@ -2862,6 +2864,8 @@ class ChangelistTest(unittest.TestCase):
         '--may_prompt',
         '--parallel',
         '--all_files',
+        '--no-cache',
+        '--timing-report', 'timings.json',
         '--json_output', '/tmp/fake-temp2',
         '--description_file', '/tmp/fake-temp1',
     ])
@@ -3044,7 +3048,9 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
         parallel=None,
         upstream='upstream',
         description='fetch description',
-        all_files=None)
+        all_files=None,
+        use_cache=True,
+        timing_report=None)
 
   def testNoIssue(self):
     git_cl.Changelist.GetIssue.return_value = None
@@ -3056,7 +3062,9 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
         parallel=None,
         upstream='upstream',
         description='get description',
-        all_files=None)
+        all_files=None,
+        use_cache=True,
+        timing_report=None)
 
   def testCustomBranch(self):
     self.assertEqual(0, git_cl.main(['presubmit', 'custom_branch']))
@@ -3067,11 +3075,14 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
         parallel=None,
         upstream='custom_branch',
         description='fetch description',
-        all_files=None)
+        all_files=None,
+        use_cache=True,
+        timing_report=None)
 
   def testOptions(self):
     self.assertEqual(
-        0, git_cl.main(['presubmit', '-v', '-v', '--all', '--parallel', '-u']))
+        0, git_cl.main(['presubmit', '-v', '-v', '--all', '--parallel', '-u',
+                        '--no-cache', '--timing-report', '-']))
     git_cl.Changelist.RunHook.assert_called_once_with(
         committing=False,
         may_prompt=False,
@@ -3079,7 +3090,9 @@ class CMDPresubmitTestCase(CMDTestCaseBase):
         parallel=True,
         upstream='upstream',
         description='fetch description',
-        all_files=True)
+        all_files=True,
+        use_cache=False,
+        timing_report='-')
 
 
 class CMDTryResultsTestCase(CMDTestCaseBase):
@@ -217,6 +217,43 @@ class GitReadOnlyFunctionsTest(git_test_utils.GitRepoReadOnlyTestBase,
     self.assertTrue(self.repo['D'].startswith(
         self.repo.run(self.gc.hash_one, 'branch_D', short=True)))
 
+  def testHashesFallback(self):
+    # rev-parse handles what cat-file can't, e.g. ranges and unknown hashes.
+    self.assertEqual(
+        [self.repo['D'], '^' + self.repo['C']],
+        self.repo.run(self.gc.hash_multi, 'tag_C..tag_D'))
+    self.assertEqual('f' * 40, self.repo.run(self.gc.hash_one, 'f' * 40))
+
+  def testCatFile(self):
+    def fn():
+      service = self.gc.cat_file()
+      self.assertIs(service, self.gc.cat_file())
+      return (service.info_multi(['branch_D', 'wat', 'master:some/other/file']),
+              service.read('master:some/other/file'),
+              service.read('wat'),
+              service.read_multi(['wat', 'master:some/other/file'] * 200))
+    infos, blob, missing, objects = self.repo.run(fn)
+    data = self.COMMIT_A['some/other/file']['data']
+    self.assertEqual((self.repo['D'], 'commit'), infos[0][:2])
+    self.assertIsNone(infos[1])
+    self.assertEqual(
+        (git_test_utils.git_hash_data(data), 'blob', len(data)), infos[2])
+    self.assertEqual((git_test_utils.git_hash_data(data), 'blob', data), blob)
+    self.assertIsNone(missing)
+    self.assertEqual([None, blob] * 200, objects)
+
+  def testCatFileChunks(self):
+    chunks = list(self.gc.CatFile._chunks(['a' * 4000, 'b' * 94, 'c', 'd']))
+    self.assertEqual(
+        [(['a' * 4000, 'b' * 94], ('a' * 4000 + '\n' + 'b' * 94 + '\n')),
+         (['c', 'd'], 'c\nd\n')],
+        [(names, data.decode('utf-8')) for names, data in chunks])
+    self.assertEqual(
+        [['e' * 5000], ['f']],
+        [names for names, _ in self.gc.CatFile._chunks(['e' * 5000, 'f'])])
+    with self.assertRaises(ValueError):
+      list(self.gc.CatFile._chunks(['g', 'h\n']))
+
   def testStream(self):
     items = set(self.repo.commit_map.values())
 
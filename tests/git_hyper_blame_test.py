@@ -7,6 +7,7 @@
 from __future__ import unicode_literals
 
 import datetime
+import json
 import os
 import re
 import shutil
@@ -121,6 +122,44 @@ class GitHyperBlameMainTest(GitHyperBlameTestBase):
     self.assertEqual(expected_output, outbuf.getvalue().rstrip().split(b'\n'))
     self.assertEqual('', sys.stderr.getvalue())
 
+  def testMultipleFiles(self):
+    """Tests the main function with several files and a directory."""
+    self.repo.git('checkout', '-f', 'tag_D')
+    blame = [self.blame_line('C', ' 1) line 1.1'),
+             self.blame_line('A', '2*) line 2.1')]
+    expected_output = (
+        [b'==> some/files/.git-blame-ignore-revs <==',
+         self.blame_line('D', '1) tag_B'), b'',
+         b'==> some/files/file <=='] + blame +
+        [b'', b'==> some/files/file <=='] + blame)
+    outbuf = BytesIO()
+    retval = self.repo.run(
+        self.git_hyper_blame.main,
+        ['--no-default-ignores', '-i', 'tag_B', '-j', '2', 'tag_D',
+         'some/files', 'some/files/file'],
+        outbuf)
+    self.assertEqual(0, retval)
+    self.assertEqual(expected_output, outbuf.getvalue().rstrip().split(b'\n'))
+    self.assertEqual('', sys.stderr.getvalue())
+
+  def testDirectoryAtRevision(self):
+    """Tests that directories are found at REVISION, not in the checkout."""
+    # setUp checks the files out again.
+    self.repo.run(gclient_utils.rmtree, 'some')
+    outbuf = BytesIO()
+    retval = self.repo.run(
+        self.git_hyper_blame.main,
+        ['--no-default-ignores', 'tag_D', 'some/files'], outbuf)
+    self.assertEqual(0, retval)
+    self.assertEqual(
+        [b'==> some/files/.git-blame-ignore-revs <==',
+         self.blame_line('D', '1) tag_B'), b'',
+         b'==> some/files/file <==',
+         self.blame_line('C', '1) line 1.1'),
+         self.blame_line('B', '2) line 2.1')],
+        outbuf.getvalue().rstrip().split(b'\n'))
+    self.assertEqual('', sys.stderr.getvalue())
+
   def testBadRepo(self):
     """Tests the main function (not in a repo)."""
     # Make a temp dir that has no .git directory.
@@ -298,6 +337,20 @@ class GitHyperBlameSimpleTest(GitHyperBlameTestBase):
     'some/other/file2': {'data': b'file2 - vanilla\nfile_z - merged\n'},
   }
 
+  def testSharedCommits(self):
+    """Tests that blames share the Commit objects of each (commit, file)."""
+    commits = {}
+    blames = [
+        self.repo.run(self.git_hyper_blame.get_parsed_blame, filename,
+                      self.repo['B'], commits=commits)
+        for filename in ('some/files/file1', 'some/files/file1',
+                         'some/other/file')]
+    self.assertIs(blames[0][0].commit, blames[1][0].commit)
+    self.assertIsNot(blames[0][0].commit, blames[2][0].commit)
+    self.assertEqual(
+        {(self.repo['A'], 'some/files/file1'),
+         (self.repo['A'], 'some/other/file')}, set(commits))
+
   def testBlameError(self):
     """Tests a blame on a non-existent file."""
     expected_output = [b'']
@@ -532,6 +585,100 @@ class GitHyperBlameLineMotionTest(GitHyperBlameTestBase):
     self.assertEqual(expected_output, output)
 
 
+class GitHyperBlameCacheTest(GitHyperBlameTestBase):
+  REPO_SCHEMA = """
+  A B C
+  """
+
+  COMMIT_A = {
+    'file':  {'data': b'A\ngreen\nblue\n'},
+  }
+
+  COMMIT_B = {
+    'file': {'data': b'A\nyellow\nblue\n'},
+  }
+
+  COMMIT_C = {
+    'file': {'data': b'X\nY\nA\nred\nblue\nZ\n'},
+  }
+
+  def setUp(self):
+    super(GitHyperBlameCacheTest, self).setUp()
+    self.repo.git('checkout', '-f', 'tag_C')
+    self.addCleanup(self.git_hyper_blame.diff_hunks_cache.clear)
+
+  def run_main(self, *args):
+    outbuf = BytesIO()
+    args = list(args) + ['-i', 'tag_B', 'tag_C', 'file']
+    retval = self.repo.run(self.git_hyper_blame.main, args, outbuf)
+    self.assertEqual(0, retval)
+    return outbuf.getvalue()
+
+  def testSerializeBlame(self):
+    parsed = self.repo.run(
+        self.git_hyper_blame.get_parsed_blame, 'file', self.repo['C'])
+    data = json.loads(json.dumps(self.git_hyper_blame.serialize_blame(parsed)))
+    restored = self.git_hyper_blame.deserialize_blame(data)
+    self.assertEqual(len(parsed), len(restored))
+    self.assertEqual(2, len(data['commits']))
+    for line, other in zip(parsed, restored):
+      self.assertEqual(vars(line.commit), vars(other.commit))
+      self.assertEqual(line[1:], other[1:])
+    # Lines of the same commit share their Commit object.
+    self.assertIs(restored[0].commit, restored[1].commit)
+
+  def testCachedBlame(self):
+    expected = self.run_main()
+    cache_dir = os.path.join(
+        self.repo.repo_path, '.git', self.git_hyper_blame.CACHE_DIR_NAME)
+    self.assertTrue(os.listdir(cache_dir))
+
+    self.git_hyper_blame.diff_hunks_cache.clear()
+    mock.patch('git_common.blame', side_effect=AssertionError).start()
+    mock.patch('git_common.diff', side_effect=AssertionError).start()
+    self.assertEqual(expected, self.run_main())
+
+    with self.assertRaises(AssertionError):
+      self.run_main('--no-cache')
+
+  def testCachedBlameDependsOnBlameInputs(self):
+    self.run_main()
+    self.git_hyper_blame.diff_hunks_cache.clear()
+    blame = mock.patch(
+        'git_common.blame', wraps=self.git_hyper_blame.git_common.blame).start()
+    self.run_main()
+    self.assertEqual(0, blame.call_count)
+
+    with open(os.path.join(self.repo.repo_path, '.mailmap'), 'w') as f:
+      f.write('Someone Else <else@example.com> <author@example.com>\n')
+    self.run_main()
+    calls = blame.call_count
+    self.assertTrue(calls)
+
+    self.repo.git('config', 'blame.markIgnoredLines', 'true')
+    self.run_main()
+    self.assertEqual(2 * calls, blame.call_count)
+
+    self.run_main()
+    self.assertEqual(2 * calls, blame.call_count)
+
+  def testTrim(self):
+    path = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, path)
+    cache = self.git_hyper_blame.BlameCache(path)
+    for i in range(3):
+      cache.set('hunks', (str(i),), [[[i, 1], [i, 1]]])
+      os.utime(cache._entry_path('hunks', (str(i),)), (i, i))
+    # Reading an entry makes it the most recently used.
+    self.assertEqual([[[0, 1], [0, 1]]], cache.get('hunks', ('0',)))
+
+    cache.max_bytes = 2 * os.path.getsize(cache._entry_path('hunks', ('0',)))
+    cache.trim()
+    self.assertIsNotNone(cache.get('hunks', ('0',)))
+    self.assertIsNone(cache.get('hunks', ('1',)))
+    self.assertIsNotNone(cache.get('hunks', ('2',)))
+
+
 class GitHyperBlameLineNumberTest(GitHyperBlameTestBase):
   REPO_SCHEMA = """
   A B C D
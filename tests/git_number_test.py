@@ -78,6 +78,44 @@ class Basic(git_test_utils.GitRepoReadWriteTestBase):
         None,
         self.repo.run(self.gn.get_num, binascii.unhexlify(self.repo['A'])))
 
+  def testLoadNumberTrees(self):
+    self.assertEqual([4], self._git_number([self.repo['E']], cache=True))
+    self.gn.clear_caches()
+    trees = self.repo.run(self.gn.load_number_trees)
+    self.assertEqual(256, len(trees))
+    for num, name in enumerate('ABCDE'):
+      commit = binascii.unhexlify(self.repo[name])
+      self.assertEqual(num, trees[commit[:self.gn.PREFIX_LEN]][commit])
+
+  def testIterNumberTree(self):
+    tree = {b'\x01' * 20: 1, b'\x02' * 20: 2 ** 32 - 1}
+    raw = b''.join(self.gn.struct.pack(self.gn.CHUNK_FMT, k, v)
+                   for k, v in sorted(tree.items()))
+    self.assertEqual(tree, dict(self.gn._iter_number_tree(raw)))
+    # A truncated entry is ignored.
+    self.assertEqual(tree, dict(self.gn._iter_number_tree(raw + b'\x03')))
+
+  def testNumberTree(self):
+    entries = {b'\x01' * 20: 1, b'\x03' * 20: 2 ** 32 - 1}
+    raw = b''.join(self.gn.struct.pack(self.gn.CHUNK_FMT, k, v)
+                   for k, v in sorted(entries.items()))
+    # A truncated entry is ignored.
+    tree = self.gn.NumberTree(raw + b'\x04')
+    self.assertEqual(entries, dict(tree.items()))
+    self.assertEqual(2 ** 32 - 1, tree[b'\x03' * 20])
+    self.assertIsNone(tree.get(b'\x02' * 20))
+    self.assertNotIn(b'\x04' * 20, tree)
+
+    tree[b'\x02' * 20] = 5
+    tree[b'\x01' * 20] = 6
+    self.assertEqual(3, len(tree))
+    self.assertEqual(5, tree[b'\x02' * 20])
+    self.assertEqual(6, tree.get(b'\x01' * 20))
+    entries.update({b'\x02' * 20: 5, b'\x01' * 20: 6})
+    self.assertEqual(entries, dict(tree.items()))
+    with self.assertRaises(KeyError):
+      tree[b'\x04' * 20]  # pylint: disable=pointless-statement
+
 
 if __name__ == '__main__':
   sys.exit(coverage_utils.covered_main(
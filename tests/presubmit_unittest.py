@@ -16,6 +16,7 @@ import multiprocessing
 import os
 import random
 import re
+import shutil
 import sys
 import tempfile
 import threading
@@ -715,6 +716,171 @@ def CheckChangeOnCommit(input_api, output_api):
 
     gclient_utils.FileWrite.assert_called_with(temp_path, fake_result_json)
 
+  def testDoPresubmitChecksWorkerProcesses(self):
+    root_path = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
+    haspresubmit_path = os.path.join(
+        self.fake_root_dir, 'haspresubmit', 'PRESUBMIT.py')
+    os.path.isfile.side_effect = lambda f: f in [root_path, haspresubmit_path]
+    os.listdir.return_value = ['PRESUBMIT.py']
+    gclient_utils.FileRead.return_value = """
+def CheckChangeOnUpload(input_api, output_api):
+  name = input_api.os_path.basename(input_api.PresubmitLocalPath())
+  output_api.AppendCC(name + '@example.com')
+  return [output_api.PresubmitNotifyResult(name)]
+"""
+    change = self.ExampleChange()
+
+    results = []
+    for jobs in (1, 2):
+      self.assertEqual(
+          0,
+          presubmit.DoPresubmitChecks(
+              change=change, committing=False, verbose=False,
+              default_presubmit=None, may_prompt=False, gerrit_obj=None,
+              json_output='temp.json', jobs=jobs))
+      results.append(json.loads(gclient_utils.FileWrite.call_args[0][1]))
+
+    self.assertEqual(results[0], results[1])
+    names = [os.path.basename(self.fake_root_dir), 'haspresubmit']
+    self.assertEqual(
+        names, [n['message'] for n in results[1]['notifications']])
+    self.assertEqual(
+        [name + '@example.com' for name in names], results[1]['more_cc'])
+
+  def testDoPresubmitChecksTimingReport(self):
+    os.path.isfile.return_value = False
+    os.listdir.return_value = []
+    presubmit.time_time.side_effect = itertools.count()
+    script = """
+def CheckChangeOnUpload(input_api, output_api):
+  return input_api.canned_checks.CheckChangeHasDescription(
+      input_api, output_api)
+"""
+    change = self.ExampleChange()
+    self.assertEqual(
+        0,
+        presubmit.DoPresubmitChecks(
+            change=change, committing=False, verbose=False,
+            default_presubmit=script, may_prompt=False, gerrit_obj=None,
+            timing_report='timings.json'))
+
+    path, content = gclient_utils.FileWrite.call_args[0]
+    self.assertEqual('timings.json', path)
+    checks = json.loads(content)['checks']
+    self.assertEqual(
+        [('script', 'CheckChangeOnUpload'),
+         ('canned', 'CheckChangeHasDescription')],
+        [(c['kind'], c['name']) for c in checks])
+    self.assertEqual(
+        [os.path.join(self.fake_root_dir, 'PRESUBMIT.py')] * 2,
+        [c['path'] for c in checks])
+    self.assertGreater(checks[0]['duration'], checks[1]['duration'])
+
+    sys.stdout.truncate(0)
+    presubmit.DoPresubmitChecks(
+        change=change, committing=False, verbose=False,
+        default_presubmit=script, may_prompt=False, gerrit_obj=None,
+        timing_report='-')
+    self.assertIn(
+        'Slowest presubmit checks (2 timed):\n', sys.stdout.getvalue())
+
+  def testExecPresubmitScriptTimesChecksThatRaise(self):
+    presubmit.time_time.side_effect = itertools.count()
+    timings = presubmit._CheckTimings()
+    executer = presubmit.PresubmitExecuter(
+        self.ExampleChange(), False, None, None, timings=timings)
+    fake_presubmit = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
+    with self.assertRaises(ValueError):
+      executer.ExecPresubmitScript(
+          'def CheckChangeOnUpload(input_api, output_api):\n'
+          '  raise ValueError()\n',
+          fake_presubmit)
+    self.assertEqual(
+        [('script', 'CheckChangeOnUpload', fake_presubmit)],
+        [(e['kind'], e['name'], e['path']) for e in timings.entries])
+
+  def _RunWithResultCache(self, change, script, cache_dir):
+    result_cache = presubmit._ResultCache(cache_dir, 'base', change)
+    with mock.patch('presubmit_support.InputApi',
+                    wraps=presubmit.InputApi) as input_api:
+      presubmit.DoPresubmitChecks(
+          change=change, committing=False, verbose=False,
+          default_presubmit=script, may_prompt=False, gerrit_obj=None,
+          json_output='temp.json', result_cache=result_cache)
+    output = json.loads(gclient_utils.FileWrite.call_args[0][1])
+    return input_api.called, output['notifications'], output['more_cc']
+
+  def testDoPresubmitChecksResultCache(self):
+    cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cache_dir)
+    os.path.isfile.return_value = False
+    os.listdir.return_value = []
+    file_hash = mock.patch('presubmit_support._FileHash').start()
+    file_hash.return_value = 'content'
+    script = """
+def CheckChangeOnUpload(input_api, output_api):
+  output_api.AppendCC('me@example.com')
+  files = [f.LocalPath() for f in input_api.AffectedFiles()]
+  return [output_api.PresubmitNotifyResult('files', files)]
+"""
+    change = self.ExampleChange()
+    ran, notifications, more_cc = self._RunWithResultCache(
+        change, script, cache_dir)
+    self.assertTrue(ran)
+    self.assertEqual(1, len(notifications))
+    self.assertEqual(['me@example.com'], more_cc)
+
+    # The script does not read the description.
+    change.SetDescriptionText('Another description')
+    self.assertEqual(
+        (False, notifications, more_cc),
+        self._RunWithResultCache(change, script, cache_dir))
+
+    file_hash.return_value = 'new content'
+    self.assertEqual(
+        (True, notifications, more_cc),
+        self._RunWithResultCache(change, script, cache_dir))
+
+    self.assertTrue(
+        self._RunWithResultCache(change, script + '\n', cache_dir)[0])
+
+  def testDoPresubmitChecksResultCacheReadsDescription(self):
+    cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cache_dir)
+    os.path.isfile.return_value = False
+    os.listdir.return_value = []
+    file_hash = mock.patch('presubmit_support._FileHash').start()
+    file_hash.return_value = 'content'
+    script = """
+def CheckChangeOnUpload(input_api, output_api):
+  return [output_api.PresubmitNotifyResult(
+      input_api.change.DescriptionText())]
+"""
+    change = self.ExampleChange()
+    self.assertTrue(self._RunWithResultCache(change, script, cache_dir)[0])
+    self.assertFalse(self._RunWithResultCache(change, script, cache_dir)[0])
+
+    change.SetDescriptionText('Another description')
+    ran, notifications, _ = self._RunWithResultCache(change, script, cache_dir)
+    self.assertTrue(ran)
+    self.assertEqual(['Another description'],
+                     [n['message'] for n in notifications])
+
+  def testSourceFingerprint(self):
+    os.listdir.return_value = ['cpplint.py', 'metrics.cfg', 'pylintrc']
+    os.path.isfile.return_value = True
+    contents = {'cpplint.py': 'a', 'metrics.cfg': 'b', 'pylintrc': 'c'}
+    mock.patch('presubmit_support._FileHash',
+               lambda path: contents[os.path.basename(path)]).start()
+    fingerprint = presubmit._SourceFingerprint()
+
+    contents['metrics.cfg'] = 'd'
+    self.assertEqual(fingerprint, presubmit._SourceFingerprint())
+    for name in ('cpplint.py', 'pylintrc'):
+      contents[name] += 'e'
+      self.assertNotEqual(fingerprint, presubmit._SourceFingerprint())
+      fingerprint = presubmit._SourceFingerprint()
+
   def testDoPresubmitChecksPromptsAfterWarnings(self):
     presubmit_path = os.path.join(self.fake_root_dir, 'PRESUBMIT.py')
     haspresubmit_path = os.path.join(
@@ -1609,6 +1775,103 @@ class AffectedFileUnittest(PresubmitTestsBase):
     af = presubmit.AffectedFile(notfound, 'A', self.fake_root_dir, None)
     self.assertEqual([], af.NewContents())
 
+  def testContentsSharedByFiles(self):
+    gclient_utils.FileRead.return_value = 'whatever\ncookie'
+    diff_cache = presubmit._GitDiffCache(None)
+    af1 = presubmit.GitAffectedFile(
+        'foo/blat.cc', 'M', self.fake_root_dir, diff_cache)
+    af2 = presubmit.GitAffectedFile(
+        'foo/blat.cc', 'M', self.fake_root_dir, diff_cache)
+    af1.NewContents().append('modified')
+    self.assertEqual(['whatever', 'cookie'], af1.NewContents())
+    self.assertEqual(['whatever', 'cookie'], af2.NewContents())
+    self.assertEqual(1, gclient_utils.FileRead.call_count)
+
+  @mock.patch('presubmit_support.GitAffectedFile.GenerateScmDiff')
+  def testChangedContentsParsedOnce(self, mockGenerateScmDiff):
+    mockGenerateScmDiff.return_value = '\n'.join([
+        'diff --git foo/blat.cc foo/blat.cc',
+        '--- foo/blat.cc',
+        '+++ foo/blat.cc',
+        '@@ -1,2 +1,2 @@',
+        ' unchanged',
+        '-old',
+        '+new',
+    ])
+    diff_cache = presubmit._GitDiffCache(None)
+    af1 = presubmit.GitAffectedFile(
+        'foo/blat.cc', 'M', self.fake_root_dir, diff_cache)
+    af2 = presubmit.GitAffectedFile(
+        'foo/blat.cc', 'M', self.fake_root_dir, diff_cache)
+    self.assertEqual([(2, 'new')], af1.ChangedContents())
+    self.assertEqual([(2, 'new')], af2.ChangedContents())
+    mockGenerateScmDiff.assert_called_once_with()
+
+  @mock.patch('scm.GIT.GetOldContents')
+  @mock.patch('scm.GIT.GetOldContentsMulti')
+  def testOldContentsReadTogether(self, mockGetOldContentsMulti,
+                                  mockGetOldContents):
+    mockGetOldContentsMulti.return_value = {'a.cc': 'a', 'b.cc': 'b1\nb2'}
+    change = presubmit.GitChange(
+        'mychange', '', self.fake_root_dir, [('M', 'b.cc'), ('D', 'a.cc')],
+        0, 0, None, upstream='upstream')
+    af_b, af_a = change.AffectedFiles()
+    self.assertEqual(['b1', 'b2'], af_b.OldContents())
+    self.assertEqual(['a'], af_a.OldContents())
+    self.assertEqual(['b1', 'b2'], af_b.OldContents())
+    mockGetOldContentsMulti.assert_called_once_with(
+        change.RepositoryRoot(), ['a.cc', 'b.cc'], branch='upstream',
+        max_size=presubmit._DiffCache.LARGE_BINARY_BYTES,
+        max_total_size=presubmit._DiffCache.MAX_CONTENTS_BYTES)
+    mockGetOldContents.assert_not_called()
+
+  def testDiffCacheEvictsLargeBinaryFiles(self):
+    diff_cache = presubmit._DiffCache()
+    diff_cache.MAX_CONTENTS_BYTES = 10
+    diff_cache.LARGE_BINARY_BYTES = 4
+    self.assertEqual(['abc'], diff_cache.Get('new', 'a', lambda: ['abc']))
+    diff_cache.Get('new', 'binary', lambda: ['a\0cde'])
+    diff_cache.Get('changed', 'b', lambda: [(1, 'xyz')])
+
+    # The binary file was evicted before the text files.
+    load = mock.Mock(return_value=['a\0cde'])
+    self.assertEqual(['a\0cde'], diff_cache.Get('new', 'binary', load))
+    self.assertEqual(['a\0cde'], diff_cache.Get('new', 'binary', load))
+    self.assertEqual(2, load.call_count)
+    load = mock.Mock()
+    self.assertEqual(['abc'], diff_cache.Get('new', 'a', load))
+    load.assert_not_called()
+
+    # Then the least recently used files are.
+    diff_cache.Get('new', 'c', lambda: ['abcdefg'])
+    load = mock.Mock()
+    self.assertEqual(['abc'], diff_cache.Get('new', 'a', load))
+    load.assert_not_called()
+    load = mock.Mock(return_value=[(1, 'xyz')])
+    self.assertEqual([(1, 'xyz')], diff_cache.Get('changed', 'b', load))
+    load.assert_called_once_with()
+
+    # Contents larger than the whole cache are not kept.
+    load = mock.Mock(return_value='x' * 20)
+    self.assertEqual('x' * 20, diff_cache.Get('old', 'large', load))
+    self.assertEqual('x' * 20, diff_cache.Get('old', 'large', load))
+    self.assertEqual(2, load.call_count)
+
+  def testDiffCacheEvictsLeastRecentlyUsedBinaryFile(self):
+    diff_cache = presubmit._DiffCache()
+    diff_cache.MAX_CONTENTS_BYTES = 10
+    diff_cache.LARGE_BINARY_BYTES = 4
+    diff_cache.Get('new', 'binary2', lambda: 'a\0cd')
+    diff_cache.Get('new', 'binary1', lambda: 'b\0cd')
+    diff_cache.Get('new', 'a', lambda: 'abc')
+
+    load = mock.Mock()
+    diff_cache.Get('new', 'binary1', load)
+    load.assert_not_called()
+    load = mock.Mock(return_value='a\0cd')
+    diff_cache.Get('new', 'binary2', load)
+    load.assert_called_once_with()
+
   def testIsTestableFile(self):
     files = [
         presubmit.GitAffectedFile('foo/blat.txt', 'M', self.fake_root_dir,
@@ -3189,6 +3452,90 @@ the current line as well!
         'Found line ending with white spaces in:', results[0]._message)
     self.checkstdout('')
 
+  def testPanProjectChecksSingleDiff(self):
+    change = presubmit.Change(
+        'foo1', 'description1', self.fake_root_dir, None, 1, 1, None)
+    input_api = self.MockInputApi(change, True)
+    input_api.FilterSourceFile.return_value = True
+    affected_file = mock.MagicMock(presubmit.GitAffectedFile)
+    affected_file.LocalPath.return_value = 'foo.cc'
+    contents = ['\tint a;', 'int b; ', 'DO NOT ''SUBMIT', 'x' * 200]
+    affected_file.NewContents.return_value = contents
+    affected_file.ChangedContents.return_value = list(
+        enumerate(contents, 1))
+    input_api.AffectedFiles.return_value = [affected_file]
+    input_api.AffectedSourceFiles.return_value = []
+
+    results = presubmit_canned_checks.PanProjectChecks(
+        input_api, presubmit.OutputApi, owners_check=False)
+
+    self.assertEqual(
+        ['Found lines longer than 80 characters (first 5 shown).',
+         'Found a tab character in:',
+         'Found line ending with white spaces in:',
+         'Found DO NOT ''SUBMIT in foo.cc:3'],
+        [r._message for r in results])
+    self.assertEqual(['foo.cc, line 4, 200 chars'], results[0]._items)
+    self.assertEqual('foo.cc:1', results[1]._long_text)
+    self.assertEqual('foo.cc:2', results[2]._long_text)
+    input_api.AffectedFiles.assert_called_once_with(
+        include_deletes=False, file_filter=None)
+    affected_file.NewContents.assert_called_once_with()
+    affected_file.ChangedContents.assert_called_once_with()
+
+  def testPanProjectChecksSkippedLineCheck(self):
+    change = presubmit.Change(
+        'foo1', 'description1', self.fake_root_dir, None, 0, 0, None)
+    input_api = self.MockInputApi(change, False)
+    affected_file = mock.MagicMock(presubmit.GitAffectedFile)
+    affected_file.LocalPath.return_value = 'foo.cc'
+    affected_file.NewContents.return_value = ['int a;\t ']
+    affected_file.ChangedContents.return_value = [(1, 'int a;\t ')]
+    input_api.AffectedFiles.return_value = [affected_file]
+    input_api.AffectedSourceFiles.return_value = []
+
+    with presubmit.canned_check_filter(['CheckChangeHasNoTabs']):
+      results = presubmit_canned_checks.PanProjectChecks(
+          input_api, presubmit.OutputApi, owners_check=False)
+
+    self.assertEqual(
+        ['Found line ending with white spaces in:'],
+        [r._message for r in results])
+
+  def testRunLineChecks(self):
+    change = presubmit.Change(
+        'foo1', 'description1', self.fake_root_dir, None, 0, 0, None)
+    input_api = self.MockInputApi(change, False)
+    files = []
+    for path, contents in (('a.cc', ['ok', 'TO''DO bar']),
+                           ('b.txt', ['ok']),
+                           ('c.cc', ['TO''DO(foo): bar '])):
+      affected_file = mock.MagicMock(presubmit.GitAffectedFile)
+      affected_file.LocalPath.return_value = path
+      affected_file.NewContents.return_value = contents
+      affected_file.ChangedContents.return_value = list(
+          enumerate(contents, 1))
+      files.append(affected_file)
+    input_api.AffectedFiles.return_value = files
+    cc_only = lambda f: f.LocalPath().endswith('.cc')
+
+    results = presubmit_canned_checks._RunLineChecks(input_api, [
+        presubmit_canned_checks._TodoHasOwnerCheck(
+            input_api, presubmit.OutputApi, cc_only),
+        presubmit_canned_checks._NoStrayWhitespaceCheck(
+            input_api, presubmit.OutputApi, None),
+    ])
+
+    self.assertEqual(2, len(results))
+    self.assertEqual(
+        'Found TO''DO with no owner in a.cc:2', results[0][0]._message)
+    self.assertEqual('c.cc:1', results[1][0]._long_text)
+    for f in files:
+      f.NewContents.assert_called_once_with()
+    files[0].ChangedContents.assert_called_once_with()
+    files[1].ChangedContents.assert_not_called()
+    files[2].ChangedContents.assert_called_once_with()
+
   def testCheckCIPDManifest_file(self):
     input_api = self.MockInputApi(None, False)
 
@@ -3282,6 +3629,44 @@ the current line as well!
     self.assertIsNone(commands[0].info)
 
 
+class ResultCacheTest(unittest.TestCase):
+  def setUp(self):
+    super(ResultCacheTest, self).setUp()
+    self.path = tempfile.mkdtemp()
+    self.addCleanup(gclient_utils.rmtree, self.path)
+    change = presubmit.Change(
+        'mychange', 'description', self.path, [], 0, 0, None)
+    self.cache = presubmit._ResultCache(self.path, 'base', change)
+
+  def testPutAndGet(self):
+    results = [
+        presubmit.OutputApi.PresubmitError('error', ['a', 1], 'long'),
+        presubmit.OutputApi.PresubmitPromptWarning('warning'),
+    ]
+    self.cache.Put('key', results, ['me@example.com'], False)
+    cached, more_cc = self.cache.Get('key')
+    self.assertEqual(['me@example.com'], more_cc)
+    self.assertEqual(
+        [type(r) for r in results], [type(r) for r in cached])
+    self.assertEqual(
+        [r.json_format() for r in results], [r.json_format() for r in cached])
+    self.assertIsNone(self.cache.Get('other'))
+
+  def testTrim(self):
+    for i in range(3):
+      key = 'key%d' % i
+      self.cache.Put(key, [], [], False)
+      os.utime(os.path.join(self.path, key), (i, i))
+    # Reading an entry makes it the most recently used.
+    self.assertIsNotNone(self.cache.Get('key0'))
+
+    self.cache.max_bytes = 2 * os.path.getsize(os.path.join(self.path, 'key0'))
+    self.cache.Trim()
+    self.assertIsNotNone(self.cache.Get('key0'))
+    self.assertIsNone(self.cache.Get('key1'))
+    self.assertIsNotNone(self.cache.Get('key2'))
+
+
 class ThreadPoolTest(unittest.TestCase):
   def setUp(self):
     super(ThreadPoolTest, self).setUp()
@@ -3325,6 +3710,17 @@ class ThreadPoolTest(unittest.TestCase):
       messages[1])
     self.assertEqual('5\n5 (0.00s) failed\nstdout', messages[2])
 
+  def testTimings(self):
+    subprocess.Popen.return_value = mock.Mock(returncode=0)
+    timings = presubmit._CheckTimings()
+    t = presubmit.ThreadPool(1, timings=timings)
+    t.AddTests([presubmit.CommandData(
+        name='test', cmd=['test'], kwargs={'cwd': 'dir'}, message=None)])
+    self.assertEqual([], t.RunAsync())
+    self.assertEqual(
+        [{'kind': 'command', 'name': 'test', 'path': 'dir', 'duration': 0}],
+        timings.entries)
+
 
 if __name__ == '__main__':
   import unittest
@@ -101,6 +101,44 @@ class RealGitTest(fake_repos.FakeReposTestBase):
     self.assertTrue(scm.GIT.IsValidRevision(cwd=self.cwd, rev=first_rev))
     self.assertTrue(scm.GIT.IsValidRevision(cwd=self.cwd, rev='HEAD'))
 
+  def testGetExistingCommits(self):
+    first_rev = self.githash('repo_1', 1)
+    second_rev = self.githash('repo_1', 2)
+    self.assertEqual(set(), scm.GIT.GetExistingCommits(self.cwd, []))
+    self.assertEqual(
+        {first_rev, second_rev},
+        scm.GIT.GetExistingCommits(
+            self.cwd, [first_rev, 'f' * 40, second_rev, 'zebra']))
+
+  def testGetOldContentsMulti(self):
+    first_rev = self.githash('repo_1', 1)
+    self.assertEqual({}, scm.GIT.GetOldContentsMulti(self.cwd, []))
+    contents = scm.GIT.GetOldContentsMulti(
+        self.cwd, ['DEPS', 'missing', 'origin'], branch=first_rev)
+    self.assertEqual(['DEPS', 'missing', 'origin'], sorted(contents))
+    self.assertEqual('', contents['missing'])
+    for filename in ('DEPS', 'origin'):
+      self.assertEqual(
+          scm.GIT.GetOldContents(self.cwd, filename, branch=first_rev),
+          contents[filename])
+      self.assertTrue(contents[filename])
+
+  @mock.patch('scm.GIT.CAT_FILE_CHUNK_BYTES', 100)
+  def testGetOldContentsMultiMaxSize(self):
+    first_rev = self.githash('repo_1', 1)
+    filenames = ['DEPS', 'missing', 'origin']
+    contents = scm.GIT.GetOldContentsMulti(
+        self.cwd, filenames, branch=first_rev)
+    self.assertEqual(
+        {'missing': ''},
+        scm.GIT.GetOldContentsMulti(
+            self.cwd, filenames, branch=first_rev, max_size=0))
+    self.assertEqual(
+        {'DEPS': contents['DEPS'], 'missing': ''},
+        scm.GIT.GetOldContentsMulti(
+            self.cwd, filenames, branch=first_rev,
+            max_total_size=len(contents['DEPS'])))
+
   def testIsAncestor(self):
     self.assertTrue(scm.GIT.IsAncestor(
         self.cwd, self.githash('repo_1', 1), self.githash('repo_1', 2)))
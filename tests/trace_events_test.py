@@ -0,0 +1,106 @@
+#!/usr/bin/env vpython3
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for trace_events.py."""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import subprocess2
+import trace_events
+from testing_support import trial_dir
+
+
+class TraceEventsTest(trial_dir.TestCase):
+  def setUp(self):
+    super(TraceEventsTest, self).setUp()
+    self.path = os.path.join(self.root_dir, 'trace.json')
+    self.addCleanup(self._reset)
+
+  @staticmethod
+  def _reset():
+    trace_events._path = None
+    del trace_events._events[:]
+    del trace_events._child_files[:]
+
+  def _load(self):
+    trace_events.save()
+    with open(self.path) as f:
+      return [e for e in json.load(f)['traceEvents'] if e['ph'] == 'X']
+
+  def testDisabled(self):
+    with trace_events.span('name', 'cat') as span:
+      span.args['key'] = 'value'
+    trace_events.complete('name', 'cat', 0)
+    trace_events.save()
+    self.assertEqual([], trace_events._events)
+    self.assertFalse(os.path.exists(self.path))
+
+  def testSpans(self):
+    trace_events.start(self.path)
+    with trace_events.span('outer', 'cat', key='value') as span:
+      span.args['more'] = 1
+      trace_events.complete('inner', 'other', 10, 12.5)
+    with self.assertRaises(ValueError):
+      with trace_events.span('failed', 'cat'):
+        raise ValueError()
+
+    events = self._load()
+    self.assertEqual(['inner', 'outer', 'failed'], [e['name'] for e in events])
+    self.assertEqual(
+        ('other', 10000000, 2500000), (
+            events[0]['cat'], events[0]['ts'], events[0]['dur']))
+    self.assertEqual({'key': 'value', 'more': 1}, events[1]['args'])
+    self.assertEqual({'error': 'ValueError'}, events[2]['args'])
+
+  def testTraced(self):
+    @trace_events.traced('cat')
+    def function(value):
+      return value * 2
+
+    trace_events.start(self.path)
+    self.assertEqual(4, function(2))
+    self.assertEqual(['function'], [e['name'] for e in self._load()])
+
+  def testSubprocess(self):
+    trace_events.start(self.path)
+    subprocess2.check_output([sys.executable, '-c', 'print(1)'])
+    events = self._load()
+    self.assertEqual(1, len(events))
+    self.assertEqual('subprocess', events[0]['cat'])
+    self.assertEqual(0, events[0]['args']['returncode'])
+    self.assertIn('print(1)', events[0]['args']['cmd'])
+
+  def testSubprocessBytesArgs(self):
+    trace_events.start(self.path)
+    proc = subprocess2.Popen(
+        [sys.executable.encode('utf-8'), b'-c', b'print(1)'],
+        stdout=subprocess2.VOID)
+    self.assertEqual(0, proc.wait(timeout=60))
+    events = self._load()
+    self.assertEqual(1, len(events))
+    self.assertEqual(
+        os.path.basename(sys.executable) + ' -c', events[0]['name'])
+    self.assertIn('print(1)', events[0]['args']['cmd'])
+
+  def testChildTraceFile(self):
+    trace_events.start(self.path)
+    child = trace_events.child_trace_file()
+    unused = trace_events.child_trace_file()
+    with open(child, 'w') as f:
+      json.dump({'traceEvents': [
+          {'name': 'child', 'ph': 'X', 'ts': 1, 'dur': 1, 'pid': 1, 'tid': 1}
+      ]}, f)
+    self.assertEqual(['child'], [e['name'] for e in self._load()])
+    self.assertFalse(os.path.exists(child))
+    self.assertFalse(os.path.exists(unused))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,168 @@
+# Copyright 2020 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Records where the wall time of a command goes, in Chrome trace format.
+
+Tracing is off until start() is called, typically because of --trace-file.
+Spans are then recorded in memory and written when the process exits, in a
+JSON file that can be loaded in chrome://tracing or https://ui.perfetto.dev.
+When tracing is off, span() and complete() cost a single check.
+
+Child processes that support --trace-file can be given the path returned by
+child_trace_file(); their events are merged into the parent's file.
+"""
+
+from __future__ import print_function
+
+import atexit
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+_lock = threading.Lock()
+_path = None
+_events = []
+_child_files = []
+
+
+def enabled():
+  return _path is not None
+
+
+def start(path):
+  """Starts recording events, to be written to |path| on exit."""
+  global _path
+  with _lock:
+    if _path is None:
+      atexit.register(save)
+    _path = os.path.abspath(path)
+
+
+def _micros(seconds):
+  return int(seconds * 1e6)
+
+
+def complete(name, category, start_time, end_time=None, **args):
+  """Records a span which started at |start_time|, as given by time.time()."""
+  if _path is None:
+    return
+  if end_time is None:
+    end_time = time.time()
+  event = {
+      'name': name,
+      'cat': category,
+      'ph': 'X',
+      'ts': _micros(start_time),
+      'dur': _micros(end_time - start_time),
+      'pid': os.getpid(),
+      'tid': threading.current_thread().ident,
+      'args': args,
+  }
+  with _lock:
+    _events.append(event)
+
+
+class _Span(object):
+  def __init__(self, name, category, args):
+    self.name = name
+    self.category = category
+    self.args = args
+    self.start = None
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, _exc_value, _traceback):
+    if exc_type is not None:
+      self.args['error'] = exc_type.__name__
+    complete(self.name, self.category, self.start, **self.args)
+
+
+class _NullSpan(object):
+  @property
+  def args(self):
+    return {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, _exc_type, _exc_value, _traceback):
+    pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, category, **args):
+  """Returns a context manager recording its body as a span.
+
+  Extra arguments are shown with the span. More can be added to the 'args'
+  dict of the returned object while the span is open.
+  """
+  if _path is None:
+    return _NULL_SPAN
+  return _Span(name, category, args)
+
+
+def traced(category, name=None):
+  """Decorates a function so that each of its calls is recorded as a span."""
+  def decorator(function):
+    span_name = name or function.__name__
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      with span(span_name, category):
+        return function(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def child_trace_file():
+  """Returns a path for a child process to write its trace to."""
+  fd, path = tempfile.mkstemp(prefix='trace_', suffix='.json')
+  os.close(fd)
+  with _lock:
+    _child_files.append(path)
+  return path
+
+
+def _thread_names():
+  names = {}
+  for thread in threading.enumerate():
+    names[thread.ident] = thread.name
+  return names
+
+
+def save():
+  """Writes the events recorded so far, and those of the children."""
+  if _path is None:
+    return
+  with _lock:
+    events = list(_events)
+    child_files = list(_child_files)
+  names = _thread_names()
+  for tid in sorted(set(e['tid'] for e in events if e['tid'] in names)):
+    events.append({
+        'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+        'args': {'name': names[tid]},
+    })
+  for path in child_files:
+    try:
+      with open(path) as f:
+        events.extend(json.load(f).get('traceEvents', []))
+    except (IOError, OSError, ValueError) as e:
+      if os.path.exists(path) and os.path.getsize(path):
+        logging.warning('Ignoring unreadable trace %s: %s', path, e)
+    finally:
+      if os.path.exists(path):
+        os.remove(path)
+  with _lock:
+    _child_files[:] = []
+  with open(_path, 'w') as f:
+    json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)